@@ -0,0 +1,98 @@
+"""Rolling-window aggregates behind the dashboard and analysis metrics
+
+Each window keeps a running sum and count of the entries in its last `days`
+days, plus monotonic deques whose fronts are the window's minimum and maximum.
+Logging an entry and letting a day roll over both cost O(1) amortized, so the
+metrics never rescan the history.
+"""
+import time
+from collections import deque
+
+from records import SECONDS_PER_DAY, record_time
+
+# Value field and window lengths (in days) maintained for each collection
+WINDOWS = {
+    'mood_data': ('mood_value', [7, 30]),
+    'sleep_data': ('hours', [7, 30]),
+    'activities': ('duration', [7]),
+}
+
+
+class RollingWindow:
+    """Sum, count, minimum and maximum of the values dated in the last `days` days"""
+
+    def __init__(self, days):
+        self.span = days * SECONDS_PER_DAY
+        self.total = 0
+        self.count = 0
+        self._entries = deque()
+        self._mins = deque()
+        self._maxs = deque()
+        self._next_id = 0
+
+    def add(self, when, value):
+        """Add a value dated at a Unix timestamp; entries are expected in date order"""
+        entry = (self._next_id, when, value)
+        self._next_id += 1
+        self._entries.append(entry)
+        self.total += value
+        self.count += 1
+        # Entries dominated by the new value can never be the min (or max) again
+        while self._mins and self._mins[-1][2] >= value:
+            self._mins.pop()
+        self._mins.append(entry)
+        while self._maxs and self._maxs[-1][2] <= value:
+            self._maxs.pop()
+        self._maxs.append(entry)
+
+    def advance(self, now):
+        """Drop the entries that fell out of the window by the Unix timestamp `now`"""
+        cutoff = now - self.span
+        while self._entries and self._entries[0][1] <= cutoff:
+            entry_id, _, value = self._entries.popleft()
+            self.total -= value
+            self.count -= 1
+            if self._mins[0][0] == entry_id:
+                self._mins.popleft()
+            if self._maxs[0][0] == entry_id:
+                self._maxs.popleft()
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def min(self):
+        return self._mins[0][2] if self._mins else None
+
+    def max(self):
+        return self._maxs[0][2] if self._maxs else None
+
+
+class AggregateEngine:
+    def __init__(self):
+        self.windows = {
+            (collection, days): RollingWindow(days)
+            for collection, (_, lengths) in WINDOWS.items()
+            for days in lengths
+        }
+
+    def rebuild(self, collection, records):
+        """Reset a collection's windows from its records of the longest window, in date order"""
+        for days in WINDOWS[collection][1]:
+            self.windows[(collection, days)] = RollingWindow(days)
+        for record in records:
+            self.add(collection, record)
+
+    def add(self, collection, record):
+        """Count a newly logged record in its collection's windows"""
+        if collection not in WINDOWS:
+            return
+        field, lengths = WINDOWS[collection]
+        when = record_time(collection, record)
+        for days in lengths:
+            self.windows[(collection, days)].add(when, record[field])
+
+    def window(self, collection, days, now=None):
+        """The window of a collection, advanced to `now`"""
+        window = self.windows[(collection, days)]
+        window.advance(now or time.time())
+        return window
@@ -0,0 +1,119 @@
+"""Analytics behind the insights, statistics and reports, free of any Streamlit calls
+
+Functions take plain data (a dataset in the data file layout, or frames and
+aggregates built from one) and return plain results, so they run the same in a
+UI session, in the benchmarks and in the nightly batch reports.
+"""
+import time
+from datetime import datetime
+
+from aggregates import WINDOWS, AggregateEngine
+from columnar import ColumnarStore
+from impact import mood_impact
+from records import SECONDS_PER_DAY, zone
+from rollups import ROLLUPS, RollupEngine
+
+
+def as_store(data):
+    """Columnar store for a dataset, or the store itself if one is given"""
+    if isinstance(data, ColumnarStore):
+        return data
+    return ColumnarStore.from_data(data)
+
+
+def build_aggregates(store, now=None):
+    """Rolling-window aggregates of a store as of the Unix timestamp `now`"""
+    now = now or time.time()
+    engine = AggregateEngine()
+    for collection, (_, lengths) in WINDOWS.items():
+        engine.rebuild(collection, store.since(collection, now - max(lengths) * SECONDS_PER_DAY))
+    return engine
+
+
+def build_rollups(store):
+    """Day, week and month rollups of a store"""
+    engine = RollupEngine()
+    for collection in ROLLUPS:
+        engine.rebuild(collection, store.frame(collection))
+    return engine
+
+
+def window_statistics(aggregates, now=None):
+    """Dashboard and analysis statistics; values are None for empty windows"""
+    now = now or time.time()
+    mood_7 = aggregates.window('mood_data', 7, now)
+    mood_30 = aggregates.window('mood_data', 30, now)
+    sleep_7 = aggregates.window('sleep_data', 7, now)
+    sleep_30 = aggregates.window('sleep_data', 30, now)
+    return {
+        'avg_mood_7d': mood_7.mean(),
+        'avg_mood_30d': mood_30.mean(),
+        'highest_mood_30d': mood_30.max(),
+        'lowest_mood_30d': mood_30.min(),
+        'avg_sleep_7d': sleep_7.mean(),
+        'avg_sleep_30d': sleep_30.mean(),
+        'least_sleep_30d': sleep_30.min(),
+        'activities_7d': aggregates.window('activities', 7, now).count,
+    }
+
+
+def insights(statistics, activities_df):
+    """Personalized suggestions from window statistics and the activity history"""
+    insights = []
+
+    # Analyze mood trends over the last 30 days
+    avg_mood = statistics['avg_mood_30d']
+    if avg_mood is not None:
+        if avg_mood < 3:
+            insights.append("Your mood has been lower than average. Consider scheduling activities that bring you joy or speaking with a mental health professional.")
+        elif avg_mood >= 4:
+            insights.append("Great job! Your mood has been consistently positive.")
+
+    avg_sleep = statistics['avg_sleep_30d']
+    if avg_sleep is not None:
+        if avg_sleep < 7:
+            insights.append("You're getting less than the recommended 7-9 hours of sleep. Try to maintain a consistent sleep schedule.")
+        elif avg_sleep > 9:
+            insights.append("You're getting more than average sleep. If you feel tired despite this, consider checking your sleep quality.")
+
+    if not activities_df.empty:
+        activity_counts = activities_df['activity'].value_counts()
+
+        if len(activity_counts) < 3:
+            insights.append("Consider diversifying your activities to maintain better mental health.")
+
+        if 'Exercise' in activity_counts and activity_counts['Exercise'] > 3:
+            insights.append("Great job maintaining regular exercise! This is excellent for mental health.")
+
+    if not insights:
+        insights.append("Start logging more data to receive personalized insights!")
+
+    return insights
+
+
+def mood_correlations(mood_df, activities_df):
+    """Same-day and next-day mood effect of each activity, or None without data"""
+    return mood_impact(mood_df, activities_df)
+
+
+def weekly_mood(rollups):
+    """Average mood per week with entries"""
+    weekly = rollups.table('mood_data', 'week')
+    return weekly[['date', 'mean']].rename(columns={'mean': 'mood_value'})
+
+
+def report(data, now=None):
+    """Insights, statistics and weekly mood averages of one user's data, as plain JSON types"""
+    now = now or time.time()
+    store = as_store(data)
+    statistics = window_statistics(build_aggregates(store, now), now)
+    weekly = weekly_mood(build_rollups(store))
+    return {
+        'generated': datetime.fromtimestamp(now, zone(store.timezone)).isoformat(timespec='seconds'),
+        'statistics': statistics,
+        'insights': insights(statistics, store.frame('activities')),
+        'weekly_mood': [
+            {'week': week.strftime("%Y-%m-%d"), 'mood_value': round(float(value), 3)}
+            for week, value in zip(weekly['date'], weekly['mood_value'])
+        ],
+    }
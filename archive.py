@@ -0,0 +1,242 @@
+"""Compressed monthly archive segments for records older than the hot window
+
+Nearly every view reads recent records only: the 7- and 30-day statistics,
+the recent tables, the tracking pages. So whenever the record log is folded
+into the data file, the records of whole months that ended before the hot
+window (MHT_HOT_DAYS days, default 90; 0 keeps everything in the data file)
+move out of it into segments next to it:
+
+    users/<user id>/mental_health_data.archive/2024-03-<id>.json.gz
+
+A segment is the gzip-compressed data file layout of one month's records and
+is never modified after it is written. A record logged later for an archived
+month goes into another segment of that month at the next fold. The data file
+lists its segments and their record counts under ``_archive``, so the counts
+of the whole history are known without reading any segment. Segments that are
+not listed, such as those of an interrupted fold, are removed at the next one.
+
+Sessions load only the hot data file. Long-range charts and reports read the
+segments on demand through ``RecordLog.load_archive``; exports and the search
+index page through them one segment at a time with ``History``. Users who
+have not logged enough for a fold are archived with
+
+    python archive.py [USER ...]
+"""
+import argparse
+import bisect
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date
+
+import profiling
+from records import FIELDS, SECONDS_PER_DAY, day_timestamp, empty_data, from_timestamp
+
+DEFAULT_HOT_DAYS = 90
+
+# The hot window holds at least the 30-day statistics
+MIN_HOT_DAYS = 31
+
+SEGMENT_SUFFIX = '.json.gz'
+
+
+def hot_days():
+    """Days of records kept in the data file, or 0 when nothing is archived"""
+    days = int(os.environ.get("MHT_HOT_DAYS", DEFAULT_HOT_DAYS))
+    if 0 < days < MIN_HOT_DAYS or days < 0:
+        raise ValueError(f"Invalid MHT_HOT_DAYS: {days}. Must be 0 or at least {MIN_HOT_DAYS}")
+    return days
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def next_month(day):
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def split(data, days, now=None):
+    """Hot data and the records of each month that ended `days` days before `now`, by month
+
+    Months are "YYYY-MM" in the data's timezone.
+    """
+    timezone = data['timezone']
+    first_hot = month_start(from_timestamp((now or time.time()) - days * SECONDS_PER_DAY, timezone))
+    boundary = day_timestamp(first_hot, timezone)
+    hot = dict(data)
+    archived = {}
+    for collection, fields in FIELDS.items():
+        records = data.get(collection, [])
+        old = [record for record in records if record[fields[0]] < boundary]
+        if not old:
+            continue
+        hot[collection] = [record for record in records if record[fields[0]] >= boundary]
+        # Start timestamps of every month from the oldest record on, to find each record's month
+        month = month_start(from_timestamp(min(record[fields[0]] for record in old), timezone))
+        months, starts = [], []
+        while month < first_hot:
+            months.append(month.strftime('%Y-%m'))
+            starts.append(day_timestamp(month, timezone))
+            month = next_month(month)
+        for record in old:
+            label = months[bisect.bisect_right(starts, record[fields[0]]) - 1]
+            archived.setdefault(label, {}).setdefault(collection, []).append(record)
+    return hot, archived
+
+
+def write_segment(directory, month, records):
+    """Write a new segment of one month's records; returns its file name"""
+    os.makedirs(directory, exist_ok=True)
+    name = f"{month}-{uuid.uuid4().hex[:12]}{SEGMENT_SUFFIX}"
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            with gzip.GzipFile(fileobj=f, mode='wb') as compressed:
+                compressed.write(json.dumps(records).encode())
+            f.flush()
+            os.fsync(f.fileno())
+            profiling.count(bytes_written=f.tell())
+        os.replace(tmp_path, os.path.join(directory, name))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return name
+
+
+def read_segment(directory, name):
+    """Records of a segment, by collection"""
+    path = os.path.join(directory, name)
+    with open(path, 'rb') as f:
+        raw = f.read()
+    profiling.count(bytes_read=len(raw))
+    return json.loads(gzip.decompress(raw))
+
+
+def read_segments(directory, listing, timezone):
+    """Data file layout of every listed segment, oldest month first"""
+    data = empty_data(timezone)
+    for name in sorted(listing):
+        for collection, records in read_segment(directory, name).items():
+            data[collection].extend(records)
+    return data
+
+
+def archived_counts(listing):
+    """Archived records per collection"""
+    counts = dict.fromkeys(FIELDS, 0)
+    for segment in listing.values():
+        for collection, count in segment.items():
+            counts[collection] += count
+    return counts
+
+
+class History:
+    """A user's whole history read like one columnar store, archived records first
+
+    Rows are numbered through the listed segments, oldest month first, and
+    then on through the hot store. Records are read one segment at a time, so
+    paging through the history, as exports and the search index do, never
+    holds more than a month of the archive.
+    """
+
+    def __init__(self, directory, listing, hot):
+        self.directory = directory
+        self.hot = hot
+        self.timezone = hot.timezone
+        self.segments = sorted(listing.items())
+        self.archived = archived_counts(listing)
+
+    def count(self, collection):
+        """Number of records in a collection"""
+        return self.archived.get(collection, 0) + self.hot.count(collection)
+
+    def records(self, collection, rows=None):
+        """Records of a collection as dicts, optionally only the given row numbers in their order"""
+        rows = range(self.count(collection)) if rows is None else list(rows)
+        archived = self.archived.get(collection, 0)
+        names, starts = [], []
+        start = 0
+        for name, counts in self.segments:
+            if counts.get(collection):
+                names.append(name)
+                starts.append(start)
+                start += counts[collection]
+        hot = iter(self.hot.records(collection, [row - archived for row in rows if row >= archived]))
+        result = []
+        # Only the segment of the last archived row is kept, so rows in order read each segment once
+        segment, records = None, None
+        for row in rows:
+            if row >= archived:
+                result.append(next(hot))
+                continue
+            index = bisect.bisect_right(starts, row) - 1
+            if index != segment:
+                segment, records = index, read_segment(self.directory, names[index])[collection]
+            result.append(records[row - starts[index]])
+        return result
+
+    def chunks(self, collection, chunk_size):
+        """Records of a collection as dicts, `chunk_size` at a time"""
+        chunk = []
+        for name, counts in self.segments:
+            if not counts.get(collection):
+                continue
+            for record in read_segment(self.directory, name)[collection]:
+                chunk.append(record)
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+        for records in self.hot.chunks(collection, chunk_size):
+            for record in records:
+                chunk.append(record)
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+
+def remove_unlisted(directory, listing):
+    """Delete the segments and temporary files a data file does not list"""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name not in listing:
+            os.remove(os.path.join(directory, name))
+
+
+def main(argv=None):
+    # The record log imports this module, so the storage modules are imported here
+    from storage import data_dir, open_store, user_data_file
+    parser = argparse.ArgumentParser(description="Move records older than the hot window into archive segments.")
+    parser.add_argument("users", nargs="*", help="user ids (default: every user)")
+    parser.add_argument("--data-dir", default=None, help="data directory (default: MHT_DATA_DIR or ./data)")
+    args = parser.parse_args(argv)
+
+    root = args.data_dir or data_dir()
+    users = args.users
+    if not users:
+        users_dir = os.path.join(root, 'users')
+        users = sorted(os.listdir(users_dir)) if os.path.isdir(users_dir) else []
+    try:
+        days = hot_days()
+        for user_id in users:
+            moved = open_store(user_data_file(user_id, root), "json").archive_months()
+            print(f"{user_id}: {sum(moved.values()):,} records moved to the archive")
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    if not days:
+        print("MHT_HOT_DAYS is 0; nothing was archived")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""Nightly batch reports for every user shard, without launching the UI
+
+    python batch_reports.py --output reports --workers 8
+
+Each user's data is loaded and analyzed on a process pool, and the report is
+written to ``<output>/<user id>.json``.
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import analytics
+from storage import data_dir, open_user_store
+
+
+def user_ids(root):
+    """User ids with a shard under the data directory"""
+    users_dir = os.path.join(root, 'users')
+    if not os.path.isdir(users_dir):
+        return []
+    return sorted(name for name in os.listdir(users_dir)
+                  if os.path.isdir(os.path.join(users_dir, name)))
+
+
+def report_user(user_id, root, output):
+    """Write one user's report; returns the user id and an error message or None"""
+    try:
+        data = open_user_store(user_id, root=root).load()
+        with open(os.path.join(output, f"{user_id}.json"), 'w') as f:
+            json.dump(analytics.report(data), f)
+    except Exception as e:
+        return user_id, f"{type(e).__name__}: {e}"
+    return user_id, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write insights and weekly reports for every user.")
+    parser.add_argument("--data-dir", default=None, help="data directory (default: MHT_DATA_DIR or ./data)")
+    parser.add_argument("--output", default="reports", help="directory for the report files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    args = parser.parse_args(argv)
+
+    root = args.data_dir or data_dir()
+    os.makedirs(args.output, exist_ok=True)
+    users = user_ids(root)
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        results = pool.map(report_user, users, [root] * len(users), [args.output] * len(users),
+                           chunksize=max(1, len(users) // (4 * (args.workers or 1))))
+        for user_id, error in results:
+            if error:
+                failed += 1
+                print(f"{user_id}: {error}", file=sys.stderr)
+    print(f"Wrote {len(users) - failed} of {len(users)} reports to {args.output}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+"""Headless benchmarks for the tracker
+
+Run from the repository root:
+
+    python -m benchmarks.run --sizes 10000 100000 1000000 --output bench.json
+"""
@@ -0,0 +1,205 @@
+"""Time the tracker's data paths on synthetic histories, outside a Streamlit server
+
+Results are written as JSON so runs of different versions can be compared.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import streamlit as st
+
+from benchmarks.synthetic import generate
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+BENCH_USER = "bench"
+
+# Pages timed from a cold start: one that only logs records, one with charts and frames
+STARTUP_PAGES = ["Track Mood", "Dashboard"]
+
+
+class SessionState(dict):
+    """Attribute-style dict standing in for st.session_state outside a server"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    def __delattr__(self, name):
+        del self[name]
+
+
+def install_session_state():
+    """Swap st.session_state for a plain stub and import the app against it"""
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    st.session_state = SessionState()
+    import mhtall
+    mhtall.init_session_state()
+    return mhtall
+
+
+def timed(function, repeat):
+    """Wall times in seconds of `repeat` calls of a function"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def benchmark_size(mhtall, size, repeat):
+    """Run every benchmark on a synthetic history of `size` records"""
+    from load_cache import load_cache
+    from storage import user_data_file
+
+    data_file = user_data_file(BENCH_USER)
+    os.makedirs(os.path.dirname(data_file), exist_ok=True)
+    with open(data_file, 'w') as f:
+        json.dump(generate(size), f)
+
+    def fresh_app():
+        mhtall.reset_user_state(BENCH_USER)
+        app = mhtall.MentalHealthApp(BENCH_USER)
+        app.store.wait_for_compaction()
+        return app
+
+    def cold_load():
+        load_cache.clear()
+        fresh_app().load_data()
+
+    app = fresh_app()
+    app.load_data()
+    record = {"date": int(time.time()), "mood": "Good", "mood_value": 4, "notes": ""}
+
+    def append():
+        app.save_data('mood_data', record)
+
+    def frames():
+        # Everything show_dashboard and show_analysis build from the history
+        st.session_state.frame_cache.bump_all()
+        for collection in ('mood_data', 'sleep_data', 'activities', 'journal_entries', 'goals'):
+            app.frame(collection)
+        app.chart_frame('mood_data', 'mood_value', "lttb")
+        app.chart_frame('sleep_data', 'hours')
+        app.rebuild_aggregates(['mood_data', 'sleep_data', 'activities'])
+
+    def charts_built():
+        # New versions miss the figure cache, as after logging to every collection
+        st.session_state.frame_cache.bump_all()
+        app.show_analysis()
+
+    benchmarks = [
+        ("load_data_cold", cold_load),
+        ("load_data_warm", app.load_data),
+        ("save_data_append", append),
+        ("save_data_snapshot", app.save_data),
+        ("dashboard_analysis_frames", frames),
+        ("analysis_charts_built", charts_built),
+        ("analysis_charts_cached", app.show_analysis),
+        ("generate_insights", app.generate_insights),
+        ("analyze_mood_correlations", app.analyze_mood_correlations),
+        ("generate_weekly_report", app.generate_weekly_report),
+    ]
+    results = []
+    for name, function in benchmarks:
+        times = timed(function, repeat)
+        results.append({
+            "benchmark": name,
+            "size": size,
+            "seconds": times,
+            "best": min(times),
+            "median": statistics.median(times),
+        })
+        print(f"{size:>9} {name:<28} best {min(times):.4f}s", file=sys.stderr)
+    app.store.wait_for_compaction()
+    results.extend(startup_results(size, repeat))
+    return results
+
+
+def startup_results(size, repeat):
+    """Import and first-render times of a fresh interpreter per page and run"""
+    results = []
+    for page in STARTUP_PAGES:
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, "-m", "benchmarks.startup", page],
+                                    capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output))
+        for measure in ("import_seconds", "first_render_seconds"):
+            times = [run[measure] for run in runs]
+            name = f"{measure[:-len('_seconds')]}:{page}"
+            results.append({
+                "benchmark": name,
+                "size": size,
+                "seconds": times,
+                "best": min(times),
+                "median": statistics.median(times),
+                "heavy_modules": runs[-1]["heavy_modules_after_render"],
+                "write_only": runs[-1]["write_only"],
+            })
+            print(f"{size:>9} {name:<28} best {min(times):.4f}s", file=sys.stderr)
+    return results
+
+
+def heavy_startups(results):
+    """Write-only pages whose cold start pulled in heavy analytics or plotting modules"""
+    return sorted({result["benchmark"] for result in results
+                   if result.get("write_only") and result["heavy_modules"]})
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="total records per synthetic history")
+    parser.add_argument("--repeat", type=int, default=3, help="timed calls per benchmark")
+    parser.add_argument("--output", help="JSON results file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "started": datetime.now().isoformat(timespec='seconds'),
+        "results": [],
+    }
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.environ["MHT_DATA_DIR"] = data_dir
+        mhtall = install_session_state()
+        for size in args.sizes:
+            report["results"].extend(benchmark_size(mhtall, size, args.repeat))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    heavy = heavy_startups(report["results"])
+    if heavy:
+        print(f"Heavy modules imported on a cold start of {', '.join(heavy)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""Cold start of the app in a fresh interpreter: import, then the first render of one page
+
+    python -m benchmarks.startup "Track Mood"
+
+Prints JSON with the seconds spent importing the app and rendering the page
+for the first time, and the heavy analytics and plotting modules loaded by
+then. ``benchmarks.run`` starts one process per page, so every measurement is
+a cold start.
+"""
+import json
+import sys
+import time
+
+# Modules that only pages with charts or frames should pull in
+HEAVY_MODULES = ['pandas', 'plotly.express', 'analytics', 'impact']
+
+
+def heavy_modules():
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        sys.exit('usage: python -m benchmarks.startup PAGE')
+    page = argv[0]
+
+    # Streamlit itself is imported here, outside the app's own import time
+    from benchmarks.run import BENCH_USER, install_session_state
+    start = time.perf_counter()
+    mhtall = install_session_state()
+    imported = time.perf_counter()
+    imported_modules = heavy_modules()
+
+    app = mhtall.MentalHealthApp(BENCH_USER)
+    app.render(page)
+    rendered = time.perf_counter()
+
+    json.dump({
+        'page': page,
+        'import_seconds': imported - start,
+        'first_render_seconds': rendered - imported,
+        'heavy_modules_after_import': imported_modules,
+        'heavy_modules_after_render': heavy_modules(),
+        'write_only': page in mhtall.WRITE_ONLY_PAGES,
+    }, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Synthetic histories in the tracker's data file layout"""
+import random
+import time
+
+from records import SECONDS_PER_DAY, day_timestamp, empty_data, from_timestamp
+
+MOODS = {"Excellent": 5, "Good": 4, "Neutral": 3, "Low": 2, "Very Low": 1}
+ACTIVITIES = ["Exercise", "Meditation", "Reading", "Socializing", "Therapy"]
+SLEEP_QUALITIES = ["Poor", "Fair", "Good", "Excellent"]
+WORDS = ["calm", "tired", "walk", "work", "family", "friends", "rain", "sun", "stress", "rest",
+         "anxious", "happy", "coffee", "run", "music", "book", "call", "dinner", "park", "sleep"]
+
+# Share of the records that goes to each collection
+SHARES = {'mood_data': 0.4, 'activities': 0.3, 'sleep_data': 0.2, 'journal_entries': 0.1}
+
+
+def generate(size, end=None, seed=0):
+    """A dataset of about `size` mood, activity, sleep and journal records ending at the Unix timestamp `end`"""
+    rng = random.Random(seed)
+    end = int(end or time.time())
+    data = empty_data()
+    for collection, share in SHARES.items():
+        count = max(1, int(size * share))
+        # Sleep and journal entries are daily, mood and activities several times a day
+        daily = collection in ('sleep_data', 'journal_entries')
+        step = SECONDS_PER_DAY if daily else 4 * 60 * 60
+        start = end - step * count
+        for i in range(count):
+            when = start + step * i
+            if daily:
+                when = day_timestamp(from_timestamp(when, data['timezone']), data['timezone'])
+            data[collection].append(_record(collection, when, rng))
+    data['custom_tags'] = ["work", "family"]
+    return data
+
+
+def _text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _record(collection, when, rng):
+    if collection == 'mood_data':
+        mood = rng.choice(list(MOODS))
+        return {"date": when, "mood": mood,
+                "mood_value": MOODS[mood], "notes": _text(rng, rng.randint(0, 8))}
+    if collection == 'activities':
+        return {"date": when, "activity": rng.choice(ACTIVITIES),
+                "duration": rng.randrange(5, 155, 5)}
+    if collection == 'sleep_data':
+        return {"date": when, "hours": rng.randrange(8, 21) / 2,
+                "quality": rng.choice(SLEEP_QUALITIES)}
+    return {"date": when, "title": _text(rng, 3),
+            "content": _text(rng, rng.randint(20, 80))}
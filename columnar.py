@@ -0,0 +1,313 @@
+"""Compact columnar in-memory store for the tracked collections
+
+Records are kept as NumPy columns instead of lists of dicts: dates as int64
+Unix timestamps, small numbers in narrow integer or float32 columns,
+repeated labels (mood, activity, sleep quality, goal type) as category codes,
+and free text (notes, journal titles and content) as indexes into a shared
+string table. Columns grow by doubling and never change their filled prefix,
+so frames built from them can share their memory. Frames show the dates as
+wall-clock times in the store's timezone.
+"""
+import sys
+
+import numpy as np
+
+from records import COLLECTIONS, empty_data, local_timezone
+
+# Storage kind of every field; "timestamp" columns hold dates
+SCHEMA = {
+    'mood_data': {'date': 'timestamp', 'mood': 'category', 'mood_value': np.int8, 'notes': 'text'},
+    'activities': {'date': 'timestamp', 'activity': 'category', 'duration': np.int16},
+    'sleep_data': {'date': 'timestamp', 'hours': np.float32, 'quality': 'category'},
+    'goals': {'created_date': 'timestamp', 'type': 'category', 'target': np.int64, 'deadline': 'timestamp'},
+    'journal_entries': {'date': 'timestamp', 'title': 'text', 'content': 'text'},
+}
+
+
+def wall_times(timestamps, timezone):
+    """Naive datetime64 wall-clock times in `timezone` of an array of Unix timestamps"""
+    import pandas as pd
+    times = pd.DatetimeIndex(np.asarray(timestamps, dtype=np.int64).astype('datetime64[s]'))
+    return times.tz_localize('UTC').tz_convert(timezone).tz_localize(None).to_numpy()
+
+
+def join_frames(collection, older, newer):
+    """One frame of a collection from two of its typed frames, sorted by date"""
+    import pandas as pd
+    df = pd.concat([older, newer], ignore_index=True)
+    for field, kind in SCHEMA[collection].items():
+        if kind == 'category':
+            # Frames of different stores have different categories
+            df[field] = df[field].astype('category')
+    date_field = next(iter(SCHEMA[collection]))
+    if not df[date_field].is_monotonic_increasing:
+        df = df.sort_values(date_field, kind='stable', ignore_index=True)
+    return df
+
+
+class Column:
+    """Growable NumPy array"""
+
+    def __init__(self, dtype, capacity=64):
+        self._data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self._data):
+            grown = np.empty(2 * len(self._data), dtype=self._data.dtype)
+            grown[:self.size] = self._data
+            self._data = grown
+        self._data[self.size] = value
+        self.size += 1
+
+    def values(self):
+        """View of the filled part of the column"""
+        return self._data[:self.size]
+
+    def load(self, values):
+        """Replace the column's contents with a copy of an array"""
+        self._data = np.array(values, dtype=self._data.dtype)
+        if not len(self._data):
+            self._data = np.empty(64, dtype=self._data.dtype)
+        self.size = len(values)
+
+
+class Labels:
+    """Interned labels and their codes"""
+
+    def __init__(self, labels=None):
+        self.labels = list(labels or [])
+        # Built on first use, so bulk-loaded tables only pay for it when appended to
+        self._codes = None
+
+    def code(self, label):
+        if self._codes is None:
+            self._codes = {label: code for code, label in enumerate(self.labels)}
+        if label not in self._codes:
+            self._codes[label] = len(self.labels)
+            self.labels.append(label)
+        return self._codes[label]
+
+
+class ColumnarStore:
+    def __init__(self, timezone=None):
+        self.timezone = timezone or local_timezone()
+        self.strings = Labels()
+        self.custom_tags = []
+        self._columns = {}
+        self._labels = {}
+        self._sorted = {}
+        # Row numbers and dates in date order of unsorted collections, built when first paged
+        self._order = {}
+        for collection, fields in SCHEMA.items():
+            self._columns[collection] = {}
+            self._sorted[collection] = True
+            for field, kind in fields.items():
+                if kind == 'timestamp':
+                    self._columns[collection][field] = Column(np.int64)
+                elif kind in ('category', 'text'):
+                    self._columns[collection][field] = Column(np.int32)
+                    if kind == 'category':
+                        self._labels[(collection, field)] = Labels()
+                else:
+                    self._columns[collection][field] = Column(kind)
+
+    @classmethod
+    def from_data(cls, data):
+        """Build a store from a dataset in the data file layout"""
+        store = cls(data.get('timezone'))
+        store.extend(data)
+        return store
+
+    def extend(self, data):
+        """Append the records of a dataset in the data file layout"""
+        for collection in SCHEMA:
+            for record in data.get(collection, []):
+                self.append(collection, record)
+        self.custom_tags.extend(data.get('custom_tags', []))
+
+    def append(self, collection, record):
+        """Append one record of a collection"""
+        if collection == 'custom_tags':
+            self.custom_tags.append(record)
+            return
+        columns = self._columns[collection]
+        date_field = next(iter(columns))
+        row = self.count(collection)
+        if row and record[date_field] < columns[date_field].values()[-1]:
+            self._sorted[collection] = False
+        for field, kind in SCHEMA[collection].items():
+            value = record.get(field)
+            if kind == 'category':
+                value = self._labels[(collection, field)].code(value)
+            elif kind == 'text':
+                value = self.strings.code(value or "")
+            columns[field].append(value)
+        if collection in self._order:
+            self._insert_order(collection, row, record[date_field])
+
+    def copy(self):
+        """Independent copy of the store"""
+        store = ColumnarStore(self.timezone)
+        store.strings = Labels(self.strings.labels)
+        store.custom_tags = list(self.custom_tags)
+        for collection, fields in SCHEMA.items():
+            columns = {field: self.column(collection, field) for field in fields}
+            labels = {field: self.labels(collection, field) for field, kind in fields.items()
+                      if kind == 'category'}
+            store.load_columns(collection, columns, labels, self.is_sorted(collection))
+        return store
+
+    def nbytes(self):
+        """Approximate memory held by the store"""
+        total = sum(sys.getsizeof(text) for text in self.strings.labels)
+        for columns in self._columns.values():
+            total += sum(column._data.nbytes for column in columns.values())
+        return total
+
+    def column(self, collection, field):
+        """View of the stored values (labels and text as codes) of a field"""
+        return self._columns[collection][field].values()
+
+    def labels(self, collection, field):
+        """Labels behind the codes of a category field"""
+        return self._labels[(collection, field)].labels
+
+    def is_sorted(self, collection):
+        """Whether a collection's records were appended in date order"""
+        return self._sorted[collection]
+
+    def load_columns(self, collection, columns, labels, is_sorted):
+        """Replace a collection with whole columns of stored values and category labels"""
+        for field, values in columns.items():
+            self._columns[collection][field].load(values)
+        for field, field_labels in labels.items():
+            self._labels[(collection, field)] = Labels(field_labels)
+        self._sorted[collection] = is_sorted
+        self._order.pop(collection, None)
+
+    def count(self, collection):
+        """Number of records in a collection"""
+        if collection == 'custom_tags':
+            return len(self.custom_tags)
+        return next(iter(self._columns[collection].values())).size
+
+    def since(self, collection, start):
+        """Records of a collection dated after the Unix timestamp `start`, in date order"""
+        date_field = next(iter(SCHEMA[collection]))
+        timestamps = self._columns[collection][date_field].values()
+        if self._sorted[collection]:
+            rows = range(np.searchsorted(timestamps, start, side='right'), len(timestamps))
+        else:
+            rows = np.flatnonzero(timestamps > start)
+            rows = rows[np.argsort(timestamps[rows], kind='stable')]
+        return self.records(collection, rows)
+
+    def recent(self, collection, limit, before=None):
+        """Row numbers of up to `limit` records, newest first
+
+        Records are ordered by date, then by row number. `before` is the
+        (timestamp, row) key of the last record of a previous page; the page
+        continues right after it, so records appended meanwhile never shift
+        it. Sorted collections are paged by position; unsorted ones through
+        an index of the date order that appends keep current.
+        """
+        if self._sorted[collection]:
+            end = self.count(collection) if before is None else min(before[1], self.count(collection))
+            return np.arange(end - 1, max(end - limit, 0) - 1, -1)
+        rows, dates = (column.values() for column in self._date_order(collection))
+        end = len(rows)
+        if before is not None:
+            timestamp, row = before
+            start = np.searchsorted(dates, timestamp, side='left')
+            stop = np.searchsorted(dates, timestamp, side='right')
+            # Records of the same date are in row order
+            end = start + np.searchsorted(rows[start:stop], row)
+        return rows[max(end - limit, 0):end][::-1]
+
+    def records(self, collection, rows=None):
+        """Records of a collection as dicts, optionally only the given row numbers"""
+        if collection == 'custom_tags':
+            return list(self.custom_tags)
+        if rows is None:
+            rows = range(self.count(collection))
+        columns = {field: column.values() for field, column in self._columns[collection].items()}
+        result = []
+        for row in rows:
+            record = {}
+            for field, kind in SCHEMA[collection].items():
+                value = columns[field][row]
+                if kind == 'category':
+                    value = self._labels[(collection, field)].labels[value]
+                elif kind == 'text':
+                    value = self.strings.labels[value]
+                elif kind == np.float32:
+                    # float32 keeps about 7 significant digits
+                    value = round(float(value), 4)
+                else:
+                    value = int(value)
+                record[field] = value
+            result.append(record)
+        return result
+
+    def chunks(self, collection, chunk_size):
+        """Records of a collection as dicts, `chunk_size` at a time"""
+        total = self.count(collection)
+        for start in range(0, total, chunk_size):
+            yield self.records(collection, range(start, min(start + chunk_size, total)))
+
+    def to_data(self):
+        """The whole store in the data file layout"""
+        data = empty_data(self.timezone)
+        for collection in COLLECTIONS:
+            data[collection] = self.records(collection)
+        return data
+
+    def frame(self, collection, rows=None):
+        """Typed DataFrame of a collection sorted by date, or of some row numbers in their order
+
+        Numeric columns share the store's memory; dates are converted to
+        wall-clock datetime64 in one vectorized step and labels become pandas
+        categoricals.
+        """
+        import pandas as pd
+        columns = {}
+        for field, kind in SCHEMA[collection].items():
+            values = self._columns[collection][field].values()
+            if rows is not None:
+                values = values[rows]
+            if kind == 'timestamp':
+                columns[field] = wall_times(values, self.timezone)
+            elif kind == 'category':
+                labels = self._labels[(collection, field)].labels
+                columns[field] = pd.Categorical.from_codes(values, categories=pd.Index(labels, dtype=object))
+            elif kind == 'text' and rows is not None:
+                columns[field] = np.array([self.strings.labels[code] for code in values], dtype=object)
+            elif kind == 'text':
+                columns[field] = np.array(self.strings.labels, dtype=object)[values]
+            else:
+                columns[field] = values
+        df = pd.DataFrame(columns, copy=False)
+        if rows is None and not self._sorted[collection]:
+            df = df.sort_values(next(iter(SCHEMA[collection])), kind='stable', ignore_index=True)
+        return df
+
+    def _date_order(self, collection):
+        if collection not in self._order:
+            dates = self.column(collection, next(iter(SCHEMA[collection])))
+            rows = np.argsort(dates, kind='stable')
+            order = (Column(np.int64), Column(np.int64))
+            order[0].load(rows)
+            order[1].load(dates[rows])
+            self._order[collection] = order
+        return self._order[collection]
+
+    def _insert_order(self, collection, row, timestamp):
+        rows, dates = self._order[collection]
+        position = np.searchsorted(dates.values(), timestamp, side='right')
+        if position == dates.size:
+            rows.append(row)
+            dates.append(timestamp)
+        else:
+            rows.load(np.insert(rows.values(), position, row))
+            dates.load(np.insert(dates.values(), position, timestamp))
@@ -0,0 +1,61 @@
+"""Downsampling of long series before they are sent to the browser as charts
+
+A series longer than the chart's point budget is either averaged into the
+finest calendar bucket (day, week or month) that fits the budget, or reduced
+with largest-triangle-three-buckets (LTTB), which keeps the points that shape
+the visible line.
+"""
+import numpy as np
+
+# Point budgets for desktop and mobile charts
+MAX_POINTS = 1000
+MOBILE_POINTS = 300
+
+# Calendar buckets tried from finest to coarsest, with their length in days
+BUCKETS = [('D', 1), ('W', 7), ('MS', 31)]
+
+VALID_METHODS = {"resample", "lttb"}
+
+
+def lttb(x, y, threshold):
+    """Indexes of the points kept by largest-triangle-three-buckets"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # The first and last points are always kept; the rest is split into buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end:edges[i + 2]].mean()
+            next_y = y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        # Keep the point forming the largest triangle with the previously kept
+        # point and the average of the next bucket
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(area.argmax())
+        keep[i + 1] = previous
+    return keep
+
+
+def downsample(df, x, y, max_points=MAX_POINTS, method="resample"):
+    """Reduce a frame sorted by `x` to at most `max_points` chart points"""
+    if method not in VALID_METHODS:
+        raise ValueError(f"Invalid downsampling method: {method}. Must be one of {VALID_METHODS}")
+    if len(df) <= max_points:
+        return df
+    if method == "resample":
+        span_days = (df[x].iloc[-1] - df[x].iloc[0]).days + 1
+        for freq, days in BUCKETS:
+            if span_days / days <= max_points:
+                return df.resample(freq, on=x)[y].mean().dropna().reset_index()
+        # Histories with more months than the budget fall back to LTTB
+    keep = lttb(df[x].to_numpy().astype('datetime64[s]').astype(np.int64), df[y].to_numpy(), max_points)
+    return df.iloc[keep]
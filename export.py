@@ -0,0 +1,106 @@
+"""Streaming export of the tracked collections into a zip archive
+
+Every table is serialized on its own worker thread, `CHUNK_SIZE` records at a
+time, into a spooled temporary file that moves to disk once it outgrows
+`SPOOL_SIZE`. Memory per table therefore stays bounded however long the
+history is. The finished tables are then copied into one zip archive, which
+is offered to the browser as a download rather than left on the server.
+Dates are written as wall-clock times in the data's timezone.
+"""
+import csv
+import io
+import json
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from records import DATE_FIELDS, DATE_FORMATS, FIELDS, format_timestamp
+
+# File extension of each export format
+EXPORT_FORMATS = {"CSV": "csv", "JSON": "json", "EXCEL": "xlsx"}
+
+CHUNK_SIZE = 5000
+SPOOL_SIZE = 1024 * 1024
+
+
+def export_archive(store, export_format, chunk_size=CHUNK_SIZE):
+    """Serialize every collection of a columnar store and return a rewound zip file object"""
+    format_upper = export_format.upper()
+    if format_upper not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid export format: {export_format}. Must be one of {set(EXPORT_FORMATS)}")
+
+    with ThreadPoolExecutor(max_workers=len(FIELDS)) as pool:
+        futures = {
+            collection: pool.submit(_serialize, store, collection, format_upper, chunk_size)
+            for collection in FIELDS
+        }
+        tables = {collection: future.result() for collection, future in futures.items()}
+
+    archive = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for collection, table in tables.items():
+            with table, zf.open(f"{collection}.{EXPORT_FORMATS[format_upper]}", 'w') as member:
+                shutil.copyfileobj(table, member)
+    archive.seek(0)
+    return archive
+
+
+def _serialize(store, collection, format_upper, chunk_size):
+    table = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    chunks = _readable_dates(store.chunks(collection, chunk_size), collection, store.timezone)
+    if format_upper == "CSV":
+        _write_csv(table, collection, chunks)
+    elif format_upper == "JSON":
+        _write_json(table, chunks)
+    elif format_upper == "EXCEL":
+        _write_excel(table, collection, chunks)
+    table.seek(0)
+    return table
+
+
+def _readable_dates(chunks, collection, timezone):
+    date_format = DATE_FORMATS[collection]
+    for chunk in chunks:
+        for record in chunk:
+            for field in DATE_FIELDS[collection]:
+                record[field] = format_timestamp(record[field], timezone, date_format)
+        yield chunk
+
+
+def _write_csv(table, collection, chunks):
+    text = io.TextIOWrapper(table, encoding='utf-8', newline='')
+    writer = csv.DictWriter(text, fieldnames=FIELDS[collection])
+    writer.writeheader()
+    for chunk in chunks:
+        writer.writerows(chunk)
+    text.flush()
+    # Keep the underlying file open for the archive step
+    text.detach()
+
+
+def _write_json(table, chunks):
+    # A JSON array of records, the same layout as DataFrame.to_json(orient="records")
+    table.write(b'[')
+    first = True
+    for chunk in chunks:
+        for record in chunk:
+            if not first:
+                table.write(b',')
+            table.write(json.dumps(record).encode('utf-8'))
+            first = False
+    table.write(b']')
+
+
+def _write_excel(table, collection, chunks):
+    from openpyxl import Workbook
+
+    # Write-only workbooks stream rows instead of keeping the sheet in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(collection)
+    fields = FIELDS[collection]
+    sheet.append(fields)
+    for chunk in chunks:
+        for record in chunk:
+            sheet.append([record.get(field) for field in fields])
+    workbook.save(table)
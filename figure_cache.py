@@ -0,0 +1,76 @@
+"""Cache of built Plotly figures, keyed on the data and layout they were built from
+
+Every rerun used to rebuild each chart with plotly express, which groups,
+validates and serializes its frame even when nothing changed. The cache keeps
+each chart's figure as its serialized JSON spec, under a key made of the chart's
+name, the versions of the collections it reads (see ``frame_cache``) and its
+layout parameters. A rerun with the same key turns the spec back into a figure
+without validating it again, which costs a small fraction of building it.
+
+Specs of outdated versions are not removed; they age out of the cache, which
+evicts the least recently used specs once it holds more than
+MHT_FIGURE_CACHE_MB megabytes of them.
+"""
+import json
+import os
+from collections import OrderedDict
+
+DEFAULT_CAP_MB = 16
+
+
+class FigureCache:
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get("MHT_FIGURE_CACHE_MB", DEFAULT_CAP_MB)) * 2**20)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._specs = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key, build):
+        """Figure of a key, from its cached spec or built by `build()`"""
+        import plotly.graph_objects as go
+        import plotly.io as pio
+        spec = self._specs.get(key)
+        if spec is not None:
+            self._specs.move_to_end(key)
+            self.hits += 1
+            # The spec was validated when the figure was first built
+            return go.Figure(json.loads(spec), _validate=False)
+        self.misses += 1
+        fig = build()
+        self.put(key, pio.to_json(fig, validate=False))
+        return fig
+
+    def put(self, key, spec):
+        """Store a spec under a key, evicting the least recently used ones over the cap"""
+        self._discard(key)
+        if len(spec) > self.max_bytes:
+            return
+        self._specs[key] = spec
+        self._bytes += len(spec)
+        while self._bytes > self.max_bytes:
+            self._discard(next(iter(self._specs)))
+            self.evictions += 1
+
+    def clear(self):
+        self._specs.clear()
+        self._bytes = 0
+
+    def stats(self):
+        """Hit, miss and eviction counters plus the current size of the cache"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._specs),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+    def _discard(self, key):
+        spec = self._specs.pop(key, None)
+        if spec is not None:
+            self._bytes -= len(spec)
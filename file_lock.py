@@ -0,0 +1,42 @@
+"""Advisory file locks for the per-user data shards"""
+import contextlib
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows; the locks do nothing there, so a shard must not be
+    # shared by several server processes
+    fcntl = None
+
+
+@contextlib.contextmanager
+def file_lock(path, shared=False, blocking=True):
+    """Hold an advisory lock on `path`.lock, yielding False if a non-blocking lock is busy
+
+    Exclusive locks are taken to write, and create the directory of `path` if
+    needed. A shared lock in a missing directory locks nothing, as there is
+    nothing to read yet.
+    """
+    directory = os.path.dirname(path) or '.'
+    if not os.path.isdir(directory):
+        if shared:
+            yield True
+            return
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.lock', 'a') as f:
+        if fcntl is None:
+            yield True
+            return
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(f, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,32 @@
+"""Versioned DataFrame cache for the tracked collections
+
+Every collection has a version counter that is bumped whenever a record is
+appended to it. A collection's frame is built once per version; every later
+request for the same version gets the cached frame. Cached frames are shared
+between callers and must not be modified in place.
+"""
+from records import FIELDS
+
+
+class FrameCache:
+    def __init__(self):
+        self.versions = {}
+        self._frames = {}
+
+    def bump(self, collection):
+        """Mark a collection as changed"""
+        self.versions[collection] = self.versions.get(collection, 0) + 1
+
+    def bump_all(self):
+        """Mark every collection as changed"""
+        for collection in FIELDS:
+            self.bump(collection)
+
+    def get(self, collection, store):
+        """Frame for the current version of a collection in a columnar store"""
+        version = self.versions.get(collection, 0)
+        cached = self._frames.get(collection)
+        if cached is None or cached[0] != version:
+            cached = (version, store.frame(collection))
+            self._frames[collection] = cached
+        return cached[1]
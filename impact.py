@@ -0,0 +1,95 @@
+"""Vectorized activity-to-mood impact engine
+
+Activities are folded into a day x activity matrix of counts and minutes, and
+moods into a mean mood per day. Each activity's effect is the difference in
+mean mood between days with and without it (same day), and between days
+following a day with and without it (next day), with a normal-approximation
+confidence interval on that difference (Welch's standard error). Everything is
+a handful of NumPy operations over the whole matrix, however many days and
+custom activity names there are.
+"""
+import numpy as np
+import pandas as pd
+
+# z value of a two-sided 95% confidence interval
+Z_95 = 1.96
+
+
+def day_numbers(dates):
+    """Days since the epoch of a datetime64 column"""
+    return dates.to_numpy().astype('datetime64[D]').astype(np.int64)
+
+
+def activity_matrix(activities_df, first_day, n_days):
+    """Activity names plus day x activity matrices of counts and minutes"""
+    codes, names = pd.factorize(activities_df['activity'])
+    cells = (day_numbers(activities_df['date']) - first_day) * len(names) + codes
+    shape = (n_days, len(names))
+    counts = np.bincount(cells, minlength=n_days * len(names)).reshape(shape)
+    minutes = np.bincount(cells, weights=activities_df['duration'].to_numpy(),
+                          minlength=n_days * len(names)).reshape(shape)
+    return list(names), counts, minutes
+
+
+def daily_mood(mood_df, first_day, n_days):
+    """Mean mood of each day, NaN on days without a mood entry"""
+    days = day_numbers(mood_df['date']) - first_day
+    totals = np.bincount(days, weights=mood_df['mood_value'].to_numpy(), minlength=n_days)
+    counts = np.bincount(days, minlength=n_days)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return totals / counts
+
+
+def mood_difference(mood, present, z=Z_95):
+    """Mean mood with minus without each activity, and its confidence interval
+
+    `mood` holds one value per day and `present` says which activities
+    happened on (or before) that day.
+    """
+    present = present.astype(np.float64)
+    n_with = present.sum(axis=0)
+    n_without = len(mood) - n_with
+    sum_with = mood @ present
+    squares_with = (mood * mood) @ present
+    sum_without = mood.sum() - sum_with
+    squares_without = (mood * mood).sum() - squares_with
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_with = sum_with / n_with
+        mean_without = sum_without / n_without
+        var_with = np.clip(squares_with - n_with * mean_with ** 2, 0, None) / (n_with - 1)
+        var_without = np.clip(squares_without - n_without * mean_without ** 2, 0, None) / (n_without - 1)
+        half_width = z * np.sqrt(var_with / n_with + var_without / n_without)
+    effect = mean_with - mean_without
+    return effect, effect - half_width, effect + half_width
+
+
+def mood_impact(mood_df, activities_df, z=Z_95):
+    """Same-day and next-day mood effect of every activity, with confidence intervals"""
+    if mood_df.empty or activities_df.empty:
+        return None
+    mood_days = day_numbers(mood_df['date'])
+    activity_days = day_numbers(activities_df['date'])
+    first_day = min(mood_days.min(), activity_days.min())
+    n_days = max(mood_days.max(), activity_days.max()) - first_day + 1
+
+    names, counts, minutes = activity_matrix(activities_df, first_day, n_days)
+    mood = daily_mood(mood_df, first_day, n_days)
+    present = counts > 0
+    has_mood = ~np.isnan(mood)
+
+    same_day = mood_difference(mood[has_mood], present[has_mood], z)
+    # Activity on day d against mood on day d + 1
+    next_has_mood = has_mood[1:]
+    next_day = mood_difference(mood[1:][next_has_mood], present[:-1][next_has_mood], z)
+
+    return pd.DataFrame({
+        'activity': names,
+        'days': present.sum(axis=0),
+        'total_minutes': minutes.sum(axis=0),
+        'same_day_effect': same_day[0],
+        'same_day_low': same_day[1],
+        'same_day_high': same_day[2],
+        'next_day_effect': next_day[0],
+        'next_day_low': next_day[1],
+        'next_day_high': next_day[2],
+    })
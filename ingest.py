@@ -0,0 +1,269 @@
+"""Bulk import of mood, activity and sleep records from CSV or JSON-lines files
+
+    python ingest.py sleep.csv workouts.jsonl --user alice
+    python ingest.py export.csv --type sleep --chunk-size 20000
+
+Every row is one record. Its ``type`` column (mood, activity or sleep) names
+the collection it goes to, unless ``--type`` sets one for the whole file. The
+other columns are the fields the tracking pages log:
+
+    mood       date, mood_value (1-5) and/or mood (Excellent ... Very Low), notes
+    activity   date, activity, duration (minutes)
+    sleep      date, hours, quality (Poor, Fair, Good, Excellent)
+
+Dates are Unix timestamps or ISO 8601 times; times without an offset are read
+in the timezone of the user's data. Sleep is kept by day, as on the Track
+Sleep page. Rows breaking the rules of the tracking widgets are skipped and
+reported, and so are rows whose (date, type) is already stored or appeared
+earlier in the import.
+
+Files are read and written in chunks: each chunk becomes one batched write per
+collection, so memory stays bounded by the chunk size plus the sorted dates
+(8 bytes per record) kept for duplicate detection. The record log is folded
+into the data file once, after the last chunk.
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfoNotFoundError
+
+import numpy as np
+
+from columnar import ColumnarStore
+from load_cache import load_cache
+from records import (DURATION_RANGE, MOOD_SCALE, SLEEP_HOURS_RANGE, SLEEP_QUALITIES, day_timestamp,
+                     from_timestamp, to_timestamp, zone)
+from storage import DEFAULT_USER, open_user_store, pipeline
+
+# Row types and the collections they go to; the collection names work as types too
+TYPES = {'mood': 'mood_data', 'activity': 'activities', 'sleep': 'sleep_data'}
+
+FORMATS = {'csv', 'jsonl'}
+
+DEFAULT_CHUNK_SIZE = 50000
+
+# Invalid rows reported one by one before only counting them
+MAX_REPORTED = 20
+
+MOOD_LABELS = {label.lower(): label for label in MOOD_SCALE}
+MOOD_VALUES = {value: label for label, value in MOOD_SCALE.items()}
+QUALITY_LABELS = {label.lower(): label for label in SLEEP_QUALITIES}
+
+# Timestamps that fit the int64 date columns and read back as dates in every timezone
+TIMESTAMP_RANGE = (to_timestamp(datetime(1, 1, 2), 'UTC'), to_timestamp(datetime(9999, 12, 30), 'UTC'))
+
+
+def row_type(row, default=None):
+    """Collection a row belongs to"""
+    value = str(row.get('type') or default or '').strip().lower()
+    collection = TYPES.get(value, value)
+    if collection not in TYPES.values():
+        raise ValueError(f"Invalid type: {value!r}. Must be one of {set(TYPES)}")
+    return collection
+
+
+def parse_date(value, timezone):
+    """Unix timestamp of a Unix time or an ISO 8601 time"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        timestamp = value
+    else:
+        text = str(value or '').strip()
+        try:
+            timestamp = float(text)
+        except ValueError:
+            try:
+                timestamp = to_timestamp(datetime.fromisoformat(text), timezone)
+            except (OverflowError, ValueError):
+                raise ValueError(f"Invalid date: {text!r}. "
+                                 "Must be a Unix timestamp or an ISO 8601 time") from None
+    # Also rejects infinite and NaN timestamps
+    if not TIMESTAMP_RANGE[0] <= timestamp <= TIMESTAMP_RANGE[1]:
+        raise ValueError(f"Invalid date: {value!r}. Must be within the years 1 to 9999")
+    return int(timestamp)
+
+
+def parse_number(row, field):
+    value = row.get(field)
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {field}: {value!r}. Must be a number") from None
+    if not np.isfinite(number):
+        raise ValueError(f"Invalid {field}: {value!r}. Must be a number")
+    return number
+
+
+def parse_row(collection, row, timezone):
+    """Record of one row, checked against the rules of the tracking pages"""
+    date = parse_date(row.get('date'), timezone)
+    if collection == 'mood_data':
+        mood = None
+        if row.get('mood') not in (None, ''):
+            mood = MOOD_LABELS.get(str(row['mood']).strip().lower())
+            if mood is None:
+                raise ValueError(f"Invalid mood: {row['mood']!r}. Must be one of {set(MOOD_SCALE)}")
+        if row.get('mood_value') not in (None, '') or mood is None:
+            value = parse_number(row, 'mood_value')
+            if value not in MOOD_VALUES:
+                raise ValueError(f"Invalid mood_value: {row.get('mood_value')!r}. Must be one of {set(MOOD_VALUES)}")
+            if mood is not None and MOOD_SCALE[mood] != value:
+                raise ValueError(f"Invalid mood_value: {row['mood_value']!r}. Must match the mood {mood!r}")
+            mood = MOOD_VALUES[value]
+        return {'date': date, 'mood': mood, 'mood_value': MOOD_SCALE[mood], 'notes': str(row.get('notes') or '')}
+    if collection == 'activities':
+        activity = str(row.get('activity') or '').strip()
+        if not activity:
+            raise ValueError("Invalid activity: ''. Must not be empty")
+        duration = parse_number(row, 'duration')
+        if not DURATION_RANGE[0] <= duration <= DURATION_RANGE[1] or duration != int(duration):
+            raise ValueError(f"Invalid duration: {row['duration']!r}. "
+                             f"Must be whole minutes from {DURATION_RANGE[0]} to {DURATION_RANGE[1]}")
+        return {'date': date, 'activity': activity, 'duration': int(duration)}
+    hours = parse_number(row, 'hours')
+    if not SLEEP_HOURS_RANGE[0] <= hours <= SLEEP_HOURS_RANGE[1]:
+        raise ValueError(f"Invalid hours: {row['hours']!r}. "
+                         f"Must be from {SLEEP_HOURS_RANGE[0]} to {SLEEP_HOURS_RANGE[1]}")
+    quality = QUALITY_LABELS.get(str(row.get('quality') or '').strip().lower())
+    if quality is None:
+        raise ValueError(f"Invalid quality: {row.get('quality')!r}. Must be one of {set(SLEEP_QUALITIES)}")
+    day = day_timestamp(from_timestamp(date, timezone), timezone)
+    return {'date': day, 'hours': hours, 'quality': quality}
+
+
+def read_rows(path, file_format):
+    """(line number, row dict) of every row of a file"""
+    with open(path, 'r', newline='') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            # Lines that are not JSON objects are reported as invalid rows
+            yield number, row if isinstance(row, dict) else None
+
+
+def chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Dates:
+    """Sorted dates already stored per collection, for duplicate detection"""
+
+    def __init__(self, stores):
+        self.dates = {collection: np.sort(np.concatenate([store.column(collection, 'date') for store in stores]))
+                      for collection in TYPES.values()}
+
+    def new(self, collection, records):
+        """Records whose date is neither stored nor earlier in `records`"""
+        dates = np.array([record['date'] for record in records], dtype=np.int64)
+        _, first = np.unique(dates, return_index=True)
+        keep = np.zeros(len(dates), dtype=bool)
+        keep[first] = True
+        keep &= ~np.isin(dates, self.dates[collection])
+        self.dates[collection] = np.union1d(self.dates[collection], dates[keep])
+        return [record for record, kept in zip(records, keep) if kept]
+
+
+def stored_data(store):
+    """Columnar copies of what a store holds, its archive included"""
+    if hasattr(store, 'load_store'):
+        stored, settings = store.load_store()
+        stores = [stored]
+        if settings['_archive']:
+            stores.append(store.load_archive(settings['_archive'], stored.timezone))
+        # Nothing else in the importer's process reads the cached copies again
+        load_cache.clear()
+        return stores
+    return [ColumnarStore.from_data(store.load())]
+
+
+def ingest(paths, store, file_type=None, file_format=None, chunk_size=DEFAULT_CHUNK_SIZE, timezone=None,
+           progress=sys.stderr):
+    """Import files into a store; returns the counts of rows read, imported, duplicate and invalid"""
+    stored = stored_data(store)
+    timezone = timezone or stored[0].timezone
+    dates = Dates(stored)
+    # Only the sorted dates are needed from here on, not the stored history
+    del stored
+    counts = dict.fromkeys(['read', 'imported', 'duplicates', 'invalid'], 0)
+    started = time.perf_counter()
+    for path in paths:
+        kind = file_format or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        if kind not in FORMATS:
+            raise ValueError(f"Invalid format: {kind}. Must be one of {FORMATS}")
+        for chunk in chunks(read_rows(path, kind), chunk_size):
+            batches = {}
+            for line, row in chunk:
+                try:
+                    if row is None:
+                        raise ValueError("Invalid row: not a JSON object")
+                    collection = row_type(row, file_type)
+                    batches.setdefault(collection, []).append(parse_row(collection, row, timezone))
+                except ValueError as e:
+                    counts['invalid'] += 1
+                    if counts['invalid'] <= MAX_REPORTED:
+                        print(f"{path}:{line}: {e}", file=progress)
+            counts['read'] += len(chunk)
+            # The chunk's batches go to the storage service in one round trip
+            with pipeline(store) as writer:
+                for collection, records in batches.items():
+                    new = dates.new(collection, sorted(records, key=lambda record: record['date']))
+                    counts['duplicates'] += len(records) - len(new)
+                    if new:
+                        writer.append_many(collection, new)
+                        counts['imported'] += len(new)
+            rate = counts['read'] / max(time.perf_counter() - started, 1e-9)
+            print(f"{path}: {counts['read']:,} rows read, {counts['imported']:,} imported, "
+                  f"{counts['duplicates']:,} duplicates, {counts['invalid']:,} invalid "
+                  f"({rate:,.0f} rows/s)", file=progress)
+    if counts['imported'] and hasattr(store, 'compact'):
+        print("Folding the record log into the data file", file=progress)
+        store.compact(background=False)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import mood, activity and sleep records in bulk.")
+    parser.add_argument("files", nargs="+", help="CSV or JSON-lines files")
+    parser.add_argument("--user", default=DEFAULT_USER, help="user id to import into")
+    parser.add_argument("--data-dir", default=None, help="data directory (default: MHT_DATA_DIR or ./data)")
+    parser.add_argument("--backend", default=None, help="storage backend (default: MHT_STORAGE_BACKEND or json)")
+    parser.add_argument("--type", choices=sorted(TYPES), help="record type of rows without a type column")
+    parser.add_argument("--format", choices=sorted(FORMATS), help="file format (default: from the extension)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per batch")
+    parser.add_argument("--timezone", default=None, help="timezone of dates without an offset "
+                                                         "(default: the data's)")
+    args = parser.parse_args(argv)
+
+    try:
+        store = open_user_store(args.user, args.backend, args.data_dir)
+        if args.timezone:
+            zone(args.timezone)
+        counts = ingest(args.files, store, args.type, args.format, max(1, args.chunk_size), args.timezone)
+    except (OSError, ValueError, ZoneInfoNotFoundError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    print(f"Imported {counts['imported']:,} of {counts['read']:,} rows; "
+          f"skipped {counts['duplicates']:,} duplicates and {counts['invalid']:,} invalid rows")
+    return 1 if counts['invalid'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
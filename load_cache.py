@@ -0,0 +1,94 @@
+"""Process-wide cache of loaded data files
+
+Streamlit reruns the script, and with it ``load_data``, on every widget
+interaction. The cache keeps each data file's last loaded value together with
+the identity (mtime, size, inode) of the files it was read from, so a rerun
+with nothing changed on disk is served from memory, and every session of the
+same user shares one loaded copy. Values are shared, so callers must not
+modify them.
+
+The cache is bounded by an approximate memory cap, set in megabytes with the
+MHT_LOAD_CACHE_MB environment variable, and evicts the least recently used
+files first.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_CAP_MB = 256
+
+
+def file_identity(path):
+    """(mtime, size, inode) of a file, or None when it does not exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class LoadCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, identity, load, size):
+        """Cached value of a key if its identity still matches, else `load()`"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == identity:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = load()
+        self.put(key, identity, value, size(value))
+        return value
+
+    def peek(self, key):
+        """Cached value of a key whatever it was loaded from, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None else None
+
+    def put(self, key, identity, value, nbytes):
+        """Store a value under a key, evicting the least recently used ones over the cap"""
+        with self._lock:
+            self._discard(key)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (identity, value, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Hit, miss and eviction counters plus the current size of the cache"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+
+load_cache = LoadCache(int(float(os.environ.get("MHT_LOAD_CACHE_MB", DEFAULT_CAP_MB)) * 2**20))
@@ -1,41 +1,43 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-from datetime import datetime
-import json
+import time
 
-# Initialize session state variables
-if 'mood_data' not in st.session_state:
-    st.session_state.mood_data = []
-if 'activities' not in st.session_state:
-    st.session_state.activities = []
-if 'sleep_data' not in st.session_state:
-    st.session_state.sleep_data = []
+from columnar import wall_times
+from records import day_timestamp, today
+from storage import DEFAULT_USER, open_user_store
+
+def init_session_state():
+    """Initialize session state variables"""
+    if 'mood_data' not in st.session_state:
+        st.session_state.mood_data = []
+    if 'activities' not in st.session_state:
+        st.session_state.activities = []
+    if 'sleep_data' not in st.session_state:
+        st.session_state.sleep_data = []
 
 class MentalHealthApp:
     def __init__(self):
-        pass
+        self.store = open_user_store(DEFAULT_USER)
 
-    def save_data(self):
-        """Save data to JSON file"""
-        data = {
-            'mood_data': st.session_state.mood_data,
-            'activities': st.session_state.activities,
-            'sleep_data': st.session_state.sleep_data
-        }
-        with open('mental_health_data.json', 'w') as f:
-            json.dump(data, f)
+    def save_data(self, collection=None, record=None):
+        """Store a new record, or save everything when no record is given"""
+        if collection is None:
+            data = self.store.load()
+            data.update({
+                'mood_data': st.session_state.mood_data,
+                'activities': st.session_state.activities,
+                'sleep_data': st.session_state.sleep_data
+            })
+            self.store.write_snapshot(data)
+        else:
+            self.store.append(collection, record)
 
     def load_data(self):
-        """Load data from JSON file"""
-        try:
-            with open('mental_health_data.json', 'r') as f:
-                data = json.load(f)
-                st.session_state.mood_data = data.get('mood_data', [])
-                st.session_state.activities = data.get('activities', [])
-                st.session_state.sleep_data = data.get('sleep_data', [])
-        except FileNotFoundError:
-            pass
+        """Load data from the configured storage backend"""
+        data = self.store.load()
+        st.session_state.mood_data = data['mood_data']
+        st.session_state.activities = data['activities']
+        st.session_state.sleep_data = data['sleep_data']
+        st.session_state.timezone = data['timezone']
 
     def main_page(self):
         """Main page layout"""
@@ -44,6 +46,9 @@ class MentalHealthApp:
         # Sidebar navigation
         page = st.sidebar.radio("**:rainbow[Navigate]**", 
             ["Dashboard", "Track Mood", "Track Activities", "Track Sleep", "Analysis & Insights"])
+        # Logging a mood needs none of the stored data
+        if page != "Track Mood":
+            self.load_data()
         
         if page == "Dashboard":
             self.show_dashboard()
@@ -81,17 +86,18 @@ class MentalHealthApp:
         
         if st.button("Log Mood"):
             mood_entry = {
-                "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
+                "date": int(time.time()),
                 "mood": mood,
                 "mood_value": mood_scale[mood],
                 "notes": notes
             }
             st.session_state.mood_data.append(mood_entry)
-            self.save_data()
+            self.save_data('mood_data', mood_entry)
             st.success("Mood logged successfully!")
 
     def track_activities(self):
         """Activity tracking interface"""
+        import pandas as pd
         st.subheader("Track Your Activities")
         
         activities = ["Exercise", "Meditation", "Reading", "Socializing", "Therapy", "Other"]
@@ -112,19 +118,19 @@ class MentalHealthApp:
         
         if st.button("Log Activity"):
             activity_entry = {
-                "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
+                "date": int(time.time()),
                 "activity": activity,
                 "duration": duration
             }
             st.session_state.activities.append(activity_entry)
-            self.save_data()
+            self.save_data('activities', activity_entry)
             st.success("Activity logged successfully!")
 
         # Display recent activities
         if st.session_state.activities:
             st.subheader("Recent Activities")
             activities_df = pd.DataFrame(st.session_state.activities)
-            activities_df['date'] = pd.to_datetime(activities_df['date'])
+            activities_df['date'] = wall_times(activities_df['date'], st.session_state.timezone)
             activities_df = activities_df.sort_values('date', ascending=False)
             st.dataframe(activities_df)
 
@@ -149,19 +155,21 @@ class MentalHealthApp:
             
         if st.button("Log Sleep"):
             sleep_entry = {
-                "date": datetime.now().strftime("%Y-%m-%d"),
+                "date": day_timestamp(today(st.session_state.timezone), st.session_state.timezone),
                 "hours": sleep_hours,
                 "quality": sleep_quality
             }
             st.session_state.sleep_data.append(sleep_entry)
-            self.save_data()
+            self.save_data('sleep_data', sleep_entry)
             st.success("Sleep data logged successfully!")
 
     def plot_mood_trend(self):
         """Plot mood trend visualization"""
+        import pandas as pd
+        import plotly.express as px
         if st.session_state.mood_data:
             df = pd.DataFrame(st.session_state.mood_data)
-            df['date'] = pd.to_datetime(df['date'])
+            df['date'] = wall_times(df['date'], st.session_state.timezone)
             
             fig = px.line(df, x='date', y='mood_value', 
                          title='Mood Trend Over Time',
@@ -172,9 +180,11 @@ class MentalHealthApp:
 
     def plot_sleep_pattern(self):
         """Plot sleep pattern visualization"""
+        import pandas as pd
+        import plotly.express as px
         if st.session_state.sleep_data:
             df = pd.DataFrame(st.session_state.sleep_data)
-            df['date'] = pd.to_datetime(df['date'])
+            df['date'] = wall_times(df['date'], st.session_state.timezone)
             
             fig = px.bar(df, x='date', y='hours',
                         title='Sleep Pattern',
@@ -185,6 +195,7 @@ class MentalHealthApp:
 
     def show_dashboard(self):
         """Display dashboard with overview of all metrics"""
+        import pandas as pd
         st.subheader("Your Wellness Dashboard")
         
         # Summary metrics
@@ -219,6 +230,7 @@ class MentalHealthApp:
 
     def show_analysis(self):
         """Show analysis and insights"""
+        import pandas as pd
         st.subheader("Analysis & Insights")
         
         if st.session_state.mood_data:
@@ -238,6 +250,7 @@ class MentalHealthApp:
 
     def generate_insights(self):
         """Generate personalized insights based on user data"""
+        import pandas as pd
         insights = []
         
         # Analyze mood trends
@@ -265,8 +278,8 @@ class MentalHealthApp:
         return insights
 
 def main():
+    init_session_state()
     app = MentalHealthApp()
-    app.load_data()
     app.main_page()
 
 if __name__ == "__main__":
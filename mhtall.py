@@ -1,67 +1,354 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-from datetime import datetime
-import json
-
-# Initialize session state variables
-if 'mood_data' not in st.session_state:
-    st.session_state.mood_data = []
-if 'activities' not in st.session_state:
-    st.session_state.activities = []
-if 'sleep_data' not in st.session_state:
-    st.session_state.sleep_data = []
-if 'is_mobile' not in st.session_state:
-    st.session_state.is_mobile = False
-if 'goals' not in st.session_state:
-        st.session_state.goals = []
-if 'journal_entries' not in st.session_state:
-        st.session_state.journal_entries = []
-if 'custom_tags' not in st.session_state:
-        st.session_state.custom_tags = []
-if 'meditation_active' not in st.session_state:
+import time
+
+import profiling
+from aggregates import WINDOWS, AggregateEngine
+from archive import History, archived_counts
+from columnar import ColumnarStore, join_frames
+from downsample import MAX_POINTS, MOBILE_POINTS, downsample
+from export import EXPORT_FORMATS, export_archive
+from figure_cache import FigureCache
+from frame_cache import FrameCache
+from load_cache import load_cache
+from records import (ACTIVITIES, COLLECTIONS, DATE_FORMATS, DURATION_RANGE, FIELDS, MOOD_SCALE,
+                     SECONDS_PER_DAY, SLEEP_HOURS_RANGE, SLEEP_QUALITIES, day_timestamp, format_timestamp,
+                     today)
+from rollups import GRANULARITIES, ROLLUPS, RollupEngine
+from storage import DEFAULT_USER, STORAGE_ERRORS, open_user_index, open_user_store, pipeline
+from write_queue import open_queue
+
+# Navigation entries and the methods rendering them
+PAGES = {
+    "Dashboard": 'show_dashboard',
+    "Track Mood": 'track_mood',
+    "Track Activities": 'track_activities',
+    "Track Sleep": 'track_sleep',
+    "Journal": 'add_journal_entry',
+    "Search": 'search_entries',
+    "Meditation": 'meditation_timer',
+    "Goals": 'add_wellness_goals',
+    "Analytics & Insights": 'show_analysis',
+    "Export Data": 'export_data',
+}
+
+# Pages that only log records; they skip loading, and save_data loads before appending
+WRITE_ONLY_PAGES = {"Track Mood", "Journal", "Goals"}
+
+
+def init_session_state():
+    """Initialize session state variables"""
+    if 'data' not in st.session_state:
+        st.session_state.data = ColumnarStore()
+    if 'data_shared' not in st.session_state:
+        st.session_state.data_shared = False
+    if 'is_mobile' not in st.session_state:
+        st.session_state.is_mobile = False
+    if 'meditation_active' not in st.session_state:
         st.session_state.meditation_active = False
+    if 'meditation_session' not in st.session_state:
+        st.session_state.meditation_session = None
+    if 'frame_cache' not in st.session_state:
+        st.session_state.frame_cache = FrameCache()
+    if 'figure_cache' not in st.session_state:
+        st.session_state.figure_cache = FigureCache()
+    if 'aggregates' not in st.session_state:
+        st.session_state.aggregates = AggregateEngine()
+    if 'rollups' not in st.session_state:
+        st.session_state.rollups = RollupEngine()
+    if 'table_pages' not in st.session_state:
+        st.session_state.table_pages = {}
+    if 'archive' not in st.session_state:
+        # Archive segments of the loaded data, with their record counts
+        st.session_state.archive = {}
+    if 'stored_counts' not in st.session_state:
+        # Records per collection the store returned at the last load
+        st.session_state.stored_counts = dict.fromkeys(COLLECTIONS, 0)
+    if 'appended' not in st.session_state:
+        # Collections the session added records to that were not part of the last load
+        st.session_state.appended = set()
 
 
+def trace_points(trace):
+    """Number of points of a Plotly trace"""
+    # Pie charts carry their points in `values` instead of `x`
+    points = trace.x if getattr(trace, 'x', None) is not None else trace.values
+    if isinstance(points, dict):
+        # Figures rebuilt from a cached spec keep numeric arrays base64-encoded
+        import base64
+        import numpy as np
+        return len(base64.b64decode(points['bdata'])) // np.dtype(points['dtype']).itemsize
+    return len(points)
 
 
 
 
 class MentalHealthApp:
-    def __init__(self):
-        pass
-
-    def save_data(self):
-        """Save data to JSON file"""
-        data = {
-            'mood_data': st.session_state.mood_data,
-            'activities': st.session_state.activities,
-            'sleep_data': st.session_state.sleep_data,
-            'goals': st.session_state.goals,
-            'journal_entries': st.session_state.journal_entries,
-            'custom_tags': st.session_state.custom_tags,
-            'meditation_active': st.session_state.meditation_active
+    def __init__(self, user_id=DEFAULT_USER):
+        self.user_id = user_id
+        self.store = open_user_store(user_id)
+        self.queue = open_queue(self.store)
+        self.loaded = False
+        # Error of a save that kept nothing, for confirm_saved
+        self.save_error = None
 
-        }
-        with open('mental_health_data.json', 'w') as f:
-            json.dump(data, f)
+    @profiling.timed("save_data")
+    def save_data(self, collection=None, record=None):
+        """Store a new record, or save everything when no record is given
 
+        Returns whether the record is on disk already, rather than only queued
+        for the background writer. A record that could not be saved at all is
+        left out of the session, and its error kept in `save_error`.
+        """
+        self.ensure_loaded()
+        if collection is None:
+            data = st.session_state.data.to_data()
+            data['meditation_active'] = st.session_state.meditation_active
+            data['meditation_session'] = st.session_state.meditation_session
+            if st.session_state.archive:
+                # Only the hot records are loaded; the segments holding the rest stay
+                data['_archive'] = st.session_state.archive
+            # Queued records are in the snapshot already and must not be appended after it
+            self.queue.flush()
+            self.store.write_snapshot(data)
+            # The store now holds exactly the session's records
+            st.session_state.stored_counts = {collection: st.session_state.data.count(collection)
+                                              for collection in COLLECTIONS}
+            st.session_state.appended = set()
+            st.session_state.frame_cache.bump_all()
+            self.rebuild_aggregates(WINDOWS)
+            return True
+        else:
+            try:
+                durable = self.queue.put(collection, record)
+            except STORAGE_ERRORS as e:
+                # Group and sync saves wait for their commit, which keeps nothing when it fails
+                self.save_error = e
+                return False
+            if st.session_state.data_shared:
+                # Loaded stores are shared with other sessions through the load cache
+                st.session_state.data = st.session_state.data.copy()
+                st.session_state.data_shared = False
+            st.session_state.data.append(collection, record)
+            st.session_state.appended.add(collection)
+            st.session_state.frame_cache.bump(collection)
+            st.session_state.aggregates.add(collection, record)
+            st.session_state.rollups.add(collection, record, self.timezone())
+            return durable
+
+    def ensure_loaded(self):
+        """Load the data unless this rerun has already done so"""
+        if not self.loaded:
+            self.load_data()
+
+    @profiling.timed("load_data")
     def load_data(self):
-        """Load data from JSON file"""
+        """Load data from the configured storage backend"""
+        self.loaded = True
+        unsaved = []
         try:
-            with open('mental_health_data.json', 'r') as f:
-                data = json.load(f)
-                st.session_state.mood_data = data.get('mood_data', [])
-                st.session_state.activities = data.get('activities', [])
-                st.session_state.sleep_data = data.get('sleep_data', [])
-                st.session_state.goals = data.get('goals', [])
-                st.session_state.journal_entries = data.get('journal_entries', [])
-                st.session_state.custom_tags = data.get('custom_tags', [])
-                st.session_state.meditation_active = data.get('meditation_active', False)
-                st.session_state.is_mobile = data.get('is_mobile', False)
-                
+            # Records still queued would look like rows missing from the files
+            self.queue.flush()
+        except STORAGE_ERRORS as e:
+            # The writer keeps trying; meanwhile its records are shown as if saved
+            unsaved = self.queue.queued()
+            entries = "1 entry" if len(unsaved) == 1 else f"{len(unsaved)} entries"
+            st.error(f"Saving failed: {e}. {entries} will be tried again in the background.")
+        previous = st.session_state.stored_counts
+        # Every backend serves a shared columnar store, reading only what changed since its last load
+        loaded, settings = self.store.load_store()
+        st.session_state.stored_counts = {collection: loaded.count(collection) for collection in COLLECTIONS}
+        # Records the session holds beyond the last load are not where the store put them
+        local = st.session_state.appended | {collection for collection, _ in unsaved}
+        st.session_state.appended = {collection for collection, _ in unsaved}
+        if unsaved:
+            loaded = loaded.copy()
+            for collection, record in unsaved:
+                loaded.append(collection, record)
+        changed = [collection for collection in COLLECTIONS
+                   if loaded.count(collection) != previous[collection] or collection in local]
+        moved = settings['_archive'] != st.session_state.archive
+        if moved:
+            # Old months moved into the archive, renumbering the hot records
+            totals = {collection: self.count(collection) for collection in ROLLUPS}
+            st.session_state.archive = settings['_archive']
+            changed = COLLECTIONS
+        if changed:
+            st.session_state.data = loaded
+            st.session_state.data_shared = not unsaved
+        for collection in changed:
+            st.session_state.frame_cache.bump(collection)
+        st.session_state.meditation_active = settings['meditation_active']
+        st.session_state.meditation_session = settings['meditation_session']
+        st.session_state.is_mobile = settings.get('is_mobile', st.session_state.is_mobile)
+        self.rebuild_aggregates([collection for collection in changed if collection in WINDOWS])
+        rollups = [collection for collection in changed if collection in ROLLUPS]
+        if moved:
+            # Rollups cover the whole history, which only changed where its totals did
+            rollups = [collection for collection in rollups if self.count(collection) != totals[collection]]
+            previous = dict.fromkeys(COLLECTIONS, 0)
+        self.update_rollups(rollups, previous, local)
+
+    def confirm_saved(self, message, durable):
+        """Tell the user a record was saved, or queued to be saved in the background"""
+        error = self.queue.error()
+        if self.save_error is not None:
+            st.error(f"Saving failed: {self.save_error}. Nothing was saved; please try again.")
+        elif error is not None:
+            st.error(f"{message}, but saving it failed: {error}. It will be tried again in the background.")
+        elif durable:
+            st.success(f"{message} successfully!")
+        else:
+            st.success(f"{message}! Saving in the background.")
+
+    def rebuild_aggregates(self, collections):
+        """Refill the rolling windows of some collections from their recent records"""
+        for collection in collections:
+            longest = max(WINDOWS[collection][1])
+            st.session_state.aggregates.rebuild(collection, self.recent_records(collection, longest))
+
+    def update_rollups(self, collections, previous, local):
+        """Bring the rollups of some collections up to date from the store's earlier record counts
+
+        Collections in `local` got records from this session since the last
+        load; they are already counted, at rows the store may have filled
+        differently, so those collections are rebuilt instead.
+        """
+        data = st.session_state.data
+        for collection in collections:
+            count = st.session_state.stored_counts[collection]
+            if collection not in local and 0 < previous[collection] < count:
+                # Only the records the store appended since the last load are new
+                for record in data.records(collection, range(previous[collection], count)):
+                    st.session_state.rollups.add(collection, record, data.timezone)
+            else:
+                st.session_state.rollups.invalidate(collection)
+
+    def rollups(self):
+        """Rollups, first rebuilding the collections that changed wholesale"""
+        rollups = st.session_state.rollups
+        for collection in list(rollups.stale):
+            rollups.rebuild(collection, self.frame(collection))
+        return rollups
+
+    def recent_records(self, collection, days):
+        """Records of a collection dated within the last `days` days"""
+        since = time.time() - days * SECONDS_PER_DAY
+        if hasattr(self.store, 'query_range'):
+            # Indexed backends answer the window without touching the full history
+            return self.store.query_range(collection, since)
+        return st.session_state.data.since(collection, since)
+
+    def timezone(self):
+        """Timezone the user's dates are shown and grouped into days in"""
+        return st.session_state.data.timezone
+
+    def today(self):
+        """Unix timestamp of the start of today in the user's timezone"""
+        return day_timestamp(today(self.timezone()), self.timezone())
+
+    def frame(self, collection):
+        """Typed DataFrame of a collection's whole history
+
+        The hot records' frame is rebuilt only when the collection changes;
+        archived records are read on demand and shared between sessions.
+        """
+        hot = st.session_state.frame_cache.get(collection, st.session_state.data)
+        if not archived_counts(st.session_state.archive)[collection]:
+            return hot
+        listing = st.session_state.archive
+        archived = load_cache.get((self.store.archive_dir, collection), tuple(sorted(listing)),
+                                  lambda: self.archive_store().frame(collection),
+                                  lambda df: int(df.memory_usage(deep=True).sum()))
+        return join_frames(collection, archived, hot)
+
+    def archive_store(self):
+        """Columnar store of the archived records, read on demand"""
+        try:
+            return self.store.load_archive(st.session_state.archive, self.timezone())
         except FileNotFoundError:
-            pass
+            # The data was rewritten since this session loaded it
+            self.load_data()
+            return self.store.load_archive(st.session_state.archive, self.timezone())
+
+    def stored_history(self):
+        """History the store itself loaded, archived records included, and its data generation
+
+        Unlike the session's data it holds no records of this session that are
+        not saved yet, so every session keeps the shared search index in step
+        with the same rows.
+        """
+        loaded, settings = self.store.load_store()
+        directory = self.store.archive_dir if settings['_archive'] else None
+        return History(directory, settings['_archive'], loaded), settings['_generation']
+
+    def history(self):
+        """The session's whole history, archived records read one segment at a time"""
+        listing = st.session_state.archive
+        return History(self.store.archive_dir if listing else None, listing, st.session_state.data)
+
+    def chart_frame(self, collection, y, method="resample", max_points=None):
+        """Frame of a collection reduced to the chart point budget"""
+        if max_points is None:
+            max_points = MOBILE_POINTS if st.session_state.is_mobile else MAX_POINTS
+        if method == "resample" and collection in ROLLUPS and self.count(collection) > max_points:
+            # Calendar buckets come straight from the rollups instead of resampling every entry
+            rollups = self.rollups()
+            span = rollups.span_days(collection)
+            for granularity, days in GRANULARITIES.items():
+                if span / days <= max_points:
+                    table = rollups.table(collection, granularity)
+                    return table[['date', 'mean']].rename(columns={'mean': y})
+        return downsample(self.frame(collection), 'date', y, max_points, method)
+
+    def figure(self, name, collections, build, **layout):
+        """Figure of a chart, built by `build()` only when its collections or layout changed"""
+        versions = st.session_state.frame_cache.versions
+        # The mobile layout changes both chart heights and point budgets
+        key = (name, tuple(versions.get(collection, 0) for collection in collections),
+               st.session_state.is_mobile, tuple(sorted(layout.items())))
+        return st.session_state.figure_cache.get(key, build)
+
+    def plotly_chart(self, fig, **kwargs):
+        """Render a Plotly figure, timed under its key or title when profiling is on"""
+        if not profiling.ENABLED:
+            return st.plotly_chart(fig, **kwargs)
+        with profiling.span(f"chart:{kwargs.get('key') or fig.layout.title.text}"):
+            profiling.count(rows=sum(trace_points(trace) for trace in fig.data))
+            return st.plotly_chart(fig, **kwargs)
+
+    def recent_frame(self, collection, limit, before=None):
+        """Frame of the newest records of a collection, newest first, built from those rows only"""
+        store = st.session_state.data
+        return store.frame(collection, store.recent(collection, limit, before))
+
+    def recent_table(self, collection, page_size=10):
+        """Newest records of a collection as a table, one page at a time"""
+        store = st.session_state.data
+        # Each visited page is kept as the key of the record before it
+        pages = st.session_state.table_pages.setdefault(collection, [None])
+        rows = store.recent(collection, page_size, pages[-1])
+        st.dataframe(store.frame(collection, rows), hide_index=True)
+        first = (len(pages) - 1) * page_size
+        archived = archived_counts(st.session_state.archive)[collection]
+        st.caption(f"Entries {first + 1}–{first + len(rows)} of {store.count(collection)}"
+                   + (f", plus {archived} archived (see Export Data)" if archived else ""))
+        newer, older = st.columns(2)
+        newer.button("← Newer", key=f"{collection}_newer", disabled=len(pages) == 1, on_click=pages.pop)
+        last = None
+        if len(rows):
+            last = (int(store.column(collection, FIELDS[collection][0])[rows[-1]]), int(rows[-1]))
+        older.button("Older →", key=f"{collection}_older", disabled=first + len(rows) >= store.count(collection),
+                     on_click=pages.append, args=(last,))
+
+    def count(self, collection):
+        """Number of records in a collection, archived ones included"""
+        return st.session_state.data.count(collection) + archived_counts(st.session_state.archive).get(collection, 0)
+
+    def statistics(self):
+        """Window statistics of the dashboard and analysis pages"""
+        import analytics
+        return analytics.window_statistics(st.session_state.aggregates)
+
     def set_page_layout(self):
         """Set page layout"""
          # Detect device type based on viewport width
@@ -82,56 +369,30 @@ class MentalHealthApp:
         
         # Sidebar navigation
         if st.session_state.is_mobile:
-
-    # Mobile navigation using selectbox at top
-            page = st.selectbox("**:rainbow[Navigate]**", 
-        ["Dashboard", "Track Mood", "Track Activities", "Track Sleep", 
-             "Journal", "Meditation", "Goals", "Analytics & Insights", 
-             "Export Data"])
+            # Mobile navigation using selectbox at top
+            page = st.selectbox("**:rainbow[Navigate]**", list(PAGES))
         else:
+            # Desktop navigation using sidebar
+            page = st.sidebar.radio("**:rainbow[Navigate]**", list(PAGES))
+        self.render(page)
 
-    # Desktop navigation using sidebar
-            page = st.sidebar.radio("**:rainbow[Navigate]**", 
-         ["Dashboard", "Track Mood", "Track Activities", "Track Sleep", 
-             "Journal", "Meditation", "Goals", "Analytics & Insights", 
-             "Export Data"])
-        if page == "Dashboard":
-            self.show_dashboard()
-        elif page == "Track Mood":
-            self.track_mood()
-        elif page == "Track Activities":
-            self.track_activities()
-        elif page == "Track Sleep":
-            self.track_sleep()
-        elif page == "Journal":
-            self.add_journal_entry()
-        elif page == "Meditation":
-            self.meditation_timer()
-        elif page == "Goals":
-            self.add_wellness_goals()
-        elif page == "Analysis & Insights":
-            self.show_analysis()
-        elif page == "Export Data":
-            self.export_data()
+    def render(self, page):
+        """Render one page, loading the data first unless the page only logs records"""
+        if page not in WRITE_ONLY_PAGES:
+            self.ensure_loaded()
+        with profiling.span(f"page:{page}"):
+            getattr(self, PAGES[page])()
 
     def track_mood(self):
         """Mood tracking interface"""
         st.subheader("Track Your Mood")
         
-        mood_scale = {
-            "Excellent": 5,
-            "Good": 4,
-            "Neutral": 3,
-            "Low": 2,
-            "Very Low": 1
-        }
-        
         col1, col2 = st.columns(2)
         
         with col1:
             mood = st.select_slider(
                 "How are you feeling?",
-                options=list(mood_scale.keys())
+                options=list(MOOD_SCALE.keys())
             )
             
         with col2:
@@ -139,52 +400,43 @@ class MentalHealthApp:
         
         if st.button("Log Mood"):
             mood_entry = {
-                "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
+                "date": int(time.time()),
                 "mood": mood,
-                "mood_value": mood_scale[mood],
+                "mood_value": MOOD_SCALE[mood],
                 "notes": notes
             }
-            st.session_state.mood_data.append(mood_entry)
-            self.save_data()
-            st.success("Mood logged successfully!")
+            self.confirm_saved("Mood logged", self.save_data('mood_data', mood_entry))
 
     def track_activities(self):
         """Activity tracking interface"""
         st.subheader("Track Your Activities")
         
-        activities = ["Exercise", "Meditation", "Reading", "Socializing", "Therapy", "Other"]
-        
         col1, col2 = st.columns(2)
         
         with col1:
-            activity = st.selectbox("Select Activity", activities)
+            activity = st.selectbox("Select Activity", ACTIVITIES)
             if activity == "Other":
                 activity = st.text_input("Specify activity")
                 
         with col2:
             duration = st.number_input("Duration (minutes)", 
-                                     min_value=5, 
-                                     max_value=150,
+                                     min_value=DURATION_RANGE[0], 
+                                     max_value=DURATION_RANGE[1],
                                      value=30,
                                      step=5)
         
         if st.button("Log Activity"):
             activity_entry = {
-                "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
+                "date": int(time.time()),
                 "activity": activity,
                 "duration": duration
             }
-            st.session_state.activities.append(activity_entry)
-            self.save_data()
-            st.success("Activity logged successfully!")
+            self.confirm_saved("Activity logged", self.save_data('activities', activity_entry))
 
         # Display recent activities
-        if st.session_state.activities:
+        if self.count('activities'):
             st.subheader("Recent Activities")
-            activities_df = pd.DataFrame(st.session_state.activities)
-            activities_df['date'] = pd.to_datetime(activities_df['date'])
-            activities_df = activities_df.sort_values('date', ascending=False)
-            st.dataframe(activities_df)
+            self.recent_table('activities')
 
     def track_sleep(self):
         """Sleep tracking interface"""
@@ -194,78 +446,71 @@ class MentalHealthApp:
         
         with col1:
             sleep_hours = st.number_input("Hours of sleep", 
-                                        min_value=0.0, 
-                                        max_value=24.0, 
+                                        min_value=SLEEP_HOURS_RANGE[0], 
+                                        max_value=SLEEP_HOURS_RANGE[1], 
                                         value=7.0, 
                                         step=0.5)
             
         with col2:
             sleep_quality = st.select_slider(
                 "Sleep Quality",
-                options=["Poor", "Fair", "Good", "Excellent"]
+                options=SLEEP_QUALITIES
             )
             
         if st.button("Log Sleep"):
             sleep_entry = {
-                "date": datetime.now().strftime("%Y-%m-%d"),
+                "date": self.today(),
                 "hours": float(sleep_hours),
                 "quality": sleep_quality
             }
-            st.session_state.sleep_data.append(sleep_entry)
-            self.save_data()
-            st.success("Sleep data logged successfully!")
+            self.confirm_saved("Sleep data logged", self.save_data('sleep_data', sleep_entry))
         #display recent sleep data 
-        if st.session_state.sleep_data:
+        if self.count('sleep_data'):
             st.subheader("Recent Sleep Data")
-            sleep_df = pd.DataFrame(st.session_state.sleep_data)
-            sleep_df['date'] = pd.to_datetime(sleep_df['date'])
-            sleep_df = sleep_df.sort_values('date', ascending=False)
-            st.dataframe(sleep_df)
-    def plot_mood_trend(self):
+            self.recent_table('sleep_data')
+    @profiling.timed("plot_mood_trend")
+    def plot_mood_trend(self, max_points=None):
         """Plot mood trend visualization"""
-        if st.session_state.mood_data:
-            df = pd.DataFrame(st.session_state.mood_data)
-            df['date'] = pd.to_datetime(df['date'])
-            
+        import plotly.express as px
+        if self.count('mood_data'):
             height = 300 if st.session_state.is_mobile else 400
-            fig = px.line(df, x='date', y='mood_value', 
-                         title='Mood Trend Over Time',
-                         labels={'mood_value': 'Mood Level', 'date': 'Date'},
-                         height=height)
-            st.plotly_chart(fig, use_container_width=True)
+            fig = self.figure('mood_trend', ['mood_data'], lambda: px.line(
+                self.chart_frame('mood_data', 'mood_value', "lttb", max_points), x='date', y='mood_value',
+                title='Mood Trend Over Time',
+                labels={'mood_value': 'Mood Level', 'date': 'Date'},
+                height=height), max_points=max_points)
+            self.plotly_chart(fig, use_container_width=True)
         else:
             st.info("No mood data available yet. Start tracking your mood to see trends!")
     
-    def plot_sleep_pattern(self):
+    @profiling.timed("plot_sleep_pattern")
+    def plot_sleep_pattern(self, max_points=None):
         """Plot sleep pattern visualization"""
-        if st.session_state.sleep_data:
-            df = pd.DataFrame(st.session_state.sleep_data)
-            df['date'] = pd.to_datetime(df['date'])
-            df = df.sort_values('date')
-
+        import plotly.express as px
+        if self.count('sleep_data'):
             height = 300 if st.session_state.is_mobile else 400
-            fig = px.bar(df, x='date', y='hours',
-                        title='Sleep Pattern',
-                        labels={'hours': 'Hours of Sleep', 'date': 'Date'},
-                        height=height)
-            st.plotly_chart(fig, use_container_width=True)
+            fig = self.figure('sleep_pattern', ['sleep_data'], lambda: px.bar(
+                self.chart_frame('sleep_data', 'hours', max_points=max_points), x='date', y='hours',
+                title='Sleep Pattern',
+                labels={'hours': 'Hours of Sleep', 'date': 'Date'},
+                height=height), max_points=max_points)
+            self.plotly_chart(fig, use_container_width=True)
         else:
             st.info("No sleep data available yet. Start tracking your sleep to see patterns!")
     
     def show_dashboard(self):
         """Display dashboard with overview of all metrics"""
+        import plotly.express as px
         st.subheader("Your Wellness Dashboard")
         #create metrics 
         col1 , col2  ,col3 = st.columns(3)
+        stats = self.statistics()
         # Summary metrics
         with col1:
             # Mood metric
-            if st.session_state.mood_data:
-                mood_df = pd.DataFrame(st.session_state.mood_data)
-                mood_df['date'] = pd.to_datetime(mood_df['date'])
-                recent_mood = mood_df[mood_df['date'] > (datetime.now() - pd.Timedelta(days=7))]
-                if not recent_mood.empty:
-                    avg_mood = recent_mood['mood_value'].mean()
+            if self.count('mood_data'):
+                avg_mood = stats['avg_mood_7d']
+                if avg_mood is not None:
                     st.metric("Average Mood (Last 7 days)", f"{avg_mood:.1f}")
                 else:
                     st.metric("Average Mood", "No recent data")
@@ -274,12 +519,9 @@ class MentalHealthApp:
     
         with col2:
         # Sleep metric
-            if st.session_state.sleep_data:
-                sleep_df = pd.DataFrame(st.session_state.sleep_data)
-                sleep_df['date'] = pd.to_datetime(sleep_df['date'])
-                recent_sleep = sleep_df[sleep_df['date'] > (datetime.now() - pd.Timedelta(days=7))]
-                if not recent_sleep.empty:
-                    avg_sleep = recent_sleep['hours'].mean()
+            if self.count('sleep_data'):
+                avg_sleep = stats['avg_sleep_7d']
+                if avg_sleep is not None:
                     st.metric("Average Sleep (Last 7 days)", f"{avg_sleep:.1f} hrs")
                 else:
                     st.metric("Average Sleep", "No recent data")
@@ -288,189 +530,179 @@ class MentalHealthApp:
     
         with col3:
             # Activity metric
-            if st.session_state.activities:
-                activities_df = pd.DataFrame(st.session_state.activities)
-                activities_df['date'] = pd.to_datetime(activities_df['date'])
-                recent_activities = activities_df[activities_df['date'] > (datetime.now() - pd.Timedelta(days=7))]
-                activity_count = len(recent_activities)
+            if self.count('activities'):
+                activity_count = stats['activities_7d']
                 st.metric("Activities (Last 7 days)", activity_count)
             else:
                 st.metric("Activities", "No data")
         # Show visualizations
-    if st.session_state.mood_data:
-        st.subheader("Mood Trend")
-        mood_df = pd.DataFrame(st.session_state.mood_data)
-        mood_df['date'] = pd.to_datetime(mood_df['date'])
-        fig_mood = px.line(mood_df, x='date', y='mood_value',
-                          title='Mood Trend',
-                          labels={'mood_value': 'Mood Level', 'date': 'Date'})
-        st.plotly_chart(fig_mood, use_container_width=True, key="dashboard_mood")
-
-    if st.session_state.sleep_data:
-        st.subheader("Sleep Pattern")
-        sleep_df = pd.DataFrame(st.session_state.sleep_data)
-        sleep_df['date'] = pd.to_datetime(sleep_df['date'])
-        fig_sleep = px.bar(sleep_df, x='date', y='hours',
-                          title='Sleep Pattern',
-                          labels={'hours': 'Hours of Sleep', 'date': 'Date'})
-        st.plotly_chart(fig_sleep, use_container_width=True, key="dashboard_sleep")
-
-    # Show recent activities
-    if st.session_state.activities:
-        st.subheader("Recent Activities")
-        activities_df = pd.DataFrame(st.session_state.activities)
-        activities_df['date'] = pd.to_datetime(activities_df['date'])
-        recent_activities = activities_df.sort_values('date', ascending=False).head(5)
-        st.dataframe(recent_activities[['date', 'activity', 'duration']])
-    # Show recent journal entries
-    if st.session_state.journal_entries:
-        st.subheader("Recent Journal Entries")
-        journal_df = pd.DataFrame(st.session_state.journal_entries)
-        journal_df['date'] = pd.to_datetime(journal_df['date'])
-        recent_entries = journal_df.sort_values('date', ascending=False).head(5)
-        st.dataframe(recent_entries[['date', 'title', 'content']])
-    # show recent goals
-    if st.session_state.goals:
-        st.subheader("Recent Goals")
-        goals_df = pd.DataFrame(st.session_state.wellness_goals)
-        goals_df['date'] = pd.to_datetime(goals_df['date'])
-        recent_goals = goals_df.sort_values('date', ascending=False).head(5)
-        st.dataframe(recent_goals[['date', 'goal', 'status']])
+        if self.count('mood_data'):
+            st.subheader("Mood Trend")
+            fig_mood = self.figure('dashboard_mood', ['mood_data'], lambda: px.line(
+                self.chart_frame('mood_data', 'mood_value', "lttb"), x='date', y='mood_value',
+                title='Mood Trend',
+                labels={'mood_value': 'Mood Level', 'date': 'Date'}))
+            self.plotly_chart(fig_mood, use_container_width=True, key="dashboard_mood")
 
-        
-        
-        
+        if self.count('sleep_data'):
+            st.subheader("Sleep Pattern")
+            fig_sleep = self.figure('dashboard_sleep', ['sleep_data'], lambda: px.bar(
+                self.chart_frame('sleep_data', 'hours'), x='date', y='hours',
+                title='Sleep Pattern',
+                labels={'hours': 'Hours of Sleep', 'date': 'Date'}))
+            self.plotly_chart(fig_sleep, use_container_width=True, key="dashboard_sleep")
+
+        # Show recent activities
+        if self.count('activities'):
+            st.subheader("Recent Activities")
+            recent_activities = self.recent_frame('activities', 5)
+            st.dataframe(recent_activities[['date', 'activity', 'duration']])
+        # Show recent journal entries
+        if self.count('journal_entries'):
+            st.subheader("Recent Journal Entries")
+            recent_entries = self.recent_frame('journal_entries', 5)
+            st.dataframe(recent_entries[['date', 'title', 'content']])
+        # show recent goals
+        if self.count('goals'):
+            st.subheader("Recent Goals")
+            recent_goals = self.recent_frame('goals', 5)
+            st.dataframe(recent_goals[['created_date', 'type', 'target', 'deadline']])
 
     def show_analysis(self):
         """Show comprehensive analysis page"""
+        import plotly.express as px
         st.subheader("Analysis & Insights")
         
-        tab1, tab2, tab3 = st.tabs(["Mood Analysis", "Sleep Analysis", "Activity Impact"])
+        tab1, tab2, tab3, tab4 = st.tabs(["Mood Analysis", "Sleep Analysis", "Activity Impact",
+                                          "Long-term Trends"])
+        stats = self.statistics()
         
         with tab1:
             
-            if st.session_state.mood_data:
+            if self.count('mood_data'):
                 st.subheader("Mood Trend Analysis")
-                mood_df = pd.DataFrame(st.session_state.mood_data)
-                mood_df['date'] = pd.to_datetime(mood_df['date'])
-                mood_df = mood_df.sort_values('date')
-            
-                fig1 = px.line(mood_df, x='date', y='mood_value',
-                         title='Mood Trend Over Time',
-                         labels={'mood_value': 'Mood Level', 'date': 'Date'})
-                st.plotly_chart(fig1, use_container_width=True, key="mood_trend_analysis")
+                fig1 = self.figure('mood_trend_analysis', ['mood_data'], lambda: px.line(
+                    self.chart_frame('mood_data', 'mood_value', "lttb"), x='date', y='mood_value',
+                    title='Mood Trend Over Time',
+                    labels={'mood_value': 'Mood Level', 'date': 'Date'}))
+                self.plotly_chart(fig1, use_container_width=True, key="mood_trend_analysis")
             
                 # Show mood statistics
                 st.subheader("Mood Statistics (Last 30 days)")
-                recent_mood = mood_df[mood_df['date'] > (datetime.now() - pd.Timedelta(days=30))]
-                if not recent_mood.empty:
+                if stats['highest_mood_30d'] is not None:
                     col1, col2, col3 = st.columns(3)
-                    col2.metric("Highest Mood", f"{recent_mood['mood_value'].max():.0f}")
-                    col3.metric("Lowest Mood", f"{recent_mood['mood_value'].min():.0f}")
+                    col2.metric("Highest Mood", f"{stats['highest_mood_30d']:.0f}")
+                    col3.metric("Lowest Mood", f"{stats['lowest_mood_30d']:.0f}")
             else:
                 st.info("Start tracking your mood to see analysis here!")
     
         with tab2:
-            if st.session_state.sleep_data:
+            if self.count('sleep_data'):
                 st.subheader("Sleep Patterns")
-                sleep_df = pd.DataFrame(st.session_state.sleep_data)
-                sleep_df['date'] = pd.to_datetime(sleep_df['date'])
-                sleep_df = sleep_df.sort_values('date')
-                
                 # Create sleep trend visualization
-                fig2 = px.bar(sleep_df, x='date', y='hours',
-                        title='Sleep Duration Over Time',
-                        labels={'hours': 'Hours of Sleep', 'date': 'Date'})
-                st.plotly_chart(fig2, use_container_width=True, key="sleep_trend_analysis")
+                fig2 = self.figure('sleep_trend_analysis', ['sleep_data'], lambda: px.bar(
+                    self.chart_frame('sleep_data', 'hours'), x='date', y='hours',
+                    title='Sleep Duration Over Time',
+                    labels={'hours': 'Hours of Sleep', 'date': 'Date'}))
+                self.plotly_chart(fig2, use_container_width=True, key="sleep_trend_analysis")
                 
                 # Show sleep statistics
                 st.subheader("Sleep Statistics (Last 30 days)")
-                recent_sleep = sleep_df[sleep_df['date'] > (datetime.now() - pd.Timedelta(days=30))]
-                if not recent_sleep.empty:
+                if stats['least_sleep_30d'] is not None:
                     col1, col2, col3 = st.columns(3)
-                    col3.metric("Least Sleep", f"{recent_sleep['hours'].min():.1f} hrs")
+                    col3.metric("Least Sleep", f"{stats['least_sleep_30d']:.1f} hrs")
             else:
                 st.info("Start tracking your sleep to see analysis here!")
     
         with tab3:
-            if st.session_state.activities and st.session_state.mood_data:
+            if self.count('activities') and self.count('mood_data'):
                 st.subheader("Activity Impact Analysis")
                 
-                # Create activity analysis
-                activities_df = pd.DataFrame(st.session_state.activities)
-                activities_df['date'] = pd.to_datetime(activities_df['date'])
-                
                 # Activity frequency chart
-                activity_counts = activities_df['activity'].value_counts()
-                fig3 = px.pie(values=activity_counts.values,
-                        names=activity_counts.index,
-                        title='Activity Distribution')
-                st.plotly_chart(fig3, use_container_width=True, key="activity_distribution")
+                def activity_distribution():
+                    activity_counts = self.frame('activities')['activity'].value_counts()
+                    return px.pie(values=activity_counts.values,
+                                  names=activity_counts.index,
+                                  title='Activity Distribution')
+                fig3 = self.figure('activity_distribution', ['activities'], activity_distribution)
+                self.plotly_chart(fig3, use_container_width=True, key="activity_distribution")
                 
                 # Activity duration analysis
-                avg_duration = activities_df.groupby('activity')['duration'].mean().reset_index()
-                fig4 = px.bar(avg_duration, x='activity', y='duration',
-                        title='Average Duration by Activity',
-                        labels={'duration': 'Minutes', 'activity': 'Activity'})
-                st.plotly_chart(fig4, use_container_width=True, key="activity_duration")
+                def activity_duration():
+                    avg_duration = self.frame('activities').groupby('activity')['duration'].mean().reset_index()
+                    return px.bar(avg_duration, x='activity', y='duration',
+                                  title='Average Duration by Activity',
+                                  labels={'duration': 'Minutes', 'activity': 'Activity'})
+                fig4 = self.figure('activity_duration', ['activities'], activity_duration)
+                self.plotly_chart(fig4, use_container_width=True, key="activity_duration")
+
+                # Mood on days with each activity compared to days without it
+                impact = self.analyze_mood_correlations()
+                if impact is not None:
+                    st.subheader("Mood Impact by Activity")
+                    impact = impact.assign(error_plus=impact['same_day_high'] - impact['same_day_effect'],
+                                           error_minus=impact['same_day_effect'] - impact['same_day_low'])
+                    fig5 = self.figure('activity_impact', ['mood_data', 'activities'], lambda: px.bar(
+                        impact, x='activity', y='same_day_effect',
+                        error_y='error_plus', error_y_minus='error_minus',
+                        title='Same-Day Mood Difference (95% CI)',
+                        labels={'same_day_effect': 'Mood Difference', 'activity': 'Activity'}))
+                    self.plotly_chart(fig5, use_container_width=True, key="activity_impact")
+                    st.dataframe(impact[['activity', 'days', 'total_minutes',
+                                         'same_day_effect', 'same_day_low', 'same_day_high',
+                                         'next_day_effect', 'next_day_low', 'next_day_high']])
             else:
                 st.info("Start tracking both activities and mood to see their relationship!")
+
+        with tab4:
+            if any(self.count(collection) for collection in ROLLUPS):
+                self.show_trends()
+            else:
+                st.info("Start tracking to see your long-term trends here!")
+
+    def show_trends(self):
+        """Daily, weekly or monthly trends read from the rollups"""
+        import plotly.express as px
+        rollups = self.rollups()
+        granularity = st.radio("Group by", list(GRANULARITIES), index=1, horizontal=True,
+                               format_func=str.capitalize)
+        period = granularity.capitalize()
+
+        if self.count('mood_data'):
+            fig = self.figure('mood_rollup', ['mood_data'], lambda: px.line(
+                rollups.table('mood_data', granularity), x='date', y=['mean', 'min', 'max'],
+                title=f'Mood per {granularity}',
+                labels={'value': 'Mood Level', 'date': period, 'variable': ''}), granularity=granularity)
+            self.plotly_chart(fig, use_container_width=True, key="mood_rollup")
+
+        if self.count('sleep_data'):
+            fig = self.figure('sleep_rollup', ['sleep_data'], lambda: px.bar(
+                rollups.table('sleep_data', granularity), x='date', y='mean',
+                title=f'Average sleep per {granularity}',
+                labels={'mean': 'Hours of Sleep', 'date': period}), granularity=granularity)
+            self.plotly_chart(fig, use_container_width=True, key="sleep_rollup")
+            fig = self.figure('sleep_quality_rollup', ['sleep_data'], lambda: px.bar(
+                rollups.label_table('sleep_data', granularity), x='date', y='count', color='quality',
+                title=f'Sleep quality per {granularity}',
+                labels={'count': 'Nights', 'date': period, 'quality': 'Quality'}), granularity=granularity)
+            self.plotly_chart(fig, use_container_width=True, key="sleep_quality_rollup")
+
+        if self.count('activities'):
+            fig = self.figure('activity_rollup', ['activities'], lambda: px.bar(
+                rollups.label_table('activities', granularity), x='date', y='total', color='activity',
+                title=f'Activity minutes per {granularity}',
+                labels={'total': 'Minutes', 'date': period, 'activity': 'Activity'}), granularity=granularity)
+            self.plotly_chart(fig, use_container_width=True, key="activity_rollup")
     def generate_insights(self):
         """Generate personalized insights based on user data"""
-        insights = []
-        
-        if st.session_state.mood_data:
-            df_mood = pd.DataFrame(st.session_state.mood_data)
-            df_mood['date'] = pd.to_datetime(df_mood['date'])
-            
-            # Analyze mood trends
-            avg_mood = df_mood['mood_value'].mean()
-            if avg_mood < 3:
-                insights.append("Your mood has been lower than average. Consider scheduling activities that bring you joy or speaking with a mental health professional.")
-            elif avg_mood >= 4:
-                insights.append("Great job! Your mood has been consistently positive.")
-    
-        if st.session_state.sleep_data:
-            df_sleep = pd.DataFrame(st.session_state.sleep_data)
-            avg_sleep = df_sleep['hours'].mean()
-            
-            if avg_sleep < 7:
-                insights.append("You're getting less than the recommended 7-9 hours of sleep. Try to maintain a consistent sleep schedule.")
-            elif avg_sleep > 9:
-                insights.append("You're getting more than average sleep. If you feel tired despite this, consider checking your sleep quality.")
-    
-        if st.session_state.activities:
-            df_activities = pd.DataFrame(st.session_state.activities)
-            activity_counts = df_activities['activity'].value_counts()
-            
-            if len(activity_counts) < 3:
-                insights.append("Consider diversifying your activities to maintain better mental health.")
-            
-            if 'Exercise' in activity_counts and activity_counts['Exercise'] > 3:
-                insights.append("Great job maintaining regular exercise! This is excellent for mental health.")
-    
-        if not insights:
-            insights.append("Start logging more data to receive personalized insights!")
-            
-        return insights
+        import analytics
+        return analytics.insights(self.statistics(), self.frame('activities'))
     
     #mood correlation analysis
     def analyze_mood_correlations(self):
         """Analyze correlations between activities and mood"""
-        if st.session_state.mood_data and st.session_state.activities:
-            mood_df = pd.DataFrame(st.session_state.mood_data)
-            activities_df = pd.DataFrame(st.session_state.activities)
-            
-            # Convert dates and merge data
-            mood_df['date'] = pd.to_datetime(mood_df['date']).dt.date
-            activities_df['date'] = pd.to_datetime(activities_df['date']).dt.date
-            
-            # Group activities by date
-            daily_activities = activities_df.groupby('date')['activity'].agg(list).reset_index()
-            
-            # Merge with mood data
-            combined_df = pd.merge(mood_df, daily_activities, on='date', how='inner')
-            return combined_df
+        import analytics
+        return analytics.mood_correlations(self.frame('mood_data'), self.frame('activities'))
     #goal setting and progress tracking
     def add_wellness_goals(self):
         """Add wellness goals tracking"""
@@ -486,13 +718,10 @@ class MentalHealthApp:
             goal = {
                 "type": goal_type,
                 "target": goal_target,
-                "deadline": goal_deadline.strftime("%Y-%m-%d"),
-                "created_date": datetime.now().strftime("%Y-%m-%d")
+                "deadline": day_timestamp(goal_deadline, self.timezone()),
+                "created_date": self.today()
             }
-            if 'goals' not in st.session_state:
-                st.session_state.goals = []
-            st.session_state.goals.append(goal)
-            self.save_data()
+            self.confirm_saved("Goal set", self.save_data('goals', goal))
     #Journaling Feature
     def add_journal_entry(self):
         """Add journaling capability"""
@@ -504,63 +733,151 @@ class MentalHealthApp:
         
         if st.button("Save Journal Entry"):
             entry = {
-                "date": journal_date.strftime("%Y-%m-%d"),
+                "date": day_timestamp(journal_date, self.timezone()),
                 "title": journal_title,
                 "content": journal_content
             }
-            if 'journal_entries' not in st.session_state:
-                st.session_state.journal_entries = []
-            st.session_state.journal_entries.append(entry)
-            self.save_data()
+            self.confirm_saved("Journal entry saved", self.save_data('journal_entries', entry))
+
+    def search_entries(self):
+        """Full-text search over journal entries and mood notes"""
+        st.subheader("Search Your Entries")
+
+        query = st.text_input("Search journal entries and mood notes",
+                              help='Use calm* to match word beginnings and "long walk" for exact phrases')
+        col1, col2 = st.columns(2)
+        with col1:
+            sources = {"Journal": 'journal_entries', "Mood notes": 'mood_data'}
+            selected = st.multiselect("Search in", list(sources), default=list(sources))
+        with col2:
+            days = st.date_input("Date range", value=())
+
+        if not query:
+            return
+        start = end = None
+        if len(days) == 2:
+            # Day timestamps mark the start of a day; the range keeps both end days
+            start = day_timestamp(days[0], self.timezone()) - 1
+            end = day_timestamp(days[1], self.timezone()) + SECONDS_PER_DAY - 1
+        collections = {sources[name] for name in selected}
+        try:
+            hits = self.search_hits(query, start, end, collections)
+        except FileNotFoundError:
+            # Archive segments were rewritten while they were read; the store loads the new listing
+            hits = self.search_hits(query, start, end, collections)
+        if not hits:
+            st.info("No entries match your search.")
+            return
+        st.caption("1 match" if len(hits) == 1 else f"{len(hits)} most recent matches")
+        for collection, record in hits:
+            day = format_timestamp(record['date'], self.timezone(), DATE_FORMATS[collection])
+            if collection == 'journal_entries':
+                with st.expander(f"📔 {day} — {record['title'] or 'Untitled'}"):
+                    st.write(record['content'])
+            else:
+                with st.expander(f"🙂 {day} — Mood: {record['mood']}"):
+                    st.write(record['notes'])
+    def search_hits(self, query, start, end, collections):
+        """(collection, record) of the newest entries matching a query, archived ones included"""
+        history, generation = self.stored_history()
+        # Opened on the first search only: reading a saved index takes a while for long histories
+        index = open_user_index(self.user_id)
+        index.sync(history, generation)
+        results = index.search(query, start, end, collections)
+        rows = {}
+        for collection, row, _ in results:
+            if row < history.count(collection):
+                rows.setdefault(collection, []).append(row)
+        # One read per collection, in row order, so each archive segment is read once
+        found = {}
+        for collection, wanted in rows.items():
+            wanted.sort()
+            found[collection] = dict(zip(wanted, history.records(collection, wanted)))
+        hits = []
+        for collection, row, timestamp in results:
+            record = found.get(collection, {}).get(row)
+            # A record that moved since it was indexed is left out
+            if record is not None and record['date'] == timestamp:
+                hits.append((collection, record))
+        return hits
+
     #advance analytics and reporting
     def generate_weekly_report(self):
         """Generate detailed weekly wellness report"""
+        import analytics
+        import plotly.express as px
         st.subheader("Weekly Wellness Report")
         
-        if st.session_state.mood_data:
-            df = pd.DataFrame(st.session_state.mood_data)
-            df['date'] = pd.to_datetime(df['date'])
-            
+        if self.count('mood_data'):
             # Weekly averages
-            weekly_stats = df.set_index('date').resample('W').agg({
-                'mood_value': 'mean'
-            }).reset_index()
-            
             # Create visualization
-            fig = px.line(weekly_stats, x='date', y='mood_value',
-                         title='Weekly Mood Trends',
-                         labels={'mood_value': 'Average Mood', 'date': 'Week'})
-            st.plotly_chart(fig)
+            fig = self.figure('weekly_mood', ['mood_data'], lambda: px.line(
+                analytics.weekly_mood(self.rollups()), x='date', y='mood_value',
+                title='Weekly Mood Trends',
+                labels={'mood_value': 'Average Mood', 'date': 'Week'}))
+            self.plotly_chart(fig)
     #meditation Timer
     def meditation_timer(self):
-        """Add meditation timer feature"""
+        """Meditation timer that follows wall-clock time instead of sleeping in the script run"""
         st.subheader("Meditation Timer")
-        time = st.slider("Session Duration (minutes)", 1, 60, 15)
-        
-        duration = st.slider("Duration (minutes)", 1, 60, 5)
-        if 'meditation_active' not in st.session_state:
-            st.session_state.meditation_active = False
-        
+        duration = st.slider("Session Duration (minutes)", 1, 60, 15)
+
         if st.button("Start Meditation"):
-            st.session_state.meditation_active = True
-            
-        if st.session_state.meditation_active:
-            progress_bar = st.progress(0)
-            for i in range(duration * 60):
-                time.sleep(1)
-                progress_bar.progress((i + 1) / (duration * 60))
+            self.set_meditation_session({'started': time.time(), 'minutes': duration})
+
+        if st.session_state.meditation_session:
+            self.meditation_progress()
+        elif 'meditation_logged' in st.session_state:
+            logged = st.session_state.pop('meditation_logged')
+            if logged is True:
+                st.success("Meditation session logged as an activity!")
+            else:
+                st.error(f"Saving the meditation session failed: {logged}. Nothing was saved.")
+
+    def set_meditation_session(self, session):
+        """Start a meditation session, or clear it with None"""
+        st.session_state.meditation_session = session
+        st.session_state.meditation_active = session is not None
+        with pipeline(self.store) as store:
+            store.set_value('meditation_session', session)
+            store.set_value('meditation_active', session is not None)
+
+    @st.fragment(run_every=1)
+    def meditation_progress(self):
+        """Progress of the running session, redrawn every second on a fragment rerun"""
+        session = st.session_state.meditation_session
+        if not session:
+            return
+        total = session['minutes'] * 60
+        elapsed = time.time() - session['started']
+        if elapsed < total:
+            remaining = int(total - elapsed)
+            st.progress(elapsed / total, text=f"{remaining // 60:02d}:{remaining % 60:02d} remaining")
+            if st.button("Stop Meditation"):
+                self.set_meditation_session(None)
+                st.rerun()
+            return
+
+        # Completed sessions are logged as Meditation activities
+        activity_entry = {
+            "date": int(time.time()),
+            "activity": "Meditation",
+            "duration": session['minutes']
+        }
+        self.save_data('activities', activity_entry)
+        self.set_meditation_session(None)
+        # Shown after the rerun: True, or the error that kept the activity from being saved
+        st.session_state.meditation_logged = self.save_error or True
+        st.rerun()
+
     #CUstomizable tags and categories
     def manage_custom_tags(self):
         """Manage custom tags for activities and moods"""
         st.subheader("Manage Custom Tags")
         
-        if 'custom_tags' not in st.session_state:
-            st.session_state.custom_tags = []
-        
         new_tag = st.text_input("Add New Tag")
         if st.button("Add Tag") and new_tag:
-            st.session_state.custom_tags.append(new_tag)
-            self.save_data()
+            self.confirm_saved("Tag added", self.save_data('custom_tags', new_tag))
     
     # def add_custom_tags(self):
     #     """Add custom tags for categorization"""
@@ -583,40 +900,78 @@ class MentalHealthApp:
         """Export user data in various formats"""
         st.subheader("Export Your Data")
     # add a format selection for the export button
-        export_format = st.selectbox("Select Export Format", ["CSV", "JSON", "EXCEL"])
+        export_format = st.selectbox("Select Export Format", list(EXPORT_FORMATS))
         
         
         if st.button("Export Data"):
-            data = {
-                'mood_data': pd.DataFrame(st.session_state.mood_data),
-                'activities': pd.DataFrame(st.session_state.activities),
-                'sleep_data': pd.DataFrame(st.session_state.sleep_data)
-            }
-            VALID_FORMATS = {"CSV", "JSON", "EXCEL"}
-            
-            for name, df in data.items():
-                # Convert to uppercase for case-insensitive comparison
-                format_upper = export_format.upper()
-                
-                if format_upper not in VALID_FORMATS:
-                    raise ValueError(f"Invalid export format: {export_format}. Must be one of {VALID_FORMATS}")
-                    
-                if format_upper == "CSV":
-                    df.to_csv(f"{name}.csv", index=False)
-                elif format_upper == "JSON":
-                    df.to_json(f"{name}.json", orient="records")
-                elif format_upper == "EXCEL":
-                    df.to_excel(f"{name}.xlsx", index=False)
-            
-           
-    
-    
-    
+            try:
+                # Archived months stream into the tables one segment at a time
+                archive = export_archive(self.history(), export_format)
+            except FileNotFoundError:
+                # The data was rewritten since this session loaded it
+                self.load_data()
+                archive = export_archive(self.history(), export_format)
+            # The download button serves bytes, so only the compressed archive is read into memory
+            with archive:
+                archive_bytes = archive.read()
+            st.download_button("Download Export", data=archive_bytes,
+                               file_name="mental_health_export.zip",
+                               mime="application/zip")
+
+
+def select_user():
+    """Pick the user whose data shard this session reads and writes"""
+    user_id = st.sidebar.text_input("User ID", value=st.query_params.get("user", DEFAULT_USER))
+    user_id = user_id.strip() or DEFAULT_USER
+    if st.session_state.get('user_id') != user_id:
+        reset_user_state(user_id)
+    return user_id
+
+def reset_user_state(user_id):
+    """Start the session's per-user state over for another user"""
+    st.session_state.data = ColumnarStore()
+    st.session_state.data_shared = False
+    st.session_state.frame_cache = FrameCache()
+    st.session_state.figure_cache = FigureCache()
+    st.session_state.aggregates = AggregateEngine()
+    st.session_state.rollups = RollupEngine()
+    st.session_state.table_pages = {}
+    st.session_state.archive = {}
+    st.session_state.stored_counts = dict.fromkeys(COLLECTIONS, 0)
+    st.session_state.appended = set()
+    st.session_state.user_id = user_id
+
+def show_profile():
+    """Sidebar debug panel with the timings of this server process"""
+    with st.sidebar.expander("🔧 Profiling"):
+        st.dataframe([
+            {'call': row['name'], 'calls': row['calls'],
+             'p50 ms': round(row['p50'] * 1000, 1), 'p95 ms': round(row['p95'] * 1000, 1),
+             'rows': round(row['rows']), 'read KB': round(row['bytes_read'] / 1024, 1),
+             'written KB': round(row['bytes_written'] / 1024, 1)}
+            for row in profiling.profiler.summary()
+        ], hide_index=True)
+        stats = load_cache.stats()
+        st.caption(f"Load cache: {stats['hits']} hits, {stats['misses']} misses, "
+                   f"{stats['entries']} files, {stats['bytes'] / 2**20:.1f} of "
+                   f"{stats['max_bytes'] / 2**20:.0f} MB")
+        stats = st.session_state.figure_cache.stats()
+        st.caption(f"Figure cache: {stats['hits']} hits, {stats['misses']} misses, "
+                   f"{stats['entries']} figures, {stats['bytes'] / 2**20:.1f} of "
+                   f"{stats['max_bytes'] / 2**20:.0f} MB")
+        st.caption(f"Metrics file: {profiling.METRICS_FILE}")
 
 def main():
-    app = MentalHealthApp()
-    app.load_data()
-    app.main_page()
+    init_session_state()
+    try:
+        app = MentalHealthApp(select_user())
+    except ValueError as e:
+        st.error(str(e))
+        return
+    with profiling.span("rerun"):
+        app.main_page()
+    if profiling.ENABLED:
+        show_profile()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,229 @@
+"""Upgrade data files written in an older schema to the current one
+
+Version 1 data files kept dates as local-time strings; version 2 keeps them as
+Unix timestamps next to the name of the timezone they are shown in. The JSON
+data file is upgraded as a stream, one record at a time, into a temporary file
+that then replaces it, so a large history is never held in memory as a whole.
+The record log does this on its first load of an old file; the conversion can
+also be run by hand:
+
+    python migrate.py mental_health_data.json [TIMEZONE]
+"""
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+from records import DATE_FIELDS, SCHEMA_VERSION, local_timezone, to_timestamp
+
+CHUNK_SIZE = 64 * 1024
+
+
+class JsonStream:
+    """Reads a top-level JSON object, handing out its arrays one element at a time"""
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self._file = f
+        self._chunk_size = chunk_size
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def items(self):
+        """(key, value) pairs of the object; array values are iterators over their elements"""
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            key = self._decode()
+            self._expect(':')
+            if self._peek() == '[':
+                elements = self._array()
+                yield key, elements
+                # Skip whatever the caller left of the array
+                for _ in elements:
+                    pass
+            else:
+                yield key, self._decode()
+            if self._next_char() == '}':
+                return
+
+    def _array(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._decode()
+            if self._next_char() == ']':
+                return
+
+    def _decode(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+                self._fill()
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self._buffer) and not self._eof:
+                self._fill()
+                continue
+            self._pos = end
+            return value
+
+    def _expect(self, char):
+        if self._next_char() != char:
+            raise ValueError(f"Invalid data file: expected {char!r} at offset {self._pos}")
+
+    def _next_char(self):
+        char = self._peek()
+        self._pos += 1
+        return char
+
+    def _peek(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos].isspace():
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if self._eof:
+                raise ValueError("Invalid data file: unexpected end of file")
+            self._fill()
+
+    def _fill(self):
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+
+
+def upgrade_record(collection, record, timezone):
+    """Turn the date strings of a record into Unix timestamps, in place"""
+    for field in DATE_FIELDS.get(collection, []):
+        value = record.get(field)
+        if isinstance(value, str):
+            record[field] = to_timestamp(datetime.fromisoformat(value), timezone)
+    return record
+
+
+def upgrade_data(data, timezone=None):
+    """Upgrade a whole dataset in the data file layout, in place"""
+    if data.get('schema_version', 1) >= SCHEMA_VERSION:
+        return data
+    timezone = timezone or local_timezone()
+    for collection in DATE_FIELDS:
+        for record in data.get(collection, []):
+            upgrade_record(collection, record, timezone)
+    upgraded = {'schema_version': SCHEMA_VERSION, 'timezone': timezone}
+    upgraded.update((key, value) for key, value in data.items() if key not in upgraded)
+    data.clear()
+    data.update(upgraded)
+    return data
+
+
+def read_schema(path):
+    """Schema version and timezone of a data file; None for a missing file"""
+    try:
+        with open(path, 'r') as f:
+            items = JsonStream(f).items()
+            first = next(items, None)
+            if first is None or first[0] != 'schema_version':
+                return 1, None
+            second = next(items, None)
+            timezone = second[1] if second and second[0] == 'timezone' else None
+            return first[1], timezone
+    except FileNotFoundError:
+        return None
+
+
+def migrate_file(path, target=None, timezone=None):
+    """Stream a data file into the current schema, in place or into `target`
+
+    Legacy dates are read as wall-clock times in `timezone`, by default the
+    local one. Returns the timezone of the upgraded file.
+    """
+    target = target or path
+    directory = os.path.dirname(target) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with open(path, 'r') as source, os.fdopen(fd, 'w') as out:
+            items = JsonStream(source).items()
+            first = next(items, None)
+            pending = []
+            if first is not None and first[0] == 'schema_version':
+                second = next(items, None)
+                if second is not None and second[0] == 'timezone':
+                    timezone = second[1] or timezone
+                elif second is not None:
+                    pending.append(second)
+            elif first is not None:
+                pending.append(first)
+            timezone = timezone or local_timezone()
+            out.write(f'{{"schema_version": {SCHEMA_VERSION}, "timezone": {json.dumps(timezone)}')
+            for key, value in _chain(pending, items):
+                out.write(f', {json.dumps(key)}: ')
+                if not hasattr(value, '__next__'):
+                    json.dump(value, out)
+                    continue
+                out.write('[')
+                for i, element in enumerate(value):
+                    if i:
+                        out.write(', ')
+                    json.dump(upgrade_record(key, element, timezone), out)
+                out.write(']')
+            out.write('}')
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return timezone
+
+
+def migrate_log(path, timezone, target=None):
+    """Upgrade the appended records of a record log, in place or into `target`"""
+    target = target or path
+    try:
+        source = open(path, 'r')
+    except FileNotFoundError:
+        return
+    directory = os.path.dirname(target) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with source, os.fdopen(fd, 'w') as out:
+            for line in source:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn last line from an interrupted write
+                    break
+                if entry['op'] == 'append':
+                    upgrade_record(entry['collection'], entry['record'], timezone)
+                out.write(json.dumps(entry) + '\n')
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _chain(pending, items):
+    yield from pending
+    yield from items
+
+
+if __name__ == "__main__":
+    from record_log import open_log
+
+    if len(sys.argv) not in (2, 3):
+        sys.exit("usage: python migrate.py DATA_FILE [TIMEZONE]")
+    open_log(sys.argv[1]).migrate(sys.argv[2] if len(sys.argv) == 3 else None)
@@ -0,0 +1,183 @@
+"""Timing of reruns, pages, charts and storage calls
+
+Profiling is off unless the MHT_PROFILE environment variable names a metrics
+file. When it is on, every timed call (a rerun, the page it rendered, each
+chart, ``load_data`` and ``save_data``) appends one JSON line to that file:
+
+    {"name": "page:Dashboard", "start": 1760000000.0, "seconds": 0.041,
+     "rows": 120, "bytes_read": 0, "bytes_written": 0}
+
+Rows and bytes are counted by the code doing the work through ``count``, and
+credited to every call open on the thread at the time, so a page includes the
+loads and charts it triggered. The app's sidebar then shows a debug panel with
+the calls of the current process, and the file can be summarized across
+processes and runs:
+
+    python profiling.py metrics.jsonl
+
+When profiling is off, ``timed`` hands back the function it decorates
+unchanged, ``span`` a shared do-nothing context and ``count`` returns at once,
+so the hooks cost a function call at most.
+"""
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+METRICS_FILE = os.environ.get("MHT_PROFILE") or None
+ENABLED = METRICS_FILE is not None
+
+# Durations kept per name for the in-process summary
+SAMPLES_PER_NAME = 1000
+
+COUNTERS = ('rows', 'bytes_read', 'bytes_written')
+
+
+class Span:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def __enter__(self):
+        self.profiler.stack().append(self)
+        self.start = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self._started
+        self.profiler.stack().remove(self)
+        self.profiler.record({
+            'name': self.name,
+            'start': round(self.start, 3),
+            'seconds': round(seconds, 6),
+            'rows': self.rows,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+        })
+        return False
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class Profiler:
+    def __init__(self, path):
+        self.path = path
+        self.samples = defaultdict(lambda: deque(maxlen=SAMPLES_PER_NAME))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def stack(self):
+        """Spans open on the calling thread, outermost first"""
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def count(self, rows=0, bytes_read=0, bytes_written=0):
+        """Credit rows and bytes to every span open on the calling thread"""
+        for span in self.stack():
+            span.rows += rows
+            span.bytes_read += bytes_read
+            span.bytes_written += bytes_written
+
+    def record(self, sample):
+        """Keep a finished span's sample and append it to the metrics file"""
+        line = json.dumps(sample) + '\n'
+        with self._lock:
+            self.samples[sample['name']].append(sample)
+            try:
+                with open(self.path, 'a') as f:
+                    f.write(line)
+            except OSError:
+                # Metrics are best effort; the app keeps running without them
+                pass
+
+    def summary(self):
+        """Summary rows of the samples kept in this process"""
+        with self._lock:
+            samples = {name: list(kept) for name, kept in self.samples.items()}
+        return summarize(samples)
+
+
+def summarize(samples):
+    """Calls, p50/p95/max seconds and mean rows and bytes per name, slowest p95 first"""
+    rows = []
+    for name, kept in samples.items():
+        seconds = np.array([sample['seconds'] for sample in kept])
+        p50, p95 = np.percentile(seconds, [50, 95])
+        row = {'name': name, 'calls': len(kept), 'p50': p50, 'p95': p95, 'max': seconds.max()}
+        for counter in COUNTERS:
+            row[counter] = sum(sample[counter] for sample in kept) / len(kept)
+        rows.append(row)
+    rows.sort(key=lambda row: row['p95'], reverse=True)
+    return rows
+
+
+def read_metrics(path):
+    """Samples of a metrics file grouped by name"""
+    samples = defaultdict(list)
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                sample = json.loads(line)
+            except ValueError:
+                # A torn last line from an interrupted write
+                continue
+            samples[sample['name']].append(sample)
+    return samples
+
+
+profiler = Profiler(METRICS_FILE) if ENABLED else None
+_null_span = NullSpan()
+
+
+def span(name):
+    """Context timing a block under a name"""
+    if profiler is None:
+        return _null_span
+    return Span(profiler, name)
+
+
+def timed(name):
+    """Decorator timing every call of a function under a name"""
+    def decorate(function):
+        if profiler is None:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Span(profiler, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(rows=0, bytes_read=0, bytes_written=0):
+    """Credit rows and bytes to the calls being timed on this thread"""
+    if profiler is not None:
+        profiler.count(rows, bytes_read, bytes_written)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python profiling.py METRICS_FILE")
+    print(f"{'name':<32} {'calls':>7} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} "
+          f"{'rows':>9} {'read KB':>9} {'written KB':>10}")
+    for row in summarize(read_metrics(sys.argv[1])):
+        print(f"{row['name']:<32} {row['calls']:>7} {row['p50'] * 1000:>9.1f} "
+              f"{row['p95'] * 1000:>9.1f} {row['max'] * 1000:>9.1f} {row['rows']:>9.0f} "
+              f"{row['bytes_read'] / 1024:>9.1f} {row['bytes_written'] / 1024:>10.1f}")
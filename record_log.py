@@ -0,0 +1,389 @@
+"""Append-only record log for the tracker data file
+
+Logging a mood, activity, sleep or journal entry writes a single JSON line to
+``<data file>.log`` instead of rewriting the whole data file. Once enough lines
+pile up, the log is folded back into the data file (the snapshot) on a
+background thread.
+
+Each log file starts with a header line carrying a unique id, and the snapshot
+remembers the id of the last log folded into it, so a fold interrupted between
+replacing the snapshot and deleting the log is never replayed twice. Writers
+and readers take advisory file locks, so several sessions or server processes
+can share one data file; the snapshot itself is only ever replaced by an
+atomic rename of a fully written temporary file.
+
+Next to the snapshot, a binary copy in the memory-mapped format of
+``snapshot_format`` is kept, tagged with the identity of the JSON file it was
+built from. ``load_store`` reads that copy instead of parsing the JSON whenever
+it is current, and rebuilds it when it is not. Its result is kept in the
+process-wide ``load_cache`` until one of the files changes.
+
+Folding also moves the months before the hot window into compressed archive
+segments (see ``archive``). ``load`` returns the whole history, archive
+included; ``load_store`` only the hot records, with the archive listing in its
+settings for ``load_archive``. The data file's ``_generation`` changes whenever
+records are renumbered, by a rewrite or by moving months into the archive, and
+only then.
+
+Folding also saves the data file's search index, when this process has it
+open.
+
+Data files and logs written in an older schema are upgraded by ``migrate`` on
+the first load in each process.
+"""
+import json
+import os
+import tempfile
+import threading
+import uuid
+
+import archive
+from columnar import ColumnarStore
+import profiling
+from file_lock import file_lock
+from load_cache import file_identity, load_cache
+from migrate import migrate_file, migrate_log, read_schema
+from records import COLLECTIONS, FIELDS, SCHEMA_VERSION, SETTINGS, empty_data, local_timezone
+from registry import Registry
+from search_index import save_open_index
+from snapshot_format import SNAPSHOT_KEYS, Snapshot, write_snapshot
+
+# Number of log lines after which a background compaction is started
+COMPACT_EVERY = 200
+
+
+class RecordLog:
+    def __init__(self, snapshot_path, compact_every=COMPACT_EVERY):
+        self.snapshot_path = snapshot_path
+        self.log_path = snapshot_path + '.log'
+        self.folding_path = snapshot_path + '.log.folding'
+        self.binary_path = os.path.splitext(snapshot_path)[0] + '.mhts'
+        self.archive_dir = os.path.splitext(snapshot_path)[0] + '.archive'
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._compactor = None
+        self._migrated = False
+        self._pending = self._count_lines(self.log_path)
+
+    def load(self):
+        """Rebuild the whole dataset from the archive, the snapshot and the log tail"""
+        self.migrate()
+        with file_lock(self.snapshot_path, shared=True):
+            data = self._read_snapshot()
+            self._replay(data, self.folding_path)
+            self._replay(data, self.log_path)
+            listing = data.pop('_archive', None)
+            if listing:
+                archived = archive.read_segments(self.archive_dir, listing, data['timezone'])
+                for collection in FIELDS:
+                    data[collection] = archived[collection] + data[collection]
+        return data
+
+    def load_store(self):
+        """Columnar store and settings of the snapshot plus the log tail
+
+        The result is shared through the process-wide load cache until one of
+        the files changes, so it must not be modified.
+        """
+        self.migrate()
+        with file_lock(self.snapshot_path, shared=True):
+            identity = tuple(file_identity(path)
+                             for path in (self.snapshot_path, self.folding_path, self.log_path))
+            return load_cache.get(self.snapshot_path, identity, self._load_store,
+                                  lambda loaded: loaded[0].nbytes())
+
+    def load_archive(self, listing, timezone):
+        """Columnar store of the listed archive segments, shared through the load cache
+
+        Raises FileNotFoundError when a listed segment is gone because the data
+        was rewritten since the listing was loaded.
+        """
+        with file_lock(self.snapshot_path, shared=True):
+            return load_cache.get(self.archive_dir, tuple(sorted(listing)),
+                                  lambda: ColumnarStore.from_data(
+                                      archive.read_segments(self.archive_dir, listing, timezone)),
+                                  lambda store: store.nbytes())
+
+    def migrate(self, timezone=None):
+        """Upgrade a data file and its logs from an older schema; checked once per process
+
+        Legacy dates are read as wall-clock times in `timezone`, by default the
+        local one.
+        """
+        if self._migrated:
+            return
+        schema = read_schema(self.snapshot_path)
+        if schema is not None and schema[0] < SCHEMA_VERSION:
+            self.wait_for_compaction()
+            with self._lock, file_lock(self.folding_path), file_lock(self.snapshot_path):
+                if read_schema(self.snapshot_path)[0] < SCHEMA_VERSION:
+                    timezone = timezone or local_timezone()
+                    # The logs go first: once the snapshot is current, so are they
+                    for path in (self.folding_path, self.log_path):
+                        migrate_log(path, timezone)
+                    migrate_file(self.snapshot_path, timezone=timezone)
+        self._migrated = True
+
+    def append(self, collection, record):
+        """Append one record of a collection to the log"""
+        self._write([{'op': 'append', 'collection': collection, 'record': record}])
+        profiling.count(rows=1)
+
+    def append_many(self, collection, records):
+        """Append records of a collection to the log in one write
+
+        Unlike `append` this never starts a compaction; bulk writers call
+        `compact` once they are done.
+        """
+        self._write([{'op': 'append', 'collection': collection, 'record': record}
+                     for record in records], compact=False)
+        profiling.count(rows=len(records))
+
+    def append_batch(self, records, sync=False):
+        """Append (collection, record) pairs to the log in one write, forced to disk when `sync`"""
+        self._write([{'op': 'append', 'collection': collection, 'record': record}
+                     for collection, record in records], sync=sync)
+        profiling.count(rows=len(records))
+
+    def set_value(self, key, value):
+        """Record a new value for a single setting"""
+        self._write([{'op': 'set', 'key': key, 'value': value}])
+
+    def write_snapshot(self, data):
+        """Replace the snapshot with a full dataset and drop the log
+
+        A dataset with an ``_archive`` listing holds the hot records of those
+        segments, as ``load_store`` returns them; one without it is the whole
+        history, archived afresh.
+        """
+        self.wait_for_compaction()
+        # Holding the folding lock keeps other processes from folding meanwhile
+        with self._lock, file_lock(self.folding_path), file_lock(self.snapshot_path):
+            data = dict(data)
+            data.pop('_folded', None)
+            data['_generation'] = uuid.uuid4().hex
+            profiling.count(rows=sum(len(data.get(collection, [])) for collection in COLLECTIONS))
+            data = self._archive(data)
+            self._write_file(data)
+            for path in (self.folding_path, self.log_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._pending = 0
+            archive.remove_unlisted(self.archive_dir, data.get('_archive') or {})
+
+    def archive_months(self):
+        """Move the months before the hot window out of the snapshot now; returns the moved counts"""
+        self.compact(background=False)
+        with self._lock, file_lock(self.folding_path), file_lock(self.snapshot_path):
+            data = self._read_snapshot()
+            hot = self._archive(data)
+            moved = archive.archived_counts({name: counts for name, counts in (hot.get('_archive') or {}).items()
+                                             if name not in (data.get('_archive') or {})})
+            if any(moved.values()):
+                self._write_file(hot)
+            archive.remove_unlisted(self.archive_dir, hot.get('_archive') or {})
+        return moved
+
+    def compact(self, background=True):
+        """Fold the log into the snapshot, on a background thread by default"""
+        self.migrate()
+        with self._lock, file_lock(self.snapshot_path):
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            # A leftover folding file from an interrupted run is folded first
+            if not os.path.exists(self.folding_path) and os.path.exists(self.log_path):
+                os.replace(self.log_path, self.folding_path)
+                self._pending = 0
+            if not os.path.exists(self.folding_path):
+                return
+            self._compactor = threading.Thread(target=self._fold, daemon=True)
+        if background:
+            self._compactor.start()
+        else:
+            self._compactor.run()
+
+    def wait_for_compaction(self):
+        """Block until a running background compaction has finished"""
+        compactor = self._compactor
+        if compactor is not None and compactor.is_alive():
+            compactor.join()
+
+    def _write(self, entries, compact=True, sync=False):
+        self.migrate()
+        lines = ''.join(json.dumps(entry) + '\n' for entry in entries)
+        with self._lock, file_lock(self.snapshot_path):
+            # Unbuffered, so a failed write can be cut off without leftovers
+            with open(self.log_path, 'ab', buffering=0) as f:
+                start = f.tell()
+                if start == 0:
+                    lines = json.dumps({'op': 'header', 'id': uuid.uuid4().hex}) + '\n' + lines
+                raw = memoryview(lines.encode())
+                try:
+                    while raw:
+                        raw = raw[f.write(raw):]
+                    if sync:
+                        os.fsync(f.fileno())
+                except BaseException:
+                    # Replay stops at a torn line, which would hide the records of a retry
+                    os.ftruncate(f.fileno(), start)
+                    raise
+                profiling.count(bytes_written=f.tell() - start)
+            self._pending += len(entries)
+            due = compact and self._pending >= self.compact_every
+        if due:
+            self.compact()
+
+    def _fold(self):
+        # Only one process folds at a time; the others leave it to that one
+        with file_lock(self.folding_path, blocking=False) as acquired:
+            if not acquired:
+                return
+            with file_lock(self.snapshot_path, shared=True):
+                if not os.path.exists(self.folding_path):
+                    return
+                data = self._read_snapshot()
+            # Nobody else writes the snapshot or the folding file while we hold
+            # the folding lock, so the slow part runs without the data lock
+            self._replay(data, self.folding_path)
+            data['_folded'] = self._log_id(self.folding_path)
+            # Segments are written before the snapshot listing them
+            data = self._archive(data)
+            with file_lock(self.snapshot_path):
+                self._write_file(data)
+                os.remove(self.folding_path)
+                source = self._identity()
+                archive.remove_unlisted(self.archive_dir, data.get('_archive') or {})
+            settings = {key: data[key] for key in SNAPSHOT_KEYS if key in data}
+            self._write_binary(ColumnarStore.from_data(data), settings, source)
+        save_open_index(self.snapshot_path)
+
+    def _archive(self, data):
+        # Runs under the folding lock, which every segment writer holds
+        days = archive.hot_days()
+        if not days:
+            return data
+        hot, months = archive.split(data, days)
+        listing = dict(data.get('_archive') or {})
+        for month, records in sorted(months.items()):
+            name = archive.write_segment(self.archive_dir, month, records)
+            listing[name] = {collection: len(kept) for collection, kept in records.items()}
+        if listing:
+            hot['_archive'] = listing
+        if months:
+            hot['_generation'] = uuid.uuid4().hex
+        return hot
+
+    def _write_file(self, data):
+        directory = os.path.dirname(self.snapshot_path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+                profiling.count(bytes_written=f.tell())
+            os.replace(tmp_path, self.snapshot_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _load_store(self):
+        # Runs under the shared data lock
+        source = self._identity()
+        store, settings = self._read_binary(source)
+        current = store is not None
+        if not current:
+            data = self._read_snapshot()
+            store = ColumnarStore.from_data(data)
+            settings = {key: data[key] for key in SNAPSHOT_KEYS if key in data}
+        tail = empty_data()
+        tail.update(settings)
+        self._replay(tail, self.folding_path)
+        self._replay(tail, self.log_path)
+        if not current and source is not None:
+            self._write_binary(store, settings, source)
+        store.extend(tail)
+        if profiling.ENABLED:
+            read = [self.binary_path if current else self.snapshot_path, self.folding_path, self.log_path]
+            profiling.count(rows=sum(store.count(collection) for collection in COLLECTIONS),
+                            bytes_read=sum((file_identity(path) or (0, 0))[1] for path in read))
+        settings = {key: tail[key] for key in SETTINGS}
+        settings['_archive'] = tail.get('_archive') or {}
+        settings['_generation'] = tail.get('_generation')
+        return store, settings
+
+    def _identity(self):
+        identity = file_identity(self.snapshot_path)
+        return list(identity) if identity else None
+
+    def _read_binary(self, source):
+        if source is None:
+            return None, None
+        try:
+            with Snapshot(self.binary_path) as snapshot:
+                if snapshot.source != source:
+                    return None, None
+                return snapshot.to_store(), dict(snapshot.settings)
+        except (FileNotFoundError, ValueError):
+            return None, None
+
+    def _write_binary(self, store, settings, source):
+        try:
+            write_snapshot(self.binary_path, store, settings, source)
+            if profiling.ENABLED:
+                profiling.count(bytes_written=os.path.getsize(self.binary_path))
+        except OSError:
+            # The binary copy only speeds up loading; the JSON stays authoritative
+            pass
+
+    def _read_snapshot(self):
+        data = empty_data()
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                data.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        return data
+
+    def _replay(self, data, path):
+        entries = self._entries(path)
+        header = next(entries, None)
+        if header is None or header.get('id') == data.get('_folded'):
+            return
+        for entry in entries:
+            if entry['op'] == 'append':
+                data.setdefault(entry['collection'], []).append(entry['record'])
+            elif entry['op'] == 'set':
+                data[entry['key']] = entry['value']
+
+    def _log_id(self, path):
+        header = next(self._entries(path), None)
+        return header.get('id') if header else None
+
+    def _entries(self, path):
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # A torn last line from an interrupted write
+                        return
+        except FileNotFoundError:
+            return
+
+    def _count_lines(self, path):
+        try:
+            with open(path, 'r') as f:
+                return sum(1 for _ in f)
+        except FileNotFoundError:
+            return 0
+
+
+_logs = Registry()
+
+
+def open_log(snapshot_path):
+    """Return the process-wide record log for a data file"""
+    snapshot_path = os.path.abspath(snapshot_path)
+    return _logs.get(snapshot_path, lambda: RecordLog(snapshot_path))
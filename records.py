@@ -0,0 +1,117 @@
+"""Record collections stored in the tracker's data file"""
+import os
+from datetime import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Collections that grow one record at a time
+COLLECTIONS = ['mood_data', 'activities', 'sleep_data', 'goals', 'journal_entries', 'custom_tags']
+
+# Version of the data file layout: version 1 kept dates as local-time strings,
+# version 2 keeps them as Unix timestamps plus the timezone they are shown in
+SCHEMA_VERSION = 2
+
+# Fields of each record type; the first one is the record's date
+FIELDS = {
+    'mood_data': ['date', 'mood', 'mood_value', 'notes'],
+    'activities': ['date', 'activity', 'duration'],
+    'sleep_data': ['date', 'hours', 'quality'],
+    'goals': ['created_date', 'type', 'target', 'deadline'],
+    'journal_entries': ['date', 'title', 'content'],
+}
+
+# Single values stored next to the collections, with their defaults
+SETTINGS = {'meditation_active': False, 'meditation_session': None}
+
+# Fields holding dates, stored as Unix timestamps in seconds
+DATE_FIELDS = {
+    'mood_data': ['date'],
+    'activities': ['date'],
+    'sleep_data': ['date'],
+    'goals': ['created_date', 'deadline'],
+    'journal_entries': ['date'],
+}
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Values the tracking pages accept, shared with the bulk importer
+MOOD_SCALE = {"Excellent": 5, "Good": 4, "Neutral": 3, "Low": 2, "Very Low": 1}
+ACTIVITIES = ["Exercise", "Meditation", "Reading", "Socializing", "Therapy", "Other"]
+DURATION_RANGE = (5, 150)
+SLEEP_HOURS_RANGE = (0.0, 24.0)
+SLEEP_QUALITIES = ["Poor", "Fair", "Good", "Excellent"]
+
+# How dates are written for people; sleep, goals and journal entries keep the day only
+DATE_FORMAT = "%Y-%m-%d %H:%M"
+DAY_FORMAT = "%Y-%m-%d"
+DATE_FORMATS = {
+    'mood_data': DATE_FORMAT,
+    'activities': DATE_FORMAT,
+    'sleep_data': DAY_FORMAT,
+    'goals': DAY_FORMAT,
+    'journal_entries': DAY_FORMAT,
+}
+
+
+def local_timezone():
+    """Name of the timezone new data files are kept in
+
+    Taken from the MHT_TIMEZONE or TZ environment variable, else from the
+    system's /etc/localtime, else UTC.
+    """
+    name = os.environ.get("MHT_TIMEZONE") or os.environ.get("TZ", "").lstrip(':')
+    if not name:
+        path = os.path.realpath('/etc/localtime')
+        name = path.split('zoneinfo/', 1)[1] if 'zoneinfo/' in path else "UTC"
+    try:
+        zone(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return "UTC"
+    return name
+
+
+@lru_cache(maxsize=None)
+def zone(name):
+    """tzinfo of a timezone name"""
+    return ZoneInfo(name)
+
+
+def to_timestamp(when, timezone):
+    """Unix timestamp of a datetime; naive ones are wall-clock times in `timezone`"""
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=zone(timezone))
+    return int(when.timestamp())
+
+
+def from_timestamp(timestamp, timezone):
+    """Naive wall-clock datetime in `timezone` of a Unix timestamp"""
+    return datetime.fromtimestamp(timestamp, zone(timezone)).replace(tzinfo=None)
+
+
+def day_timestamp(day, timezone):
+    """Unix timestamp of the start of a day in `timezone`"""
+    return to_timestamp(datetime(day.year, day.month, day.day), timezone)
+
+
+def today(timezone):
+    """The current date in `timezone`"""
+    return datetime.now(zone(timezone)).date()
+
+
+def format_timestamp(timestamp, timezone, date_format):
+    """A Unix timestamp written as a wall-clock time in `timezone`"""
+    return from_timestamp(timestamp, timezone).strftime(date_format)
+
+
+def record_time(collection, record):
+    """Unix timestamp of a record"""
+    return record[FIELDS[collection][0]]
+
+
+def empty_data(timezone=None):
+    """Return an empty dataset in the data file layout"""
+    # The schema keys come first, so a reader can check them before the records
+    data = {'schema_version': SCHEMA_VERSION, 'timezone': timezone or local_timezone()}
+    data.update({name: [] for name in COLLECTIONS})
+    data.update(SETTINGS)
+    return data
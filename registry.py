@@ -0,0 +1,42 @@
+"""Process-wide registries of the objects kept per data file
+
+Record logs, SQLite stores and search indexes are opened once per data file
+and shared by every session of the process. A registry hands out the one live
+object of a file, and keeps the MHT_OPEN_SHARDS (default 32) most recently
+opened ones alive between reruns. Older ones are dropped once nobody uses
+them any more, so a server that sees many users does not keep every shard's
+objects, threads and connections for its whole life.
+"""
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+DEFAULT_OPEN_SHARDS = 32
+
+
+class Registry:
+    def __init__(self, keep=None):
+        if keep is None:
+            keep = int(os.environ.get("MHT_OPEN_SHARDS", DEFAULT_OPEN_SHARDS))
+        self.keep = keep
+        self._live = weakref.WeakValueDictionary()
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, create):
+        """Live object of a key, made by `create()` when there is none"""
+        with self._lock:
+            value = self._live.get(key)
+            if value is None:
+                value = self._live[key] = create()
+            self._recent[key] = value
+            self._recent.move_to_end(key)
+            while len(self._recent) > self.keep:
+                self._recent.popitem(last=False)
+            return value
+
+    def values(self):
+        """Every live object"""
+        with self._lock:
+            return list(self._live.values())
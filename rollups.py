@@ -0,0 +1,144 @@
+"""Materialized day, week and month rollups of the tracked values
+
+For every day, week (ending on Sunday, like pandas' "W") and month (labelled
+by its first day, like "MS") the rollups keep the count, sum, minimum and
+maximum of mood values, sleep hours and activity minutes, plus per-label
+counts and sums of sleep quality and activity type. A table is built once from
+a collection's frame; after that each logged record only updates the three
+buckets it falls into. A collection whose data changed wholesale is only
+marked stale, and rebuilt by whoever reads it next. Reports and long-range
+charts read the buckets, so a year of history costs a few hundred rows however
+many entries it holds.
+"""
+from datetime import timedelta
+
+import numpy as np
+
+from records import DATE_FIELDS, from_timestamp
+
+# Value field and optional label field rolled up for each collection
+ROLLUPS = {
+    'mood_data': ('mood_value', None),
+    'sleep_data': ('hours', 'quality'),
+    'activities': ('duration', 'activity'),
+}
+
+# Bucket sizes from finest to coarsest, with their (longest) length in days
+GRANULARITIES = {'day': 1, 'week': 7, 'month': 31}
+
+
+def bucket(day, granularity):
+    """Label of the bucket a date falls into"""
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day + timedelta(days=6 - day.weekday())
+    return day.replace(day=1)
+
+
+def bucket_labels(dates, granularity):
+    """Bucket labels, as datetime64[D], of a datetime64 array"""
+    days = dates.astype('datetime64[D]')
+    if granularity == 'day':
+        return days
+    if granularity == 'week':
+        # 1970-01-01 was a Thursday; Monday is weekday 0
+        weekdays = (days.astype(np.int64) + 3) % 7
+        return days + (6 - weekdays).astype('timedelta64[D]')
+    return days.astype('datetime64[M]').astype('datetime64[D]')
+
+
+class RollupEngine:
+    def __init__(self):
+        # (collection, granularity) -> {bucket: [count, total, min, max]}
+        self.tables = {}
+        # (collection, granularity) -> {(bucket, label): [count, total]}
+        self.groups = {}
+        # Collections to rebuild before they are read again
+        self.stale = set(ROLLUPS)
+        for collection in ROLLUPS:
+            self._clear(collection)
+
+    def invalidate(self, collection):
+        """Mark a collection's rollups for a rebuild"""
+        self.stale.add(collection)
+
+    def rebuild(self, collection, df):
+        """Refill a collection's rollups from its typed frame"""
+        import pandas as pd
+        self._clear(collection)
+        self.stale.discard(collection)
+        if df.empty:
+            return
+        field, label_field = ROLLUPS[collection]
+        dates = df[DATE_FIELDS[collection][0]].to_numpy()
+        values = df[field].to_numpy(dtype=np.float64)
+        for granularity in GRANULARITIES:
+            buckets = pd.Series(bucket_labels(dates, granularity))
+            stats = pd.Series(values).groupby(buckets).agg(['count', 'sum', 'min', 'max'])
+            self.tables[(collection, granularity)] = {
+                day.date(): [int(count), total, low, high]
+                for day, count, total, low, high in stats.itertuples()
+            }
+            if label_field is not None:
+                labels = df[label_field].astype(object).to_numpy()
+                grouped = pd.Series(values).groupby([buckets, labels]).agg(['count', 'sum'])
+                self.groups[(collection, granularity)] = {
+                    (day.date(), label): [int(count), total]
+                    for (day, label), count, total in grouped.itertuples()
+                }
+
+    def add(self, collection, record, timezone):
+        """Count a newly logged record in the buckets it falls into"""
+        if collection not in ROLLUPS or collection in self.stale:
+            return
+        field, label_field = ROLLUPS[collection]
+        day = from_timestamp(record[DATE_FIELDS[collection][0]], timezone).date()
+        value = float(record[field])
+        for granularity in GRANULARITIES:
+            key = bucket(day, granularity)
+            stats = self.tables[(collection, granularity)].get(key)
+            if stats is None:
+                self.tables[(collection, granularity)][key] = [1, value, value, value]
+            else:
+                stats[0] += 1
+                stats[1] += value
+                stats[2] = min(stats[2], value)
+                stats[3] = max(stats[3], value)
+            if label_field is not None:
+                group = self.groups[(collection, granularity)].setdefault((key, record[label_field]), [0, 0.0])
+                group[0] += 1
+                group[1] += value
+
+    def table(self, collection, granularity):
+        """Frame of date, count, total, mean, min and max per bucket, in date order"""
+        import pandas as pd
+        rows = sorted(self.tables[(collection, granularity)].items())
+        df = pd.DataFrame([[day, *stats] for day, stats in rows],
+                          columns=['date', 'count', 'total', 'min', 'max'])
+        df['date'] = pd.to_datetime(df['date'])
+        df['mean'] = df['total'] / df['count']
+        return df
+
+    def label_table(self, collection, granularity):
+        """Frame of date, label, count and total per bucket and label, in date order"""
+        import pandas as pd
+        _, label_field = ROLLUPS[collection]
+        rows = sorted(self.groups[(collection, granularity)].items())
+        df = pd.DataFrame([[day, label, *stats] for (day, label), stats in rows],
+                          columns=['date', label_field, 'count', 'total'])
+        df['date'] = pd.to_datetime(df['date'])
+        return df
+
+    def span_days(self, collection):
+        """Days from the first to the last day with a record, inclusive"""
+        days = self.tables[(collection, 'day')]
+        if not days:
+            return 0
+        return (max(days) - min(days)).days + 1
+
+    def _clear(self, collection):
+        for granularity in GRANULARITIES:
+            self.tables[(collection, granularity)] = {}
+            if ROLLUPS[collection][1] is not None:
+                self.groups[(collection, granularity)] = {}
@@ -0,0 +1,296 @@
+"""Incremental full-text search over mood notes and journal entries
+
+The index maps every word to the documents (records) it appears in and its
+positions there. It covers a user's whole history, archived months included,
+and is kept current from the data the store itself loads, never from a
+session's copy: before a search, the records beyond the ones already indexed
+are added, so keeping it current costs time proportional to the new text
+only. Queries are answered from the posting lists alone:
+
+    calm walk        both words, anywhere in the entry
+    anx*             any word starting with "anx"
+    "long walk"      the words next to each other, in this order
+
+Results can be narrowed to a date range. The vocabulary is kept sorted, so a
+prefix query is a binary search plus the matching words' postings, never a
+scan over every entry.
+
+Documents are records by row number, which stay the same until the data is
+rewritten or months move into the archive. Each backend then gives its data
+a new generation, and the index starts over.
+
+The index is saved as ``<data file>.search.json`` next to the user's data:
+every SAVE_EVERY new documents, when the record log is folded and when the
+process exits. It remembers the generation and how many records of each
+collection it has indexed, so after a restart only the records saved since
+its last save are indexed again. A save by another process that indexed at
+least as much of the same generation is adopted instead of overwritten.
+"""
+import atexit
+import bisect
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+
+from file_lock import file_lock
+from load_cache import file_identity
+from records import record_time
+from registry import Registry
+
+# Free-text fields indexed for each collection
+TEXT_FIELDS = {
+    'mood_data': ['notes'],
+    'journal_entries': ['title', 'content'],
+}
+
+# New documents after which the index is saved again
+SAVE_EVERY = 50
+
+INDEX_VERSION = 2
+
+TOKEN = re.compile(r"\w+")
+QUERY_PART = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def tokenize(text):
+    """Lowercase words of a text"""
+    return TOKEN.findall(text.lower())
+
+
+class SearchIndex:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # File identity of the save this process last read or wrote
+        self._identity = None
+        self._reset()
+        self._load()
+
+    def sync(self, history, generation):
+        """Index the records of a store's loaded history beyond the ones already indexed
+
+        `history` is what the store itself loaded, archived records first (see
+        ``archive.History``), and `generation` the data generation it loaded.
+        """
+        with self._lock:
+            if generation != self.generation:
+                # Another process may have indexed this generation already
+                self._load()
+            if generation != self.generation or any(history.count(collection) < count
+                                                    for collection, count in self.counts.items()):
+                self._reset()
+                self.generation = generation
+            self._sync(history)
+            if self._unsaved >= SAVE_EVERY:
+                self._save()
+
+    def search(self, query, start=None, end=None, collections=None, limit=50):
+        """(collection, row, timestamp) of the newest matching records
+
+        `start` and `end` bound the dates as Unix timestamps: after `start`
+        and up to `end`.
+        """
+        parts = _parse(query)
+        if not parts:
+            return []
+        with self._lock:
+            candidates = None
+            # The rarest part first, so the other parts only check its documents
+            for matches in sorted((self._matches(part) for part in parts), key=len):
+                candidates = matches if candidates is None else candidates & matches
+                if not candidates:
+                    return []
+            results = []
+            for doc in candidates:
+                collection, row, timestamp = self.docs[doc]
+                if start is not None and timestamp <= start:
+                    continue
+                if end is not None and timestamp > end:
+                    continue
+                if collections is not None and collection not in collections:
+                    continue
+                results.append((collection, row, timestamp))
+        results.sort(key=lambda result: result[2], reverse=True)
+        return results[:limit]
+
+    def save(self):
+        """Write the index next to the data file, if it indexed anything since its last save"""
+        with self._lock:
+            if self._unsaved:
+                self._save()
+
+    def _reset(self):
+        self.generation = None
+        self.counts = {collection: 0 for collection in TEXT_FIELDS}
+        self.docs = []
+        self.postings = {}
+        self.vocabulary = []
+        self._unsaved = 0
+
+    def _sync(self, history):
+        for collection in TEXT_FIELDS:
+            start = self.counts[collection]
+            end = history.count(collection)
+            if end <= start:
+                continue
+            for row, record in enumerate(history.records(collection, range(start, end)), start):
+                self._add(collection, row, record)
+            self.counts[collection] = end
+
+    def _add(self, collection, row, record):
+        doc = len(self.docs)
+        self.docs.append((collection, row, record_time(collection, record)))
+        position = 0
+        for field in TEXT_FIELDS[collection]:
+            for word in tokenize(record.get(field) or ""):
+                postings = self.postings.get(word)
+                if postings is None:
+                    postings = self.postings[word] = {}
+                    bisect.insort(self.vocabulary, word)
+                postings.setdefault(doc, []).append(position)
+                position += 1
+            # A gap keeps phrases from running across fields
+            position += 1
+        self._unsaved += 1
+
+    def _matches(self, part):
+        kind, words = part
+        if kind == 'prefix':
+            prefix = words[0]
+            lo = bisect.bisect_left(self.vocabulary, prefix)
+            hi = bisect.bisect_left(self.vocabulary, prefix + '\U0010ffff')
+            matches = set()
+            for word in self.vocabulary[lo:hi]:
+                matches.update(self.postings[word])
+            return matches
+        postings = [self.postings.get(word, {}) for word in words]
+        matches = set(min(postings, key=len))
+        for word_postings in postings:
+            matches.intersection_update(word_postings)
+        if kind == 'phrase' and len(words) > 1:
+            matches = {doc for doc in matches if _adjacent(postings, doc)}
+        return matches
+
+    def _load(self):
+        # Replaces the index with its last save, if it has one
+        with file_lock(self.path, shared=True):
+            identity = file_identity(self.path)
+            saved = _read(self.path)
+        if saved is None:
+            return
+        self._reset()
+        self._adopt(saved)
+        self._identity = identity
+
+    def _adopt(self, saved):
+        self.generation = saved['generation']
+        self.counts.update(saved['counts'])
+        self.docs = [tuple(doc) for doc in saved['docs']]
+        self.postings = {
+            word: {doc: positions for doc, positions in postings}
+            for word, postings in saved['postings'].items()
+        }
+        self.vocabulary = sorted(self.postings)
+        self._unsaved = 0
+
+    def _save(self):
+        directory = os.path.dirname(self.path) or '.'
+        with file_lock(self.path):
+            if file_identity(self.path) != self._identity:
+                # Saved by another process since this one last loaded or saved it
+                saved = _read(self.path)
+                if (saved is not None and saved['generation'] == self.generation
+                        and all(saved['counts'].get(collection, 0) >= count
+                                for collection, count in self.counts.items())):
+                    self._adopt(saved)
+                    self._identity = file_identity(self.path)
+                    return
+            saved = {
+                'version': INDEX_VERSION,
+                'generation': self.generation,
+                'counts': self.counts,
+                'docs': self.docs,
+                'postings': {word: list(postings.items()) for word, postings in self.postings.items()},
+            }
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(saved, f)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            self._identity = file_identity(self.path)
+        self._unsaved = 0
+
+
+def _read(path):
+    # A saved index, or None when there is none of this version
+    try:
+        with open(path, 'r') as f:
+            saved = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return saved if saved.get('version') == INDEX_VERSION else None
+
+
+def _parse(query):
+    # ("term" | "prefix" | "phrase", words) for every part of a query
+    parts = []
+    for phrase, term in QUERY_PART.findall(query):
+        if phrase:
+            words = tokenize(phrase)
+            if words:
+                parts.append(('phrase', words))
+        elif term.endswith('*') and len(tokenize(term)) == 1:
+            parts.append(('prefix', tokenize(term)))
+        else:
+            words = tokenize(term)
+            if words:
+                # "don't" is the phrase "don t"
+                parts.append(('phrase' if len(words) > 1 else 'term', words))
+    return parts
+
+
+def _adjacent(postings, doc):
+    # Whether the words occur one right after the other somewhere in a document
+    following = [set(word_postings[doc]) for word_postings in postings[1:]]
+    return any(
+        all(first + offset in positions for offset, positions in enumerate(following, 1))
+        for first in postings[0][doc]
+    )
+
+
+def index_path(data_file):
+    """Path of the search index kept next to a data file"""
+    return os.path.splitext(data_file)[0] + '.search.json'
+
+
+_indexes = Registry()
+
+
+def open_index(data_file):
+    """Return the process-wide search index of a data file"""
+    path = os.path.abspath(index_path(data_file))
+    return _indexes.get(path, lambda: SearchIndex(path))
+
+
+def save_open_index(data_file):
+    """Save the search index of a data file, if this process has it open"""
+    path = os.path.abspath(index_path(data_file))
+    for index in _indexes.values():
+        if index.path == path:
+            index.save()
+
+
+@atexit.register
+def save_all():
+    """Save every open search index, on shutdown"""
+    for index in _indexes.values():
+        try:
+            index.save()
+        except OSError as e:
+            print(f"Search index {index.path} could not be saved: {e}", file=sys.stderr)
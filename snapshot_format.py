@@ -0,0 +1,197 @@
+"""Binary, memory-mappable snapshot of a user's data
+
+Layout: the magic bytes, the length of a JSON header, the header, then the
+data region. The header lists every collection's fixed-width columns (dates as
+int64 Unix timestamps, numbers, int32 category and text codes) with their offsets in
+the data region, the labels of each category column, and where the string heap
+lives: an int64 array of byte offsets followed by the UTF-8 bytes of every
+note, title and journal text. A reader maps the file and copies it into a
+columnar store with one array copy per column plus one decode per string, so
+loading parses no JSON records, although it still reads the whole file.
+
+There is no reader of single columns or date ranges. Every session works on
+the whole hot store: its frames, rollups and table pages. ``load_store`` builds
+that store once per change of the data and shares it through the load cache,
+and the archive keeps the file to the hot window. A page reading its window
+straight from the map would still load the whole store in the same rerun.
+
+Conversion between the snapshot and the JSON data file format:
+
+    python snapshot_format.py to-binary mental_health_data.json mental_health_data.mhts
+    python snapshot_format.py to-json mental_health_data.mhts mental_health_data.json
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+import numpy as np
+
+from columnar import SCHEMA, ColumnarStore
+from migrate import upgrade_data
+from records import SETTINGS
+
+# Keys of the data file kept with the settings: what it folded, its archive listing and generation
+SNAPSHOT_KEYS = list(SETTINGS) + ['_folded', '_archive', '_generation']
+
+MAGIC = b'MHTSNAP1'
+FORMAT_VERSION = 2
+ALIGNMENT = 8
+
+
+def write_snapshot(path, store, settings=None, source=None):
+    """Atomically write a columnar store, its settings and an optional source identity"""
+    header = {
+        'version': FORMAT_VERSION,
+        'source': source,
+        'timezone': store.timezone,
+        'settings': settings or {},
+        'custom_tags': store.custom_tags,
+        'collections': {},
+    }
+    blocks = []
+    position = 0
+
+    def place(array):
+        nonlocal position
+        array = np.ascontiguousarray(array)
+        offset = position
+        blocks.append((offset, array.tobytes()))
+        position += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        return offset
+
+    for collection, fields in SCHEMA.items():
+        columns = {}
+        for field, kind in fields.items():
+            values = store.column(collection, field)
+            column = {'dtype': values.dtype.str, 'offset': place(values)}
+            if kind == 'category':
+                column['labels'] = store.labels(collection, field)
+            columns[field] = column
+        header['collections'][collection] = {
+            'count': store.count(collection),
+            'sorted': store.is_sorted(collection),
+            'columns': columns,
+        }
+
+    encoded = [text.encode('utf-8') for text in store.strings.labels]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in encoded], out=offsets[1:])
+    header['strings'] = {
+        'count': len(encoded),
+        'offsets': place(offsets),
+        'data': place(np.frombuffer(b''.join(encoded), dtype=np.uint8)),
+    }
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes += b' ' * (-(len(MAGIC) + 8 + len(header_bytes)) % ALIGNMENT)
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes)
+            data_start = f.tell()
+            for offset, data in blocks:
+                f.seek(data_start + offset)
+                f.write(data)
+            f.truncate(data_start + position)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class Snapshot:
+    """Read-only view of a binary snapshot through a memory map"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError(f"Not a binary snapshot: {path}")
+        (header_size,) = struct.unpack_from('<Q', self._map, len(MAGIC))
+        header_start = len(MAGIC) + 8
+        self.header = json.loads(bytes(self._map[header_start:header_start + header_size]))
+        if self.header['version'] != FORMAT_VERSION:
+            self._map.close()
+            raise ValueError(f"Unsupported snapshot version: {self.header['version']}")
+        self._data_start = header_start + header_size
+        self.settings = self.header['settings']
+        self.source = self.header['source']
+        strings = self.header['strings']
+        self._string_offsets = self._array(np.int64, strings['offsets'], strings['count'] + 1)
+        self._string_data = self._data_start + strings['data']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # Views into the map must be gone before it can be closed
+        self._string_offsets = None
+        self._map.close()
+
+    def count(self, collection):
+        return self.header['collections'][collection]['count']
+
+    def column(self, collection, field):
+        """Zero-copy view of a column's stored values"""
+        meta = self.header['collections'][collection]
+        column = meta['columns'][field]
+        return self._array(np.dtype(column['dtype']), column['offset'], meta['count'])
+
+    def strings(self, codes):
+        """Decode the heap strings behind some text codes"""
+        offsets = self._string_offsets
+        return [
+            self._map[self._string_data + offsets[code]:self._string_data + offsets[code + 1]].decode('utf-8')
+            for code in codes
+        ]
+
+    def to_store(self):
+        """Copy the whole snapshot into a columnar store"""
+        store = ColumnarStore(self.header['timezone'])
+        store.strings.labels = self.strings(range(self.header['strings']['count']))
+        store.custom_tags = list(self.header['custom_tags'])
+        for collection, meta in self.header['collections'].items():
+            columns = {field: self.column(collection, field) for field in SCHEMA[collection]}
+            labels = {field: column['labels'] for field, column in meta['columns'].items()
+                      if 'labels' in column}
+            store.load_columns(collection, columns, labels, meta['sorted'])
+        return store
+
+    def _array(self, dtype, offset, count):
+        return np.frombuffer(self._map, dtype=dtype, count=count, offset=self._data_start + offset)
+
+
+def json_to_binary(json_path, snapshot_path):
+    """Convert a JSON data file into a binary snapshot"""
+    with open(json_path, 'r') as f:
+        data = upgrade_data(json.load(f))
+    settings = dict(SETTINGS)
+    # A data file converted back must still list its archive segments, or the next fold deletes them
+    settings.update({key: data[key] for key in SNAPSHOT_KEYS if key in data})
+    write_snapshot(snapshot_path, ColumnarStore.from_data(data), settings)
+
+
+def binary_to_json(snapshot_path, json_path):
+    """Convert a binary snapshot into a JSON data file"""
+    with Snapshot(snapshot_path) as snapshot:
+        data = snapshot.to_store().to_data()
+        data.update(snapshot.settings)
+    with open(json_path, 'w') as f:
+        json.dump(data, f)
+
+
+if __name__ == "__main__":
+    commands = {"to-binary": json_to_binary, "to-json": binary_to_json}
+    if len(sys.argv) != 4 or sys.argv[1] not in commands:
+        sys.exit("usage: python snapshot_format.py to-binary|to-json SOURCE TARGET")
+    commands[sys.argv[1]](sys.argv[2], sys.argv[3])
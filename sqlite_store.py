@@ -0,0 +1,290 @@
+"""SQLite storage backend for the tracker data
+
+Each record type gets its own table with an index on its date column, so the
+dashboard's "last 7 days" and "last 30 days" windows are index range scans
+instead of a pass over the whole history. ``load_store`` keeps the columnar
+copy it loaded last and reads only the rows added after it, unless the data
+was replaced meanwhile. The JSON data file stays available as an
+import/export format; an import reads its whole history, archived months and
+record log included:
+
+    python sqlite_store.py import mental_health_data.json mental_health_data.db
+    python sqlite_store.py export mental_health_data.db mental_health_data.json
+"""
+import contextlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import uuid
+
+import profiling
+from columnar import ColumnarStore
+from load_cache import load_cache
+from migrate import upgrade_record
+from record_log import open_log
+from records import COLLECTIONS, DATE_FIELDS, FIELDS, SCHEMA_VERSION, SETTINGS, empty_data, local_timezone
+from registry import Registry
+
+# Keys of the settings table that describe the stored data rather than the user's state
+SCHEMA_KEYS = ['schema_version', 'timezone']
+
+# Settings key changed by every write_snapshot, so loads can tell a rewrite from appends
+SNAPSHOT_KEY = 'snapshot_id'
+
+
+class SqliteStore:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        # Commits through this connection, which its data_version does not count
+        self._writes = 0
+
+    def load(self):
+        """Read every table back into the data file layout"""
+        data = empty_data()
+        with self._lock:
+            if not self._open(create=False):
+                return data
+            for collection, fields in FIELDS.items():
+                rows = self._conn.execute(
+                    f'SELECT {_columns(fields)} FROM {collection} ORDER BY id')
+                data[collection] = [dict(zip(fields, row)) for row in rows]
+            data['custom_tags'] = [tag for (tag,) in self._conn.execute(
+                'SELECT tag FROM custom_tags ORDER BY id')]
+            for key, value in self._conn.execute('SELECT key, value FROM settings'):
+                if key != SNAPSHOT_KEY:
+                    data[key] = json.loads(value)
+        profiling.count(rows=sum(len(data[collection]) for collection in COLLECTIONS))
+        return data
+
+    def load_store(self):
+        """Columnar store and settings of the database
+
+        The result is shared through the process-wide load cache until the
+        database changes, so it must not be modified.
+        """
+        with self._lock:
+            if not self._open(create=False):
+                return ColumnarStore(), dict(SETTINGS, _archive={}, _generation=None)
+            identity = (self._token, self._conn.execute('PRAGMA data_version').fetchone()[0], self._writes)
+            loaded = load_cache.get(self.db_path, identity, self._load_store, lambda loaded: loaded[0].nbytes())
+            return loaded[0], loaded[1]
+
+    def append(self, collection, record):
+        """Insert one record of a collection"""
+        with self._transaction():
+            self._insert(collection, [record])
+        profiling.count(rows=1)
+
+    def append_batch(self, records, sync=False):
+        """Insert (collection, record) pairs in one transaction
+
+        SQLite syncs every commit to disk by itself, so `sync` changes nothing.
+        """
+        with self._transaction():
+            for collection, record in records:
+                self._insert(collection, [record])
+        profiling.count(rows=len(records))
+
+    def append_many(self, collection, records):
+        """Insert records of a collection in one transaction"""
+        with self._transaction():
+            self._insert(collection, records)
+        profiling.count(rows=len(records))
+
+    def set_value(self, key, value):
+        """Store a new value for a single setting"""
+        with self._transaction():
+            self._conn.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+                               (key, json.dumps(value)))
+
+    def write_snapshot(self, data):
+        """Replace the stored data with a full dataset"""
+        with self._transaction():
+            for collection in COLLECTIONS:
+                self._conn.execute(f'DELETE FROM {collection}')
+                self._insert(collection, data.get(collection, []))
+            self._conn.execute('DELETE FROM settings')
+            defaults = empty_data(data.get('timezone'))
+            self._conn.executemany(
+                'INSERT INTO settings (key, value) VALUES (?, ?)',
+                [(key, json.dumps(data.get(key, defaults[key]))) for key in SCHEMA_KEYS + list(SETTINGS)]
+                + [(SNAPSHOT_KEY, json.dumps(uuid.uuid4().hex))])
+        profiling.count(rows=sum(len(data.get(collection, [])) for collection in COLLECTIONS))
+
+    def query_range(self, collection, start, end=None):
+        """Records of a collection dated after the Unix timestamp `start` and up to `end`"""
+        fields = FIELDS[collection]
+        date_field = fields[0]
+        sql = f'SELECT {_columns(fields)} FROM {collection} WHERE "{date_field}" > ?'
+        params = [start]
+        if end is not None:
+            sql += f' AND "{date_field}" <= ?'
+            params.append(end)
+        sql += f' ORDER BY "{date_field}", id'
+        with self._lock:
+            if not self._open(create=False):
+                return []
+            rows = self._conn.execute(sql, params).fetchall()
+        profiling.count(rows=len(rows))
+        return [dict(zip(fields, row)) for row in rows]
+
+    def import_json(self, json_path):
+        """Replace the stored data with the whole history of a JSON data file
+
+        Its archived months and the records still in its record log are
+        imported too.
+        """
+        self.write_snapshot(open_log(json_path).load())
+
+    def export_json(self, json_path):
+        """Write the stored data to a JSON data file"""
+        with open(json_path, 'w') as f:
+            json.dump(self.load(), f)
+
+    def is_empty(self):
+        """Whether no record of any type has been stored yet"""
+        with self._lock:
+            if not self._open(create=False):
+                return True
+            return not any(
+                self._conn.execute(f'SELECT 1 FROM {collection} LIMIT 1').fetchone()
+                for collection in COLLECTIONS)
+
+    def _open(self, create=True):
+        # The database is created on the first write, so reading a user that
+        # nobody has written for leaves no files behind; runs under the lock
+        if self._conn is None and (create or os.path.exists(self.db_path)):
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._conn = conn
+            self._token = uuid.uuid4().hex
+            self._create_tables()
+            self._migrate()
+        return self._conn is not None
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._open()
+            try:
+                with self._conn:
+                    yield
+            finally:
+                self._writes += 1
+
+    def _load_store(self):
+        # Runs under the lock; the cached value also holds the snapshot id and
+        # the last row id per collection it was loaded up to
+        settings = {key: json.loads(value)
+                    for key, value in self._conn.execute('SELECT key, value FROM settings')}
+        snapshot = settings.pop(SNAPSHOT_KEY, None)
+        previous = load_cache.peek(self.db_path)
+        if previous is not None and previous[2] == snapshot:
+            store, _, _, marks = previous
+            store = store.copy()
+        else:
+            marks = dict.fromkeys(COLLECTIONS, 0)
+            store = ColumnarStore(settings.get('timezone'))
+        marks = dict(marks)
+        tail = {}
+        for collection in COLLECTIONS:
+            fields = FIELDS.get(collection, ['tag'])
+            rows = self._conn.execute(
+                f'SELECT id, {_columns(fields)} FROM {collection} WHERE id > ? ORDER BY id',
+                (marks[collection],)).fetchall()
+            if rows:
+                marks[collection] = rows[-1][0]
+            if collection == 'custom_tags':
+                tail[collection] = [tag for _, tag in rows]
+            else:
+                tail[collection] = [dict(zip(fields, row[1:])) for row in rows]
+        store.extend(tail)
+        profiling.count(rows=sum(len(records) for records in tail.values()))
+        loaded = {key: settings.get(key, default) for key, default in SETTINGS.items()}
+        loaded['_archive'] = {}
+        # Rows keep their numbers until the next write_snapshot
+        loaded['_generation'] = snapshot
+        return store, loaded, snapshot, marks
+
+    def _create_tables(self):
+        with self._conn:
+            for collection, fields in FIELDS.items():
+                self._conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS {collection} '
+                    f'(id INTEGER PRIMARY KEY, {_columns(fields)})')
+                self._conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS {collection}_date '
+                    f'ON {collection} ("{fields[0]}")')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS custom_tags (id INTEGER PRIMARY KEY, tag)')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)')
+
+    def _migrate(self):
+        # Databases written before the schema version was recorded keep date strings
+        with self._conn:
+            if self._conn.execute(
+                    "SELECT 1 FROM settings WHERE key = 'schema_version'").fetchone():
+                return
+            timezone = local_timezone()
+            for collection, fields in DATE_FIELDS.items():
+                rows = self._conn.execute(
+                    f'SELECT id, {_columns(fields)} FROM {collection}').fetchall()
+                updates = []
+                for row in rows:
+                    record = upgrade_record(collection, dict(zip(fields, row[1:])), timezone)
+                    updates.append([record[field] for field in fields] + [row[0]])
+                assignments = ', '.join(f'"{field}" = ?' for field in fields)
+                self._conn.executemany(
+                    f'UPDATE {collection} SET {assignments} WHERE id = ?', updates)
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+                [('schema_version', json.dumps(SCHEMA_VERSION)), ('timezone', json.dumps(timezone))])
+
+    def _insert(self, collection, records):
+        if collection == 'custom_tags':
+            self._conn.executemany('INSERT INTO custom_tags (tag) VALUES (?)',
+                                   [(tag,) for tag in records])
+            return
+        fields = FIELDS[collection]
+        placeholders = ', '.join('?' for _ in fields)
+        self._conn.executemany(
+            f'INSERT INTO {collection} ({_columns(fields)}) VALUES ({placeholders})',
+            [[record.get(field) for field in fields] for record in records])
+
+
+def _columns(fields):
+    return ', '.join(f'"{field}"' for field in fields)
+
+
+_stores = Registry()
+
+
+def open_sqlite_store(db_path, import_from=None):
+    """Return the process-wide store for a database, seeding it from a JSON file when new"""
+    db_path = os.path.abspath(db_path)
+
+    def create():
+        store = SqliteStore(db_path)
+        log = open_log(import_from) if import_from else None
+        # Records may still be only in the data file's record log
+        paths = (log.snapshot_path, log.log_path, log.folding_path) if log else ()
+        if any(os.path.exists(path) for path in paths) and store.is_empty():
+            store.import_json(import_from)
+        return store
+    return _stores.get(db_path, create)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] not in ("import", "export"):
+        sys.exit("usage: python sqlite_store.py import|export SOURCE TARGET")
+    command, source, target = sys.argv[1:]
+    if command == "import":
+        SqliteStore(target).import_json(source)
+    else:
+        SqliteStore(source).export_json(target)
@@ -0,0 +1,120 @@
+"""Storage backends behind MentalHealthApp.save_data/load_data
+
+Every user's data lives in its own shard, ``<data dir>/users/<user id>/``, so
+sessions only ever read and lock their own user's files. The data directory
+defaults to ``data`` and can be moved with the MHT_DATA_DIR environment
+variable.
+
+The backend is picked with the MHT_STORAGE_BACKEND environment variable:
+"json" (default) keeps the JSON data file plus its append-only record log,
+"sqlite" keeps the data in an indexed SQLite database next to it, and
+"service" leaves the files to a local storage service (see
+``storage_service``) reached through the Unix socket named by
+MHT_STORAGE_SOCKET, by default ``storage.sock`` in the data directory. The
+service cannot read archive segments on demand, so its sessions load each
+user's whole history, archived months included.
+"""
+import contextlib
+import os
+import re
+import sqlite3
+
+from file_lock import file_lock
+from migrate import migrate_file, migrate_log, read_schema
+from record_log import open_log
+from records import local_timezone
+from search_index import open_index
+from sqlite_store import open_sqlite_store
+
+# Backends reading and writing the data files in this process
+FILE_BACKENDS = {"json", "sqlite"}
+BACKENDS = FILE_BACKENDS | {"service"}
+
+# Errors of a failed read or write, whatever the backend; the service's are OSErrors
+STORAGE_ERRORS = (OSError, ValueError, sqlite3.Error)
+
+DEFAULT_USER = "default"
+DATA_FILE_NAME = 'mental_health_data.json'
+SOCKET_NAME = 'storage.sock'
+
+USER_ID_PATTERN = re.compile(r'[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}')
+
+
+def data_dir():
+    """Directory holding every user's shard"""
+    return os.environ.get("MHT_DATA_DIR", "data")
+
+
+def service_socket(root=None):
+    """Path of the storage service's Unix socket"""
+    return os.environ.get("MHT_STORAGE_SOCKET") or os.path.join(root or data_dir(), SOCKET_NAME)
+
+
+def check_user_id(user_id):
+    if not USER_ID_PATTERN.fullmatch(user_id):
+        raise ValueError(f"Invalid user id: {user_id!r}. Use up to 64 letters, digits, '.', '_' or '-'")
+
+
+def user_data_file(user_id, root=None):
+    """Path of a user's JSON data file; the shard's directory is made by its first write"""
+    check_user_id(user_id)
+    data_file = os.path.join(root or data_dir(), 'users', user_id, DATA_FILE_NAME)
+    if user_id == DEFAULT_USER:
+        _adopt_legacy_file(data_file)
+    return data_file
+
+
+def storage_backend(backend=None):
+    """Name of the backend to use, by default the configured one"""
+    backend = (backend or os.environ.get("MHT_STORAGE_BACKEND", "json")).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Invalid storage backend: {backend}. Must be one of {BACKENDS}")
+    return backend
+
+
+def open_store(data_file, backend=None):
+    """Return the store for a data file using the configured backend"""
+    backend = storage_backend(backend)
+    if backend not in FILE_BACKENDS:
+        raise ValueError(f"Invalid storage backend for a data file: {backend}. Must be one of {FILE_BACKENDS}")
+    if backend == "sqlite":
+        db_path = os.path.splitext(data_file)[0] + '.db'
+        return open_sqlite_store(db_path, import_from=data_file)
+    return open_log(data_file)
+
+
+def open_user_store(user_id, backend=None, root=None):
+    """Return the store of one user's shard"""
+    if storage_backend(backend) == "service":
+        from storage_service import open_service_store
+        check_user_id(user_id)
+        return open_service_store(user_id, service_socket(root))
+    return open_store(user_data_file(user_id, root), backend)
+
+
+def pipeline(store):
+    """Context batching a store's writes into one round trip on backends that support it"""
+    if hasattr(store, 'pipeline'):
+        return store.pipeline()
+    return contextlib.nullcontext(store)
+
+
+def open_user_index(user_id, root=None):
+    """Return the full-text search index of one user's shard"""
+    return open_index(user_data_file(user_id, root))
+
+
+def _adopt_legacy_file(data_file):
+    # The default user starts from the old shared data file of the same name in
+    # the working directory, copied once and upgraded to the current schema on the way
+    legacy = DATA_FILE_NAME
+    if os.path.exists(data_file) or not os.path.exists(legacy):
+        return
+    with file_lock(data_file):
+        if not os.path.exists(data_file):
+            with file_lock(legacy, shared=True):
+                timezone = read_schema(legacy)[1] or local_timezone()
+                # The logs go first, so a finished data file means a finished copy
+                for suffix in ('.log.folding', '.log'):
+                    migrate_log(legacy + suffix, timezone, data_file + suffix)
+                migrate_file(legacy, data_file, timezone)
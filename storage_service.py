@@ -0,0 +1,472 @@
+"""Local storage service owning the data files of several server processes
+
+When the app runs as several Streamlit processes behind a load balancer, each
+of them reading and writing the data files races the others. The service is
+one process that owns the files instead; the app processes reach it through a
+Unix socket with MHT_STORAGE_BACKEND=service:
+
+    python storage_service.py --data-dir data
+    MHT_STORAGE_BACKEND=service streamlit run mhtall.py
+
+The protocol is one JSON object per line. A request names an operation, a
+user and the operation's arguments; the response carries its result or its
+error. Responses come back in request order, so a client may send several
+requests before reading any response (pipelining).
+
+The service keeps every opened user's data in memory. Records of concurrent
+``append_batch`` requests share a write and fsync through a group-commit
+``WriteQueue``, and are visible to loads once they are on disk. A load sends
+only the records added since the caller's last load, unless the data was
+replaced (``write_snapshot``) or the service restarted since.
+
+The service holds and sends each user's whole history, archived months
+included: it has no counterpart of ``RecordLog.load_archive``, so with this
+backend every session keeps the full history in memory.
+
+On the app side, ``ServiceStore`` has the interface of the file backends. Its
+calls borrow a connection from a per-socket pool of up to MHT_STORAGE_POOL
+(default 4) connections, and ``pipeline`` collects writes to send them in one
+round trip. Requests are sent again on a fresh connection only when sending
+them failed on a pooled one; once sent, a request may have been carried out,
+so a lost response is raised rather than risking a second append.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import uuid
+from contextlib import contextmanager
+
+import profiling
+from columnar import ColumnarStore
+from load_cache import load_cache
+from records import COLLECTIONS, FIELDS, SETTINGS
+from storage import FILE_BACKENDS, data_dir, open_user_store, service_socket, storage_backend
+from write_queue import WriteQueue
+
+DEFAULT_POOL_SIZE = 4
+
+OPERATIONS = {'load', 'append_batch', 'append_many', 'set_value', 'write_snapshot', 'query_range', 'compact',
+              'wait_for_compaction'}
+
+
+def encode(message):
+    return json.dumps(message).encode() + b'\n'
+
+
+class NotSent(ConnectionError):
+    """Requests that could not be sent, so the service has not seen them"""
+
+
+class Connection:
+    def __init__(self, path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(path)
+        except OSError as e:
+            self.socket.close()
+            raise ConnectionError(f"No storage service on {path}: {e.strerror or e}") from e
+        self.reader = self.socket.makefile('rb')
+        # Whether the connection has been used before, and may have gone stale in the pool since
+        self.reused = False
+
+    def call_many(self, requests):
+        """Send requests in one write, then read their responses in order"""
+        payload = b''.join(encode(request) for request in requests)
+        try:
+            self.socket.sendall(payload)
+        except OSError as e:
+            raise NotSent(f"Storage service connection lost: {e.strerror or e}") from e
+        responses = []
+        received = 0
+        for _ in requests:
+            line = self.reader.readline()
+            if not line:
+                raise ConnectionError("Storage service closed the connection")
+            received += len(line)
+            responses.append(json.loads(line))
+        profiling.count(bytes_read=received, bytes_written=len(payload))
+        return responses
+
+    def close(self):
+        self.reader.close()
+        self.socket.close()
+
+
+class ConnectionPool:
+    """Connections to one socket, opened on demand and kept for reuse"""
+
+    def __init__(self, path, size=None):
+        if size is None:
+            size = int(os.environ.get("MHT_STORAGE_POOL", DEFAULT_POOL_SIZE))
+        self.path = path
+        self.size = max(1, size)
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, waiting while all of them are in use"""
+        with self._slots:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                connection = Connection(self.path)
+            try:
+                yield connection
+            except BaseException:
+                # Requests may be left unanswered on it, so it is not reused
+                connection.close()
+                raise
+            connection.reused = True
+            with self._lock:
+                self._idle.append(connection)
+
+    def call_many(self, requests):
+        """Responses to requests sent together on one connection"""
+        reused = False
+        try:
+            with self.connection() as connection:
+                reused = connection.reused
+                return connection.call_many(requests)
+        except NotSent:
+            if not reused:
+                raise
+        # Idle connections may have been closed by a restarted service; a new one is not
+        self.close()
+        with self.connection() as connection:
+            return connection.call_many(requests)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+def result(response):
+    """Result of a response, raising the error the service reported"""
+    if 'error' not in response:
+        return response['result']
+    if response['type'] == 'ValueError':
+        raise ValueError(response['error'])
+    raise OSError(f"Storage service error: {response['type']}: {response['error']}")
+
+
+class StoreCalls:
+    """Writes of the store interface as service requests; subclasses send them"""
+
+    def append(self, collection, record):
+        """Append one record of a collection"""
+        return self.request('append_batch', records=[[collection, record]])
+
+    def append_batch(self, records, sync=False):
+        """Append (collection, record) pairs together
+
+        The service commits every batch to disk before answering, sharing the
+        write with concurrent batches, so `sync` changes nothing.
+        """
+        return self.request('append_batch', records=[list(pair) for pair in records])
+
+    def append_many(self, collection, records):
+        """Append records of a collection in one write"""
+        return self.request('append_many', collection=collection, records=list(records))
+
+    def set_value(self, key, value):
+        """Store a new value for a single setting"""
+        return self.request('set_value', key=key, value=value)
+
+
+class Pipeline(StoreCalls):
+    """Writes collected and sent in one round trip when the block ends"""
+
+    def __init__(self, store):
+        self.store = store
+        self.requests = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None and self.requests:
+            self.store.call_many(self.requests)
+        return False
+
+    def request(self, operation, **args):
+        self.requests.append(self.store.message(operation, args))
+
+
+class ServiceStore(StoreCalls):
+    """Store of one user whose files the storage service owns"""
+
+    def __init__(self, user_id, pool):
+        self.user_id = user_id
+        self.pool = pool
+
+    def load(self):
+        """The user's whole dataset"""
+        loaded = self.request('load')
+        data = dict(loaded['settings'])
+        data.update(loaded['records'])
+        profiling.count(rows=sum(len(records) for records in loaded['records'].values()))
+        return data
+
+    def load_store(self):
+        """Columnar store and settings of the user's data, fetching only the records added since the last call
+
+        The result is shared through the process-wide load cache, so it must
+        not be modified.
+        """
+        key = (self.pool.path, self.user_id)
+        # The cached value also holds the service epoch it was loaded in
+        previous = load_cache.peek(key)
+        epoch = counts = None
+        if previous is not None:
+            epoch = previous[2]
+            counts = {collection: previous[0].count(collection) for collection in COLLECTIONS}
+        loaded = self.request('load', epoch=epoch, counts=counts)
+        records = loaded['records']
+        if previous is None or loaded['full']:
+            store = ColumnarStore(loaded['settings'].get('timezone'))
+            store.extend(records)
+        elif any(records.values()):
+            store = previous[0].copy()
+            store.extend(records)
+        else:
+            store = previous[0]
+        settings = {key: loaded['settings'].get(key, default) for key, default in SETTINGS.items()}
+        settings['_archive'] = {}
+        # Records keep their numbers as long as the service keeps its epoch
+        settings['_generation'] = loaded['epoch']
+        load_cache.put(key, loaded['epoch'], (store, settings, loaded['epoch']), store.nbytes())
+        profiling.count(rows=sum(len(collection) for collection in records.values()))
+        return store, settings
+
+    def write_snapshot(self, data):
+        """Replace the stored data with a full dataset"""
+        self.request('write_snapshot', data=data)
+
+    def query_range(self, collection, start, end=None):
+        """Records of a collection dated after the Unix timestamp `start` and up to `end`"""
+        records = self.request('query_range', collection=collection, start=start, end=end)
+        profiling.count(rows=len(records))
+        return records
+
+    def compact(self, background=True):
+        """Fold the record log into the data file, on a thread of the service by default"""
+        self.request('compact', background=background)
+
+    def wait_for_compaction(self):
+        self.request('wait_for_compaction')
+
+    def pipeline(self):
+        """Context collecting writes to send them in one round trip"""
+        return Pipeline(self)
+
+    def message(self, operation, args):
+        return {'op': operation, 'user': self.user_id, 'args': args}
+
+    def request(self, operation, **args):
+        return self.call_many([self.message(operation, args)])[0]
+
+    def call_many(self, requests):
+        """Results of requests sent together, raising the first error"""
+        return [result(response) for response in self.pool.call_many(requests)]
+
+
+_pools = {}
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_service_store(user_id, path):
+    """Return the process-wide store of a user served on a socket"""
+    path = os.path.abspath(path)
+    with _stores_lock:
+        if path not in _pools:
+            _pools[path] = ConnectionPool(path)
+        if (path, user_id) not in _stores:
+            _stores[(path, user_id)] = ServiceStore(user_id, _pools[path])
+        return _stores[(path, user_id)]
+
+
+class Shard:
+    """A user's store and in-memory data inside the service"""
+
+    def __init__(self, store):
+        self.store = store
+        # Every append is committed before it is answered, sharing the fsync with concurrent ones
+        self.queue = WriteQueue(store, mode="group")
+        self.data = store.load()
+        self.epoch = uuid.uuid4().hex
+        self._lock = threading.Lock()
+
+    def load(self, epoch=None, counts=None):
+        """Records added after `counts`, or all of them when `epoch` is not the current one"""
+        counts = counts or {}
+        with self._lock:
+            full = epoch != self.epoch
+            records = {collection: self.data[collection][0 if full else counts.get(collection, 0):]
+                       for collection in COLLECTIONS}
+            settings = {key: value for key, value in self.data.items() if key not in COLLECTIONS}
+            return {'epoch': self.epoch, 'full': full, 'records': records, 'settings': settings}
+
+    def append_batch(self, records):
+        records = [(collection, record) for collection, record in records]
+        for collection, _ in records:
+            if collection not in COLLECTIONS:
+                raise ValueError(f"Invalid collection: {collection}. Must be one of {set(COLLECTIONS)}")
+        self.queue.put_many(records)
+        with self._lock:
+            for collection, record in records:
+                self.data[collection].append(record)
+
+    def append_many(self, collection, records):
+        if collection not in COLLECTIONS:
+            raise ValueError(f"Invalid collection: {collection}. Must be one of {set(COLLECTIONS)}")
+        self.store.append_many(collection, records)
+        with self._lock:
+            self.data[collection].extend(records)
+
+    def set_value(self, key, value):
+        self.store.set_value(key, value)
+        with self._lock:
+            self.data[key] = value
+
+    def write_snapshot(self, data):
+        self.queue.flush()
+        self.store.write_snapshot(data)
+        loaded = self.store.load()
+        with self._lock:
+            self.data = loaded
+            self.epoch = uuid.uuid4().hex
+
+    def query_range(self, collection, start, end=None):
+        if collection not in FIELDS:
+            raise ValueError(f"Invalid collection: {collection}. Must be one of {set(FIELDS)}")
+        if hasattr(self.store, 'query_range'):
+            return self.store.query_range(collection, start, end)
+        date_field = FIELDS[collection][0]
+        with self._lock:
+            records = [record for record in self.data[collection]
+                       if record[date_field] > start and (end is None or record[date_field] <= end)]
+        return sorted(records, key=lambda record: record[date_field])
+
+    def compact(self, background=True):
+        if hasattr(self.store, 'compact'):
+            self.store.compact(background)
+
+    def wait_for_compaction(self):
+        if hasattr(self.store, 'wait_for_compaction'):
+            self.store.wait_for_compaction()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            self.wfile.write(encode(self.server.respond(line)))
+
+
+class StorageService(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, root=None, backend=None):
+        backend = storage_backend(backend)
+        if backend not in FILE_BACKENDS:
+            # The service itself always works on the files
+            backend = "json"
+        self.root = root
+        self.backend = backend
+        self._shards = {}
+        self._shards_lock = threading.Lock()
+        remove_stale_socket(path)
+        super().__init__(path, RequestHandler)
+        # Only the owner's processes may talk to the service
+        os.chmod(path, 0o600)
+
+    def shard(self, user_id):
+        """The shard of a user, opened on first use"""
+        with self._shards_lock:
+            if user_id not in self._shards:
+                self._shards[user_id] = Shard(open_user_store(user_id, self.backend, self.root))
+            return self._shards[user_id]
+
+    def respond(self, line):
+        """Response to one request line"""
+        try:
+            request = json.loads(line)
+            operation = request.get('op')
+            if operation not in OPERATIONS:
+                raise ValueError(f"Invalid operation: {operation}. Must be one of {OPERATIONS}")
+            shard = self.shard(request.get('user', ''))
+            return {'result': getattr(shard, operation)(**request.get('args', {}))}
+        except Exception as e:
+            return {'error': str(e), 'type': type(e).__name__}
+
+    def server_close(self):
+        super().server_close()
+        with self._shards_lock:
+            shards = list(self._shards.values())
+        for shard in shards:
+            shard.queue.flush()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def remove_stale_socket(path):
+    """Remove the socket file of a service that is gone; refuse to replace a running one"""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.remove(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(f"A storage service is already running on {path}")
+
+
+def start_service(path, root=None, backend=None):
+    """Run a service on a background thread of this process; stop it with `shutdown` and `server_close`"""
+    service = StorageService(path, root, backend)
+    threading.Thread(target=service.serve_forever, daemon=True).start()
+    return service
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the data files to app processes over a Unix socket.")
+    parser.add_argument("--data-dir", default=None, help="data directory (default: MHT_DATA_DIR or ./data)")
+    parser.add_argument("--socket", default=None, help="socket path (default: MHT_STORAGE_SOCKET or "
+                                                       "storage.sock in the data directory)")
+    parser.add_argument("--backend", choices=sorted(FILE_BACKENDS), default=None,
+                        help="file backend (default: MHT_STORAGE_BACKEND or json)")
+    args = parser.parse_args(argv)
+
+    path = args.socket or service_socket(args.data_dir)
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        service = StorageService(path, args.data_dir, args.backend)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    # A terminated service still flushes its queues and removes its socket
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"Serving {args.data_dir or data_dir()} on {path}", file=sys.stderr)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
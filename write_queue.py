@@ -0,0 +1,184 @@
+"""Write-behind queue between logged records and the storage backend
+
+Logging a record puts it on its store's queue; a background writer takes
+everything queued, waits one commit interval for the rest of a burst, and
+commits it all with a single write and fsync. How long a save waits for its
+record to reach the disk is set with the MHT_DURABILITY environment variable:
+
+    async   (default) the save returns once the record is queued; the writer
+            commits it within one interval
+    group   the save waits for the writer's next commit, which it shares with
+            every other record queued meanwhile
+    sync    the save writes and syncs its record itself, bypassing the queue
+
+The interval is MHT_COMMIT_INTERVAL_MS milliseconds (default 10). Queued
+records are flushed when the process exits, and ``flush`` commits them on
+demand. The records of a failed async commit stay queued and are tried again
+every RETRY_SECONDS; ``error`` tells whether some are waiting for that, and
+``flush`` raises the error when they still cannot be written. A writer with
+nothing to do for IDLE_SECONDS exits, and the next queued record starts
+another.
+"""
+import atexit
+import os
+import sys
+import threading
+import time
+import weakref
+
+DURABILITY_MODES = {"sync", "group", "async"}
+DEFAULT_MODE = "async"
+DEFAULT_INTERVAL_MS = 10
+
+RETRY_SECONDS = 1.0
+IDLE_SECONDS = 60.0
+
+
+class Commit:
+    """Completion of one queued record"""
+
+    def __init__(self):
+        self.error = None
+        self._done = threading.Event()
+
+    def wait(self):
+        """Block until the record is on disk; raises the error of a failed commit"""
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+
+    def finish(self, error=None):
+        self.error = error
+        self._done.set()
+
+
+class WriteQueue:
+    def __init__(self, store, mode=None, interval=None):
+        mode = (mode or os.environ.get("MHT_DURABILITY", DEFAULT_MODE)).lower()
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f"Invalid durability mode: {mode}. Must be one of {DURABILITY_MODES}")
+        if interval is None:
+            interval = float(os.environ.get("MHT_COMMIT_INTERVAL_MS", DEFAULT_INTERVAL_MS)) / 1000
+        self.store = store
+        self.mode = mode
+        self.interval = interval
+        self._queue = []
+        # Records of the commit being written
+        self._in_flight = []
+        self._flushing = False
+        # Commits started so far, and the number of the last one that failed
+        self._attempts = 0
+        self._failed = 0
+        self._error = None
+        self._condition = threading.Condition()
+        self._writer = None
+
+    def put(self, collection, record):
+        """Queue a record; returns whether it is on disk already rather than only queued"""
+        return self.put_many([(collection, record)])
+
+    def put_many(self, records):
+        """Queue (collection, record) pairs; returns whether they are on disk already"""
+        if self.mode == "sync":
+            self.store.append_batch(records, sync=True)
+            return True
+        commits = [Commit() for _ in records]
+        with self._condition:
+            self._queue.extend((collection, record, commit)
+                               for (collection, record), commit in zip(records, commits))
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, daemon=True)
+                self._writer.start()
+            self._condition.notify_all()
+        if self.mode == "async":
+            return False
+        for commit in commits:
+            commit.wait()
+        return True
+
+    def error(self):
+        """Error of the failed commit whose records are queued to be tried again, if any"""
+        with self._condition:
+            return self._error if self._queue or self._in_flight else None
+
+    def queued(self):
+        """(collection, record) pairs not on disk yet, in the order they were queued"""
+        with self._condition:
+            return [(collection, record) for collection, record, _ in self._in_flight + self._queue]
+
+    def flush(self):
+        """Commit every queued record now and wait until they are on disk
+
+        Raises the error of a commit that failed meanwhile; its records stay
+        queued for the writer to try again.
+        """
+        with self._condition:
+            started = self._attempts
+            # A commit started before the flush may not hold every record yet
+            while (self._queue or self._in_flight) and self._failed <= started:
+                if self._queue and not self._flushing:
+                    self._flushing = True
+                    self._condition.notify_all()
+                self._condition.wait()
+            if self._failed > started and self._queue:
+                raise self._error
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._condition.wait_for(lambda: self._queue, IDLE_SECONDS):
+                    self._writer = None
+                    return
+                # The rest of a burst joins the same commit; a failed one is retried after a pause
+                delay = RETRY_SECONDS if self._error is not None else self.interval
+                deadline = time.monotonic() + delay
+                while not self._flushing and time.monotonic() < deadline:
+                    self._condition.wait(deadline - time.monotonic())
+                self._flushing = False
+                batch, self._queue = self._queue, []
+                self._in_flight = batch
+                self._attempts += 1
+                attempt = self._attempts
+            error = None
+            try:
+                self.store.append_batch([(collection, record) for collection, record, _ in batch], sync=True)
+            except Exception as e:
+                error = e
+            with self._condition:
+                self._in_flight = []
+                self._error = error
+                if error is not None:
+                    self._failed = attempt
+                    if self.mode == "async":
+                        # Nobody waits for these records, so they are kept for another try
+                        self._queue[:0] = batch
+                self._condition.notify_all()
+            if error is None or self.mode != "async":
+                for _, _, commit in batch:
+                    commit.finish(error)
+
+
+# A queue is dropped once neither a writer nor a caller holds it
+_queues = weakref.WeakValueDictionary()
+_queues_lock = threading.Lock()
+
+
+def open_queue(store):
+    """Return the process-wide write queue of a store"""
+    with _queues_lock:
+        queue = _queues.get(store)
+        if queue is None:
+            queue = _queues[store] = WriteQueue(store)
+        return queue
+
+
+@atexit.register
+def flush_all():
+    """Commit the queued records of every store, on shutdown"""
+    with _queues_lock:
+        queues = list(_queues.values())
+    for queue in queues:
+        try:
+            queue.flush()
+        except Exception as e:
+            print(f"{len(queue.queued())} queued records could not be saved: {e}", file=sys.stderr)